@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+from .fixtures import IdealistaStubApi, IdealistaStubWeb, IdealistaSyntheticData
+
+# Directorio 'src', con los datos y los modelos del proyecto
+SRC_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_PATH = os.path.join(SRC_PATH, 'data')
+MODELS_PATH = os.path.join(SRC_PATH, 'models')
+
+@pytest.fixture
+def synthetic():
+    return IdealistaSyntheticData(seed=42)
+
+@pytest.fixture
+def stub_api():
+    stub = IdealistaStubApi(total_items=120, latency=0.0)
+    yield stub
+    stub.stop()
+
+@pytest.fixture
+def stub_web():
+    stub = IdealistaStubWeb(latency=0.0, padding_kb=1)
+    yield stub
+    stub.stop()
@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+'''
+Datos sintéticos y servidores HTTP locales que usan los tests y los benchmarks (utils.idealistabenchmark)
+para probar las herramientas del proyecto sin credenciales ni acceso a internet.
+'''
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+from utils.idealistatools import IdealistaImputer
+
+def fillna_hierarchy_iterrows(idealista_df, column, aggregator):
+    '''
+    Implementación original de 'fillna_floor'/'fillna_haslift' (un recorrido con iterrows y tres
+    filtros sobre todo el DataFrame por cada nulo). Se conserva como referencia para los tests y el benchmark.
+    '''
+    df_nan = idealista_df.loc[idealista_df[column].isna(),:]
+    for index, row in df_nan.iterrows():
+        new_value = np.nan
+        for keys in IdealistaImputer.niveles_defecto:
+            mask = idealista_df[column].notnull()
+            for key in keys:
+                mask = mask & (idealista_df[key] == row[key])
+            aux = idealista_df.loc[mask, column]
+            if aux.shape[0] > 0:
+                new_value = aux.mean() if aggregator == 'mean' else aux.mode()[0]
+                break
+        idealista_df.at[index, column] = new_value
+
+class IdealistaSyntheticData:
+    '''
+    Clase que genera DataFrames sintéticos con el esquema de 'idealista_madrid.csv' para probar las herramientas
+    del proyecto y medir su rendimiento con volúmenes mayores que el dataset de Madrid.
+    '''
+
+    tipos_propiedad = ["flat", "chalet", "penthouse", "duplex", "studio"]
+    probs_tipos_propiedad = [0.82, 0.08, 0.045, 0.035, 0.02]
+    estados = ["good", "renew", "newdevelopment"]
+    probs_estados = [0.76, 0.18, 0.06]
+    plantas = ["1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "bj", "en", "ss", "st", "-1"]
+
+    def __init__(self, seed = 42, debug = False):
+        '''
+        Constructor
+        Parametros:
+            seed: semilla del generador de números aleatorios
+            debug: si vale True muestra mensajes de debug
+        '''
+        self.__seed = seed
+        self.__debug = debug
+
+    def listings(self, n_rows, nan_fraction = 0.1, n_distritos = 21, barrios_por_distrito = 6):
+        '''
+        Genera un DataFrame de viviendas con las columnas principales de 'idealista_madrid.csv'.
+
+        Parametros:
+        * n_rows: número de viviendas a generar
+        * nan_fraction: proporción de nulos en 'floor' y 'hasLift'
+        * n_distritos: número de distritos
+        * barrios_por_distrito: número de barrios de cada distrito
+        Resultado:
+        * El DataFrame generado
+        '''
+        rng = np.random.default_rng(self.__seed)
+
+        coddistrit = rng.integers(1, n_distritos + 1, n_rows)
+        nrobarrio = rng.integers(1, barrios_por_distrito + 1, n_rows)
+        codbar = (coddistrit * 10 + nrobarrio).astype('float64')
+        codbarrio = pd.Series(coddistrit.astype(str)) + "-" + pd.Series(nrobarrio.astype(str))
+
+        size = np.round(rng.lognormal(4.5, 0.5, n_rows), 1)
+        price_by_area = rng.integers(1500, 9000, n_rows)
+        floor = rng.choice(self.plantas, n_rows).astype(object)
+        floor[rng.random(n_rows) < nan_fraction] = np.nan
+        has_lift = rng.choice([0.0, 1.0], n_rows, p=[0.2, 0.8])
+        has_lift[rng.random(n_rows) < nan_fraction] = np.nan
+
+        idealista_df = pd.DataFrame({
+            "propertyCode": np.arange(90000000, 90000000 + n_rows),
+            "floor": floor,
+            "price": (size * price_by_area).astype('int64'),
+            "propertyType": rng.choice(self.tipos_propiedad, n_rows, p=self.probs_tipos_propiedad),
+            "size": size,
+            "exterior": rng.random(n_rows) < 0.8,
+            "rooms": rng.integers(0, 7, n_rows),
+            "bathrooms": rng.integers(1, 5, n_rows),
+            "latitude": rng.uniform(40.33, 40.52, n_rows),
+            "longitude": rng.uniform(-3.81, -3.58, n_rows),
+            "distance": rng.integers(0, 20000, n_rows),
+            "status": rng.choice(self.estados, n_rows, p=self.probs_estados),
+            "newDevelopment": rng.random(n_rows) < 0.06,
+            "hasLift": has_lift,
+            "priceByArea": price_by_area,
+            "hasParkingSpace": rng.random(n_rows) < 0.3,
+            "codbar": codbar,
+            "coddistrit": coddistrit.astype('float64'),
+            "codbarrio": codbarrio,
+        })
+        if self.__debug:
+            print("Generadas", n_rows, "viviendas sintéticas")
+
+        return idealista_df
+
+    def api_elements(self, n_rows, nan_fraction = 0.1):
+        '''
+        Genera viviendas con el formato de 'elementList' de la API de Idealista (lo que graba
+        Idealista.elementlist_tojson): 'propertyCode' como texto y 'detailedType'/'parkingSpace' como diccionarios.
+
+        Parametros:
+        * n_rows: número de viviendas a generar
+        * nan_fraction: proporción de nulos en 'floor' y 'hasLift'
+        Resultado:
+        * Lista de diccionarios
+        '''
+        idealista_df = self.listings(n_rows, nan_fraction=nan_fraction)
+        idealista_df["propertyCode"] = idealista_df["propertyCode"].astype(str)
+        idealista_df["detailedType"] = [{"typology": tipo} for tipo in idealista_df["propertyType"]]
+        incluido = np.random.default_rng(self.__seed).random(n_rows) < 0.5
+        idealista_df["parkingSpace"] = [{"hasParkingSpace": True, "isParkingSpaceIncludedInPrice": bool(en_precio)}
+                                        if tiene else None
+                                        for tiene, en_precio in zip(idealista_df["hasParkingSpace"], incluido)]
+        idealista_df = idealista_df.drop(columns=["hasParkingSpace", "codbar", "coddistrit", "codbarrio"])
+
+        return [{clave: valor for clave, valor in fila.items() if not (isinstance(valor, float) and np.isnan(valor))
+                 and valor is not None} for fila in idealista_df.to_dict(orient='records')]
+
+    def barrios(self, nx = 14, ny = 9, vertices_per_edge = 25):
+        '''
+        Genera polígonos sintéticos de barrios que teselan el área de Madrid: una rejilla de cuadriláteros con
+        los vértices desplazados aleatoriamente y los lados subdivididos para tener un número de vértices realista.
+
+        Parametros:
+        * nx, ny: número de barrios en cada eje
+        * vertices_per_edge: número de vértices de cada lado de un barrio
+        Resultado:
+        * Tupla (polygons, attributes) con el formato de IdealistaSpatialJoin.load_polygons
+        '''
+        rng = np.random.default_rng(self.__seed)
+        xs = np.linspace(-3.81, -3.58, nx + 1)
+        ys = np.linspace(40.33, 40.52, ny + 1)
+        vx, vy = np.meshgrid(xs, ys, indexing='ij')
+        vx[1:-1, 1:-1] += rng.uniform(-0.3, 0.3, (nx - 1, ny - 1)) * (xs[1] - xs[0])
+        vy[1:-1, 1:-1] += rng.uniform(-0.3, 0.3, (nx - 1, ny - 1)) * (ys[1] - ys[0])
+
+        t = np.linspace(0, 1, vertices_per_edge, endpoint=False)[:, np.newaxis]
+        polygons, filas = [], []
+        for i in range(nx):
+            for j in range(ny):
+                esquinas = np.array([[vx[i, j], vy[i, j]], [vx[i + 1, j], vy[i + 1, j]],
+                                     [vx[i + 1, j + 1], vy[i + 1, j + 1]], [vx[i, j + 1], vy[i, j + 1]]])
+                ring = np.vstack([a + t * (b - a) for a, b in zip(esquinas, np.roll(esquinas, -1, axis=0))])
+                polygons.append([ring])
+                coddistrit = (i * ny + j) // 6 + 1
+                codbar = coddistrit * 10 + (i * ny + j) % 6 + 1
+                filas.append({"codbar": float(codbar), "coddistrit": float(coddistrit),
+                              "barrio": "Barrio " + str(codbar), "distrito": "Distrito " + str(coddistrit)})
+
+        return polygons, pd.DataFrame(filas)
+
+class IdealistaStubApi:
+    '''
+    Servidor HTTP local que imita los endpoints de token y search de la API de Idealista.
+    Permite probar y medir el crawler sin credenciales ni acceso a internet.
+    '''
+
+    def __init__(self, total_items = 500, latency = 0.05, error_rate = 0.0, token_requests = None, schedule = None,
+                 seed = 42):
+        '''
+        Constructor
+        Parametros:
+            total_items: número de viviendas que devuelve cada búsqueda
+            latency: segundos que tarda el servidor en responder cada búsqueda
+            error_rate: proporción de búsquedas que responden con un 429
+            token_requests: número de búsquedas tras las que caduca el token (None: no caduca)
+            schedule: lista de códigos HTTP con los que responden las primeras búsquedas, en orden (p. ej. [429, 401]).
+              Un 200 responde normalmente. Cuando se agota la lista, las búsquedas responden normalmente
+            seed: semilla para generar las viviendas y los errores
+        '''
+        self.total_items = total_items
+        self.latency = latency
+        self.error_rate = error_rate
+        self.token_requests = token_requests
+        self.schedule = [] if schedule is None else list(schedule)
+        self.searched_pages = []
+        self.search_requests = 0
+        self.token_count = 0
+        self.__rng = np.random.default_rng(seed)
+        self.__lock = threading.Lock()
+        self.__server = None
+        self.__token = None
+        self.__token_uses = 0
+
+    def token_response(self):
+        '''
+        Genera un nuevo token y devuelve el JSON de respuesta del endpoint de token.
+        '''
+        with self.__lock:
+            self.token_count += 1
+            self.__token = "stub-token-" + str(self.token_count)
+            self.__token_uses = 0
+            return {"access_token": self.__token, "token_type": "bearer", "expires_in": 43199}
+
+    def search_response(self, token, query):
+        '''
+        Devuelve (código HTTP, JSON) de una búsqueda.
+
+        Parametros:
+        * token: token recibido en la cabecera Authorization
+        * query: diccionario con los parámetros de la url (resultado de parse_qs)
+        '''
+        with self.__lock:
+            self.search_requests += 1
+            codigo = self.schedule.pop(0) if self.schedule else 200
+            if codigo != 200:
+                return codigo, {"error": "scheduled_" + str(codigo)}
+            if token != self.__token or (self.token_requests is not None and self.__token_uses >= self.token_requests):
+                return 401, {"error": "invalid_token"}
+            self.__token_uses += 1
+            if self.__rng.random() < self.error_rate:
+                return 429, {"error": "too_many_requests"}
+
+        time.sleep(self.latency)
+        num_page = int(query.get("numPage", ["1"])[0])
+        max_items = int(query.get("maxItems", ["50"])[0])
+        with self.__lock:
+            self.searched_pages.append((max_items, num_page))
+        total_pages = -(-self.total_items // max_items)
+        primero = (num_page - 1) * max_items
+        elementos = [{"propertyCode": str(90000000 + i), "price": 100000.0 + i, "numPage": num_page}
+                     for i in range(primero, min(primero + max_items, self.total_items))]
+        return 200, {"elementList": elementos, "total": self.total_items, "totalPages": total_pages,
+                     "actualPage": num_page, "itemsPerPage": max_items}
+
+    def start(self):
+        '''
+        Arranca el servidor en un hilo en segundo plano.
+
+        Resultado:
+        * Tupla (url_token, url_search) para pasar a Idealista o IdealistaCrawler
+        '''
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                longitud = int(self.headers.get("Content-Length") or 0)
+                if longitud:
+                    self.rfile.read(longitud)
+                url = urlparse(self.path)
+                if url.path == "/oauth/token":
+                    codigo, cuerpo = 200, stub.token_response()
+                else:
+                    token = self.headers.get("Authorization", "").replace("Bearer ", "")
+                    codigo, cuerpo = stub.search_response(token, parse_qs(url.query))
+                datos = json.dumps(cuerpo).encode("utf-8")
+                self.send_response(codigo)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(datos)))
+                self.end_headers()
+                self.wfile.write(datos)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.__server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.__server.serve_forever, daemon=True).start()
+        url_base = "http://127.0.0.1:" + str(self.__server.server_address[1])
+
+        return url_base + "/oauth/token", url_base + "/3.5/es/search?"
+
+    def stop(self):
+        '''
+        Para el servidor (si se ha arrancado).
+        '''
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__server = None
+
+class IdealistaStubWeb:
+    '''
+    Servidor HTTP local que sirve anuncios sintéticos con la estructura html de los anuncios del portal de Idealista.
+    Responde con ETag y devuelve 304 a las peticiones condicionales de páginas que no han cambiado.
+    '''
+
+    def __init__(self, latency = 0.05, padding_kb = 200, seed = 42):
+        '''
+        Constructor
+        Parametros:
+            latency: segundos que tarda el servidor en responder cada anuncio
+            padding_kb: kilobytes de html de relleno de cada anuncio (los anuncios reales pesan varios cientos de KB)
+            seed: semilla para generar los anuncios
+        '''
+        self.latency = latency
+        self.padding_kb = padding_kb
+        self.requests = 0
+        self.not_modified = 0
+        self.__seed = seed
+        self.__lock = threading.Lock()
+        self.__server = None
+
+    def advertisement(self, numero):
+        '''
+        Devuelve (html, ETag) del anuncio indicado.
+        '''
+        rng = np.random.default_rng(self.__seed + numero)
+        size = int(rng.integers(40, 200))
+        price_by_area = int(rng.integers(2000, 9000))
+        relleno = '<div class="filler"><p>Lorem ipsum dolor sit amet</p><a href="#">enlace</a></div>\n' * \
+            (self.padding_kb * 1024 // 80)
+        html = (
+            '<html><head><title>Anuncio ' + str(numero) + '</title></head><body>' + relleno +
+            '<span class="info-data-price"><span>' + format(size * price_by_area, ',').replace(',', '.') + '</span> €</span>'
+            '<div class="details-property_features"><ul><li>' + str(size) + ' m² construidos</li>'
+            '<li>' + str(int(rng.integers(1, 6))) + ' habitaciones</li><li>' + str(int(rng.integers(1, 4))) + ' baños</li></ul></div>'
+            '<p class="flex-feature squaredmeterprice"><span>Precio del m²</span><span>' +
+            format(price_by_area, ',').replace(',', '.') + ' €/m²</span></p>' + relleno +
+            '<div id="headerMap"><ul><li>Calle Falsa</li><li>\nBarrio Delicias</li><li>\nDistrito Arganzuela</li></ul></div>'
+            '</body></html>').encode('utf-8')
+
+        return html, '"' + str(self.__seed) + '-' + str(numero) + '"'
+
+    def get_response(self, numero, if_none_match):
+        '''
+        Devuelve (código HTTP, html, ETag) de una petición de un anuncio.
+
+        Parametros:
+        * numero: número del anuncio
+        * if_none_match: valor de la cabecera If-None-Match de la petición (None si no la tiene)
+        '''
+        with self.__lock:
+            self.requests += 1
+        time.sleep(self.latency)
+        html, etag = self.advertisement(numero)
+        if if_none_match == etag:
+            with self.__lock:
+                self.not_modified += 1
+            return 304, b'', etag
+
+        return 200, html, etag
+
+    def start(self):
+        '''
+        Arranca el servidor en un hilo en segundo plano.
+
+        Resultado:
+        * Url base de los anuncios (se les añade el número de anuncio)
+        '''
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                numero = self.path.rstrip('/').split('/')[-1]
+                if not numero.isdigit():
+                    codigo, html, etag = 404, b'', '""'
+                else:
+                    codigo, html, etag = stub.get_response(int(numero), self.headers.get("If-None-Match"))
+                self.send_response(codigo)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(html)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(html)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.__server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.__server.serve_forever, daemon=True).start()
+
+        return "http://127.0.0.1:" + str(self.__server.server_address[1]) + "/inmueble/"
+
+    def stop(self):
+        '''
+        Para el servidor (si se ha arrancado).
+        '''
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__server = None
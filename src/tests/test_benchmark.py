@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pandas as pd
+
+from utils.idealistabenchmark import IdealistaBenchmark
+from utils.idealistaprofile import IdealistaProfiler
+from utils.idealistatools import IdealistaFeatureEngineering
+
+def test_compare_flags_slower_stages(tmp_path):
+    baseline = tmp_path / "baseline.json"
+    with open(baseline, 'w') as outfile:
+        json.dump({"stages": [{"stage": "imputation", "rows": 1000, "seconds": 1.0},
+                              {"stage": "encoding", "rows": 1000, "seconds": 1.0}]}, outfile)
+    stages = pd.DataFrame([{"stage": "imputation", "rows": 1000, "seconds": 1.2},
+                           {"stage": "encoding", "rows": 1000, "seconds": 2.0}])
+
+    comparacion = IdealistaBenchmark().compare(stages, str(baseline), tolerance=1.5)
+
+    assert comparacion.set_index("stage")["regression"].to_dict() == {"imputation": False, "encoding": True}
+
+def test_suite_records_every_stage(tmp_path):
+    output = tmp_path / "suite.json"
+    etapas_df, metodos_df = IdealistaBenchmark().suite(sizes=(200,), repeats=1, models_path=str(tmp_path),
+                                                       output=str(output))
+
+    assert list(etapas_df["stage"]) == ["ingestion", "cleaning", "imputation", "encoding", "distance"]
+    assert (etapas_df["seconds"] > 0).all()
+    assert "IdealistaImputer.fit_transform" in set(metodos_df["name"])
+    with open(output) as infile:
+        assert len(json.load(infile)["stages"]) == etapas_df.shape[0]
+
+def test_profiler_counts_calls_and_restores_methods(synthetic):
+    original = IdealistaFeatureEngineering.floors_2_number
+    floor = synthetic.listings(100)["floor"]
+    with IdealistaProfiler().instrument(IdealistaFeatureEngineering, methods=["floors_2_number"]) as profiler:
+        for _ in range(3):
+            IdealistaFeatureEngineering().floors_2_number(floor)
+
+    stats = profiler.stats().set_index("name")
+    assert stats.at["IdealistaFeatureEngineering.floors_2_number", "calls"] == 3
+    assert IdealistaFeatureEngineering.floors_2_number is original
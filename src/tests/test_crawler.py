@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+
+from utils.idealistacrawler import IdealistaCrawler
+
+def elementos(ficheros):
+    codigos = []
+    for fichero in ficheros:
+        with open(fichero) as infile:
+            codigos.extend(elemento["propertyCode"] for elemento in json.load(infile))
+    return codigos
+
+def crawler(stub_urls, output_dir, max_retries = 3):
+    url_token, url_search = stub_urls
+    return IdealistaCrawler(api_key="key", api_secret="secret", output_dir=str(output_dir), max_workers=1,
+                            requests_per_second=1000, max_retries=max_retries, backoff_factor=0,
+                            url_token=url_token, url_search=url_search)
+
+def test_retries_429_and_regenerates_token_on_401(stub_api, tmp_path):
+    stub_api.schedule = [200, 429, 401, 429]
+    stub_urls = stub_api.start()
+
+    ficheros = crawler(stub_urls, tmp_path).crawl([('40.44,-3.71', 20000)], maxItems='20')
+
+    assert len(ficheros) == 6
+    assert sorted(elementos(ficheros)) == sorted(str(90000000 + i) for i in range(120))
+    # Un token inicial y otro tras el 401; 6 páginas más los 3 errores programados
+    assert stub_api.token_count == 2
+    assert stub_api.search_requests == 9
+
+def test_resume_only_requests_missing_pages(stub_api, tmp_path):
+    # La página 4 falla dos veces y se agotan los reintentos (max_retries=1)
+    stub_api.schedule = [200, 200, 200, 429, 429]
+    stub_urls = stub_api.start()
+    with pytest.raises(RuntimeError):
+        crawler(stub_urls, tmp_path, max_retries=1).crawl([('40.44,-3.71', 20000)], maxItems='20')
+    assert sorted(set(pagina for _, pagina in stub_api.searched_pages)) == [1, 2, 3, 5, 6]
+
+    stub_api.searched_pages.clear()
+    ficheros = crawler(stub_urls, tmp_path).crawl([('40.44,-3.71', 20000)], maxItems='20')
+
+    assert stub_api.searched_pages == [(20, 4)]
+    assert sorted(elementos(ficheros)) == sorted(str(90000000 + i) for i in range(120))
+
+def test_resume_with_other_page_size_does_not_reuse_pages(stub_api, tmp_path):
+    stub_urls = stub_api.start()
+    crawler(stub_urls, tmp_path).crawl([('40.44,-3.71', 20000)], maxItems='20')
+    stub_api.searched_pages.clear()
+
+    ficheros = crawler(stub_urls, tmp_path).crawl([('40.44,-3.71', 20000)], maxItems='50')
+
+    assert stub_api.searched_pages == [(50, 1), (50, 2), (50, 3)]
+    assert len(ficheros) == 3
+    assert sorted(elementos(ficheros)) == sorted(str(90000000 + i) for i in range(120))
+
+def test_requires_credentials_or_token(tmp_path):
+    with pytest.raises(ValueError):
+        IdealistaCrawler(output_dir=str(tmp_path))
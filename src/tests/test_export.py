@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+
+import importlib.util
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from utils.idealistaexport import parity
+
+from .conftest import DATA_PATH, MODELS_PATH
+
+@pytest.mark.filterwarnings("ignore::UserWarning")
+def test_parity_leaves_models_untouched(tmp_path):
+    models_path = str(tmp_path / 'models')
+    shutil.copytree(MODELS_PATH, models_path)
+
+    resultado = parity(DATA_PATH, models_path, repeats=1).set_index("model")
+
+    assert sorted(os.listdir(models_path)) == sorted(os.listdir(MODELS_PATH))
+    assert resultado.loc["numpy float32", "max_abs_diff"] < 100
+    if importlib.util.find_spec("keras") is None:
+        assert not resultado["verified"].any()
+        assert np.isnan(resultado["max_abs_diff"].iloc[0])
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+
+from utils.idealistatools import IdealistaFeatureEngineering
+
+def test_bool_2_number_downcasts():
+    data_frame = pd.DataFrame({"flag": [True, False], "nullable": pd.array([True, False], dtype="boolean"),
+                               "missing": pd.array([True, None], dtype="boolean"), "rooms": [1, 300],
+                               "size": [50.5, 80.0]})
+
+    IdealistaFeatureEngineering().feateures_bool_2_number(data_frame)
+
+    assert data_frame.dtypes.to_dict() == {"flag": np.int8, "nullable": np.int8, "missing": "boolean",
+                                           "rooms": np.int16, "size": np.float64}
+    assert data_frame["flag"].tolist() == [1, 0] and data_frame["rooms"].tolist() == [1, 300]
+
+def test_featurehasher_cached_int8_does_not_overflow():
+    fe = IdealistaFeatureEngineering()
+    # Un único carácter repetido suma su hash en la misma columna: 200 no cabe en int8 y 40000 tampoco en int16
+    valores = pd.Series(["1", "a" * 200, "b" * 40000, "1"])
+
+    for n_filas, dtype in ((1, np.int8), (2, np.int16), (3, np.float64)):
+        feature = valores.iloc[:n_filas]
+        cached = fe.create_featurehasher_cached(feature, 5, "codbar")
+        assert (cached.dtypes == dtype).all()
+        pd.testing.assert_frame_equal(cached.astype(np.float64), fe.create_featurehasher(feature, 5, "codbar"))
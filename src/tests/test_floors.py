@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.idealistatools import IdealistaFeatureEngineering
+
+from .conftest import DATA_PATH
+
+def test_matches_floor_str_2_number_on_madrid_data():
+    idealista_fe = IdealistaFeatureEngineering()
+    floor = pd.read_csv(os.path.join(DATA_PATH, 'idealista_madrid.csv'), usecols=['floor'])['floor']
+
+    despues = idealista_fe.floors_2_number(floor)
+
+    assert despues.dtype == "Int8"
+    assert despues.astype(np.float64).equals(floor.apply(idealista_fe.floor_str_2_number).astype(np.float64))
+
+def test_matches_floor_str_2_number_on_synthetic_data(synthetic):
+    idealista_fe = IdealistaFeatureEngineering()
+    floor = synthetic.listings(5000)['floor']
+
+    despues = idealista_fe.floors_2_number(floor)
+
+    assert despues.index.equals(floor.index) and despues.name == 'floor'
+    assert despues.astype(np.float64).equals(floor.apply(idealista_fe.floor_str_2_number).astype(np.float64))
+
+def test_mixed_numbers_and_nulls():
+    floor = pd.Series(["bj", 3, "-1", None, 2.0, np.nan, "en"], index=list("abcdefg"))
+
+    despues = IdealistaFeatureEngineering().floors_2_number(floor)
+
+    assert despues.tolist() == [0, 3, -1, pd.NA, 2, pd.NA, 0]
+
+def test_unknown_floors_raise_or_coerce():
+    idealista_fe = IdealistaFeatureEngineering()
+    floor = pd.Series(["1", "atico", "2.5", "300", "bj"])
+
+    with pytest.raises(ValueError, match="atico"):
+        idealista_fe.floors_2_number(floor, errors='raise')
+    assert idealista_fe.floors_2_number(floor, errors='coerce').tolist() == [1, pd.NA, pd.NA, pd.NA, 0]
+    with pytest.raises(ValueError):
+        idealista_fe.floors_2_number(floor, errors='ignore')
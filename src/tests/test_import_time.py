@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+import subprocess
+import sys
+
+import pytest
+
+from utils.idealistabenchmark import IdealistaBenchmark
+
+from .conftest import SRC_PATH
+
+def modulos_importados(module):
+    '''
+    Importa un módulo en un proceso nuevo con 'python -X importtime' y devuelve los módulos que se han cargado.
+    '''
+    salida = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module], cwd=SRC_PATH,
+                            capture_output=True, text=True, check=True).stderr
+    return {linea.rsplit("|", 1)[1].strip() for linea in salida.splitlines()
+            if linea.startswith("import time:") and "|" in linea}
+
+@pytest.mark.parametrize("module", ['utils.idealistatools', 'utils.idealistageo', 'utils.idealistapredict',
+                                    'utils.idealistaexport'])
+def test_inference_modules_do_not_load_heavy_modules(module):
+    importados = modulos_importados(module)
+
+    assert module in importados
+    cargadas = sorted({pesada for pesada in IdealistaBenchmark.heavy_modules for nombre in importados
+                       if nombre == pesada or nombre.startswith(pesada + ".")})
+    assert cargadas == []
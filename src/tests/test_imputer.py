@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.idealistatools import IdealistaFeatureEngineering, IdealistaImputer
+
+from .conftest import DATA_PATH
+from .fixtures import fillna_hierarchy_iterrows
+
+@pytest.fixture(scope='module')
+def madrid_df():
+    idealista_df = pd.read_csv(os.path.join(DATA_PATH, 'idealista_madrid.csv'))
+    idealista_df['floor'] = IdealistaFeatureEngineering().floors_2_number(idealista_df['floor']).astype(np.float64)
+    return idealista_df
+
+def test_haslift_matches_iterrows(madrid_df):
+    original_df, nuevo_df = madrid_df.copy(), madrid_df.copy()
+    fillna_hierarchy_iterrows(original_df, 'hasLift', 'mode')
+    IdealistaFeatureEngineering().fillna_haslift(nuevo_df)
+
+    assert nuevo_df['hasLift'].astype(np.float64).equals(original_df['hasLift'].astype(np.float64))
+
+def test_floor_matches_iterrows_after_round(madrid_df):
+    original_df, nuevo_df = madrid_df.copy(), madrid_df.copy()
+    fillna_hierarchy_iterrows(original_df, 'floor', 'mean')
+    IdealistaFeatureEngineering().fillna_floor(nuevo_df)
+
+    # Solo cambian unas centésimas (la versión original incluía en las medias los valores ya imputados)
+    assert (original_df['floor'] - nuevo_df['floor']).abs().max() < 0.5
+    assert nuevo_df['floor'].round().equals(original_df['floor'].round())
+
+def test_result_does_not_depend_on_row_order(synthetic):
+    base_df = synthetic.listings(3000)
+    base_df['floor'] = IdealistaFeatureEngineering().floors_2_number(base_df['floor']).astype(np.float64)
+    ordenado_df = base_df.copy()
+    desordenado_df = base_df.sample(frac=1, random_state=0)
+    for idealista_df in (ordenado_df, desordenado_df):
+        IdealistaImputer({'floor': 'mean', 'hasLift': 'mode'}).fit_transform(idealista_df)
+
+    pd.testing.assert_frame_equal(desordenado_df.loc[ordenado_df.index], ordenado_df)
+
+def test_hierarchy_falls_back_to_district_and_type():
+    idealista_df = pd.DataFrame({
+        "codbarrio": ["1-1", "1-1", "1-1", "1-2", "2-1", "2-1"],
+        "coddistrit": [1.0, 1.0, 1.0, 1.0, 2.0, 2.0],
+        "propertyType": ["flat", "flat", "flat", "flat", "flat", "chalet"],
+        "floor": [2.0, 4.0, np.nan, np.nan, 7.0, np.nan],
+    })
+    IdealistaImputer({'floor': 'mean'}).fit_transform(idealista_df)
+
+    # Barrio 1-1 -> media del barrio; barrio 1-2 sin datos -> media del distrito 1; chalet -> media de los chalets
+    # de Madrid, que no hay, así que queda nulo
+    assert idealista_df['floor'].iloc[2] == 3.0
+    assert idealista_df['floor'].iloc[3] == 3.0
+    assert np.isnan(idealista_df['floor'].iloc[5])
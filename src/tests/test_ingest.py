@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+import pandas as pd
+
+from utils.idealistaingest import IdealistaIngest
+
+def anuncio(code, district, price):
+    return {"propertyCode": code, "district": district, "price": price,
+            "detailedType": {"typology": "flat", "subTypology": "studio"},
+            "parkingSpace": {"hasParkingSpace": True, "isParkingSpaceIncludedInPrice": False}}
+
+def escribir(directorio, nombre, elementos, mtime):
+    fichero = os.path.join(directorio, nombre)
+    with open(fichero, 'w') as outfile:
+        json.dump(elementos, outfile)
+    os.utime(fichero, (mtime, mtime))
+
+def test_batches_are_appended_and_latest_wins(tmp_path):
+    json_dir, store_dir = tmp_path / 'json', str(tmp_path / 'store')
+    json_dir.mkdir()
+    escribir(json_dir, 'a.json', [anuncio(1, "Centro", 100), anuncio(2, "Centro", 200)], 1000)
+    escribir(json_dir, 'b.json', [anuncio(1, "Retiro", 150), anuncio(3, "Centro", 300)], 2000)
+    ingest = IdealistaIngest(store_dir, batch_files=1)
+
+    assert ingest.ingest(str(json_dir)) == 4
+    assert sorted(os.listdir(os.path.join(store_dir, "district=Centro"))) == ["part-000000000002.parquet",
+                                                                              "part-000000000004.parquet"]
+    # Una nueva ejecución no vuelve a cargar los ficheros
+    assert IdealistaIngest(store_dir).ingest(str(json_dir)) == 0
+
+    idealista_df = IdealistaIngest(store_dir).read().set_index("propertyCode")
+    assert idealista_df.shape[0] == 3
+    assert idealista_df.loc["1", "price"] == 150 and idealista_df.loc["1", "district"] == "Retiro"
+    assert idealista_df.loc["1", "subTypology"] == "studio"
+
+def test_compact_keeps_what_read_returns(tmp_path):
+    json_dir, store_dir = tmp_path / 'json', str(tmp_path / 'store')
+    json_dir.mkdir()
+    for i in range(4):
+        escribir(json_dir, '%d.json' % i, [anuncio(code, "Centro", 100 * i + code) for code in range(i, i + 3)], 1000 + i)
+    ingest = IdealistaIngest(store_dir, batch_files=1)
+    ingest.ingest(str(json_dir))
+    antes = ingest.read().sort_values("propertyCode").reset_index(drop=True)
+
+    assert ingest.compact() == 1
+    assert os.listdir(os.path.join(store_dir, "district=Centro")) == ["part-000000000012.parquet"]
+    despues = IdealistaIngest(store_dir).read().sort_values("propertyCode").reset_index(drop=True)
+    pd.testing.assert_frame_equal(despues, antes)
+    assert ingest.compact() == 0
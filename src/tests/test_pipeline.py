@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+import pandas as pd
+import pytest
+
+from utils.idealistapipeline import IdealistaPipeline
+
+def doble(data_frame, factor = 2):
+    return data_frame * factor
+
+def crear_pipeline(tmp_path):
+    fuente = tmp_path / 'fuente.csv'
+    pd.DataFrame({"price": [1, 2, 3]}).to_csv(fuente, index=False)
+    pipeline = IdealistaPipeline(cache_dir=str(tmp_path / 'cache'), max_workers=2, track_memory=False)
+    pipeline.add_source("fuente", str(fuente))
+    pipeline.add_stage("a", doble, ["fuente"])
+    pipeline.add_stage("b", doble, ["a"], factor=3)
+    return pipeline
+
+def test_second_run_uses_the_cache(tmp_path):
+    resultado = crear_pipeline(tmp_path).run()
+    pipeline = crear_pipeline(tmp_path)
+
+    assert pipeline.run()["b"]["price"].tolist() == resultado["b"]["price"].tolist() == [6, 12, 18]
+    assert pipeline.log["status"].tolist() == ["cached", "cached"]
+
+def test_circular_stages_raise_instead_of_spinning(tmp_path):
+    pipeline = crear_pipeline(tmp_path)
+    # Volver a declarar 'a' con 'b' como entrada crea un ciclo
+    pipeline.add_stage("a", doble, ["b"])
+    errores = []
+    hilo = threading.Thread(target=lambda: errores.append(pytest.raises(ValueError, pipeline.run, ["b"])),
+                            daemon=True)
+    hilo.start()
+    hilo.join(10)
+
+    assert not hilo.is_alive()
+    assert errores and "circulares" in str(errores[0].value)
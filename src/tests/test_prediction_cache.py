@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.idealistapredict import IdealistaPredictionCache, IdealistaPredictor
+
+from .conftest import DATA_PATH, MODELS_PATH
+
+@pytest.fixture
+def predictor():
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return IdealistaPredictor(DATA_PATH, MODELS_PATH, load_neural=False)
+
+@pytest.fixture
+def X(predictor):
+    return predictor.to_matrix(pd.read_pickle(DATA_PATH + '/X_test.df').iloc[:3])
+
+def modelo_bloqueado(monkeypatch, predictor):
+    '''
+    Sustituye la predicción del modelo por una que espera a 'libera' y cuenta las filas que predice.
+    '''
+    predict_matrix = predictor.predict_matrix
+    dentro, libera, filas = threading.Event(), threading.Event(), []
+
+    def bloqueado(X):
+        filas.append(len(X))
+        dentro.set()
+        assert libera.wait(10)
+        return predict_matrix(X)
+
+    monkeypatch.setattr(predictor, "predict_matrix", bloqueado)
+    return dentro, libera, filas
+
+def en_hilo(funcion, *args):
+    resultado = {}
+    hilo = threading.Thread(target=lambda: resultado.setdefault("valor", funcion(*args)))
+    hilo.start()
+    return hilo, resultado
+
+def test_cache_hits_do_not_wait_for_the_model(monkeypatch, predictor, X):
+    cache = IdealistaPredictionCache(predictor)
+    esperado = cache.predict_matrix(X[:1])[0]
+    dentro, libera, _ = modelo_bloqueado(monkeypatch, predictor)
+
+    prediciendo, _ = en_hilo(cache.predict_matrix, X[1:2])
+    assert dentro.wait(10)
+    consulta, resultado = en_hilo(cache.predict_matrix, X[:1])
+    consulta.join(5)
+    finalizada = not consulta.is_alive()
+    libera.set()
+    prediciendo.join(10)
+
+    assert finalizada
+    np.testing.assert_array_equal(resultado["valor"][0], esperado)
+
+def test_concurrent_misses_are_predicted_once(monkeypatch, predictor, X):
+    cache = IdealistaPredictionCache(predictor)
+    dentro, libera, filas = modelo_bloqueado(monkeypatch, predictor)
+
+    primero, resultado1 = en_hilo(cache.predict_matrix, X[:2])
+    assert dentro.wait(10)
+    segundo, resultado2 = en_hilo(cache.predict_matrix, X[1:3])
+    while cache.stats()["misses"] < 4:
+        time.sleep(0.001)
+    libera.set()
+    primero.join(10)
+    segundo.join(10)
+
+    # La fila 1 la predice solo el primer hilo; el segundo solo predice la fila 2
+    assert filas == [2, 1]
+    assert cache.stats()["coalesced"] == 1
+    np.testing.assert_array_equal(resultado2["valor"][0][0], resultado1["valor"][0][1])
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import importlib.util
+import shutil
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.idealistaexport import export_keras_model
+from utils.idealistapredict import IdealistaPredictionCache, IdealistaPredictor
+from utils.idealistarefresh import IdealistaIncrementalTrainer
+
+from .conftest import DATA_PATH, MODELS_PATH
+
+@pytest.fixture
+def artifacts(tmp_path):
+    '''
+    Copia de los datos y los modelos del proyecto (save reescribe los modelos).
+    '''
+    data_path, models_path = str(tmp_path / 'data'), str(tmp_path / 'models')
+    shutil.copytree(DATA_PATH, data_path)
+    shutil.copytree(MODELS_PATH, models_path)
+    return data_path, models_path
+
+def nuevos_anuncios(data_path, n = 300):
+    X_test = pd.read_pickle(data_path + '/X_test.df')
+    y_test = pd.read_pickle(data_path + '/y_test.serie')
+    X_new = X_test.sample(n, random_state=0)
+    # Viviendas más grandes y más caras que las del entrenamiento: cambia la escala del MinMaxScaler
+    X_new = X_new.assign(size=X_new['size'] * 1.5)
+    return X_new, y_test.loc[X_new.index] * 1.15
+
+def refresh(trainer, X_new, y_new):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return trainer.refresh(X_new, y_new)
+
+def test_from_artifacts_predicts_like_the_predictor(artifacts):
+    data_path, models_path = artifacts
+    X_test = pd.read_pickle(data_path + '/X_test.df')
+    predictor = IdealistaPredictor(data_path, models_path, load_neural=False)
+
+    trainer = IdealistaIncrementalTrainer.from_artifacts(data_path, models_path)
+
+    np.testing.assert_allclose(trainer.predict(X_test)[0], predictor.predict(X_test)["ml_prediction"], rtol=1e-9)
+
+def test_refresh_changes_what_the_predictor_returns(artifacts):
+    data_path, models_path = artifacts
+    X_new, y_new = nuevos_anuncios(data_path)
+    antes = IdealistaPredictor(data_path, models_path, load_neural=False).predict(X_new)["ml_prediction"]
+
+    trainer = IdealistaIncrementalTrainer.from_artifacts(data_path, models_path, new_trees=20)
+    resultado = refresh(trainer, X_new, y_new)
+    trainer.save(models_path)
+    despues = IdealistaPredictor(data_path, models_path, load_neural=False).predict(X_new)["ml_prediction"]
+
+    assert resultado["mode"] in ("incremental", "incremental_despite_drift")
+    assert not np.allclose(despues, antes)
+    np.testing.assert_allclose(despues, trainer.predict(X_new)[0], rtol=1e-9)
+
+def test_saved_state_continues_refreshing(artifacts):
+    data_path, models_path = artifacts
+    X_new, y_new = nuevos_anuncios(data_path)
+    trainer = IdealistaIncrementalTrainer.from_artifacts(data_path, models_path, new_trees=5)
+    refresh(trainer, X_new.iloc[:150], y_new.iloc[:150])
+    trainer.save(models_path)
+
+    cargado = IdealistaIncrementalTrainer.load(models_path)
+    refresh(cargado, X_new.iloc[150:], y_new.iloc[150:])
+    cargado.save(models_path)
+
+    # 200 veces el árbol de main.ipynb y 5 árboles por actualización
+    assert len(IdealistaPredictor(data_path, models_path, load_neural=False).ml_model.estimators_) == 210
+
+@pytest.mark.skipif(importlib.util.find_spec("keras") is not None, reason="con keras la red se reentrena")
+def test_network_is_rescaled_for_the_new_scaler(artifacts):
+    data_path, models_path = artifacts
+    X_test = pd.read_pickle(data_path + '/X_test.df')
+    antes = export_keras_model(data_path, models_path, dtype='float64').predict(X_test)
+
+    trainer = IdealistaIncrementalTrainer.from_artifacts(data_path, models_path)
+    refresh(trainer, *nuevos_anuncios(data_path))
+    trainer.save(models_path)
+
+    # El .h5 se grabó en float32: la red reescalada da las mismas predicciones salvo céntimos
+    np.testing.assert_allclose(export_keras_model(data_path, models_path, dtype='float64').predict(X_test), antes,
+                               atol=1.0)
+
+def test_prediction_cache_reloads_refreshed_models(artifacts):
+    data_path, models_path = artifacts
+    X_new, y_new = nuevos_anuncios(data_path, n=50)
+    cache = IdealistaPredictionCache(IdealistaPredictor(data_path, models_path, load_neural=False), check_interval=0)
+    antes = cache.predict(X_new)["ml_prediction"]
+    version = cache.version
+
+    trainer = IdealistaIncrementalTrainer.from_artifacts(data_path, models_path)
+    refresh(trainer, X_new, y_new)
+    trainer.save(models_path)
+
+    assert not np.allclose(cache.predict(X_new)["ml_prediction"], antes)
+    assert cache.version != version
+
+def test_drift_without_history_is_reported(artifacts):
+    data_path, models_path = artifacts
+    X_new, y_new = nuevos_anuncios(data_path)
+    trainer = IdealistaIncrementalTrainer.from_artifacts(data_path, models_path)
+
+    with pytest.warns(UserWarning, match="drift"):
+        resultado = trainer.refresh(X_new, y_new * 2)
+
+    assert resultado["drift"] and resultado["mode"] == "incremental_despite_drift"
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import pandas as pd
+
+from utils.idealistascraping import IdealistaScrapingPipeline
+from utils.idealistatools import IdealistaWebScraping
+
+COLUMNAS = ["price", "size", "rooms", "bathrooms", "priceByArea", "barrio", "distrito"]
+
+def pipeline(cache_dir, parse_processes = 0):
+    return IdealistaScrapingPipeline(cache_dir=str(cache_dir), max_workers=4, requests_per_second=1000,
+                                     parse_processes=parse_processes)
+
+def test_matches_sequential_scraping(stub_web, tmp_path):
+    url_base = stub_web.start()
+    urls = [url_base + str(numero) for numero in range(6)]
+    ws = IdealistaWebScraping()
+    secuencial_df = pd.DataFrame([ws.extract_advertisement_info(ws.get_idealista_advertisement(url), 0) for url in urls])
+
+    pipeline_df = pipeline(tmp_path, parse_processes=2).run(urls, 0)
+
+    assert (pipeline_df["status"] == 'fetched').all()
+    pd.testing.assert_frame_equal(pipeline_df[COLUMNAS], secuencial_df[COLUMNAS])
+
+def test_second_run_uses_conditional_get(stub_web, tmp_path):
+    url_base = stub_web.start()
+    urls = [url_base + str(numero) for numero in range(5)]
+    primero_df = pipeline(tmp_path).run(urls, 0)
+    assert stub_web.not_modified == 0
+
+    segundo_df = pipeline(tmp_path).run(urls, 0)
+
+    assert stub_web.requests == 2 * len(urls)
+    assert stub_web.not_modified == len(urls)
+    assert (segundo_df["status"] == 'not_modified').all()
+    pd.testing.assert_frame_equal(segundo_df[COLUMNAS], primero_df[COLUMNAS])
+
+def test_failed_downloads_are_reported_per_url(stub_web, tmp_path):
+    url_base = stub_web.start()
+    urls = [url_base + "0", url_base + "no-existe", url_base + "1"]
+
+    pipeline_df = pipeline(tmp_path).run(urls, 0)
+
+    assert list(pipeline_df["status"]) == ['fetched', 'error', 'fetched']
+    assert pipeline_df["error"].iloc[1] == "HTTP 404"
+    assert pipeline_df["price"].iloc[[0, 2]].notna().all()
@@ -0,0 +1,1060 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import GridSearchCV
+
+from .idealistatools import Idealista, IdealistaFeatureEngineering, IdealistaImputer, IdealistaML, IdealistaWebScraping
+from .idealistacrawler import IdealistaCrawler
+from .idealistaexport import export_keras_model, parity
+from .idealistahistory import IdealistaListingHistory
+from .idealistageo import IdealistaDistance, IdealistaPriceIndex, IdealistaSpatialJoin
+from .idealistaoutofcore import IdealistaOutOfCoreTrainer
+from .idealistapredict import IdealistaPredictionCache, IdealistaPredictor
+from .idealistaprofile import IdealistaProfiler
+from .idealistascraping import IdealistaScrapingPipeline
+from .idealistaselection import IdealistaFeatureSelector
+from .idealistarefresh import IdealistaIncrementalTrainer
+from .idealistasearch import IdealistaModelSearch
+# Los datos sintéticos y los servidores locales son los mismos que usan los tests
+from tests.fixtures import IdealistaStubApi, IdealistaStubWeb, IdealistaSyntheticData, fillna_hierarchy_iterrows
+
+class IdealistaBenchmark:
+    '''
+    Clase con métodos para medir el rendimiento de las herramientas del proyecto sobre datos sintéticos.
+    '''
+
+    '''
+    Librerías que no deben cargarse al importar los módulos del camino de predicción
+    '''
+    heavy_modules = ["requests", "bs4", "urllib.request", "seaborn", "matplotlib", "sklearn", "scipy", "IPython",
+                     "keras", "tensorflow"]
+
+    def __init__(self, seed = 42, debug = False):
+        '''
+        Constructor
+        Parametros:
+            seed: semilla del generador de datos sintéticos
+            debug: si vale True muestra mensajes de debug
+        '''
+        self.__synthetic = IdealistaSyntheticData(seed=seed)
+        self.__seed = seed
+        self.__debug = debug
+
+    def __time(self, function, *args):
+        inicio = time.perf_counter()
+        function(*args)
+        return time.perf_counter() - inicio
+
+    def imputation(self, sizes = (10000, 100000, 1000000), max_rows_iterrows = 100000, nan_fraction = 0.1):
+        '''
+        Compara el tiempo de la imputación original (iterrows) con el de IdealistaImputer
+        para 'floor' (media) y 'hasLift' (moda).
+
+        Parametros:
+        * sizes: tamaños de los DataFrames sintéticos
+        * max_rows_iterrows: tamaño máximo con el que se ejecuta la versión original, que es cuadrática
+        * nan_fraction: proporción de nulos en las columnas imputadas
+        Resultado:
+        * DataFrame con los tiempos en segundos y, si se ha ejecutado la versión original, la diferencia máxima
+          entre los valores imputados por ambas versiones
+        '''
+        filas = []
+        for n_rows in sizes:
+            base_df = self.__synthetic.listings(n_rows, nan_fraction=nan_fraction)
+            base_df['floor'] = base_df['floor'].map({"bj": 0, "en": 0, "ss": -1, "st": -1}).fillna(
+                pd.to_numeric(base_df['floor'], errors='coerce'))
+
+            for column, aggregator in [('floor', 'mean'), ('hasLift', 'mode')]:
+                nuevo_df = base_df.copy()
+                t_nuevo = self.__time(IdealistaImputer({column: aggregator}).fit_transform, nuevo_df)
+
+                t_original, diferencia = np.nan, np.nan
+                if n_rows <= max_rows_iterrows:
+                    original_df = base_df.copy()
+                    t_original = self.__time(fillna_hierarchy_iterrows, original_df, column, aggregator)
+                    diferencia = (original_df[column].astype('float64') - nuevo_df[column].astype('float64')).abs().max()
+
+                filas.append({"rows": n_rows, "column": column, "nulls": int(base_df[column].isna().sum()),
+                              "iterrows_s": t_original, "imputer_s": t_nuevo,
+                              "speedup": t_original / t_nuevo, "max_abs_diff": diferencia})
+                if self.__debug:
+                    print(filas[-1])
+
+        return pd.DataFrame(filas)
+
+    def crawler(self, total_items = 2000, max_items = 50, latency = 0.05, max_workers = 8, requests_per_second = 50):
+        '''
+        Compara la descarga secuencial con Idealista.search (como en GetDataIdealista.ipynb) con IdealistaCrawler
+        contra un servidor local IdealistaStubApi.
+
+        Parametros:
+        * total_items: número de viviendas de la búsqueda
+        * max_items: viviendas por página
+        * latency: latencia simulada del servidor en segundos
+        * max_workers: hilos del crawler
+        * requests_per_second: límite de peticiones por segundo del crawler
+        Resultado:
+        * DataFrame con las páginas descargadas, el tiempo y las páginas por segundo de cada método
+        '''
+        stub = IdealistaStubApi(total_items=total_items, latency=latency)
+        url_token, url_search = stub.start()
+        filas = []
+        try:
+            with tempfile.TemporaryDirectory() as directorio:
+                idealista = Idealista(url_token=url_token, url_search=url_search)
+                idealista.generate_token("key", "secret")
+                inicio = time.perf_counter()
+                result = idealista.search('40.44,-3.71', maxItems=str(max_items))
+                paginas = idealista.summary_result(result)["totalPages"]
+                for pagina in range(2, paginas + 1):
+                    result = idealista.search('40.44,-3.71', numPage=str(pagina), maxItems=str(max_items))
+                    idealista.elementlist_tojson(result, os.path.join(directorio, str(pagina) + ".json"))
+                filas.append({"method": "Idealista.search", "pages": paginas, "seconds": time.perf_counter() - inicio})
+
+                crawler = IdealistaCrawler(api_key="key", api_secret="secret", output_dir=directorio,
+                                           max_workers=max_workers, requests_per_second=requests_per_second,
+                                           url_token=url_token, url_search=url_search)
+                inicio = time.perf_counter()
+                ficheros = crawler.crawl([('40.44,-3.71', 20000)], maxItems=str(max_items))
+                filas.append({"method": "IdealistaCrawler", "pages": len(ficheros), "seconds": time.perf_counter() - inicio})
+        finally:
+            stub.stop()
+
+        resultado = pd.DataFrame(filas)
+        resultado["pages_per_second"] = resultado["pages"] / resultado["seconds"]
+        if self.__debug:
+            print(resultado)
+
+        return resultado
+
+    def distance(self, sizes = (10000, 100000, 1000000), n_references = 10, max_rows_scalar = 100000):
+        '''
+        Compara IdealistaWebScraping.distance (una distancia por llamada) con IdealistaDistance.distance_matrix
+        en float64 y float32.
+
+        Parametros:
+        * sizes: número de viviendas
+        * n_references: número de puntos de referencia
+        * max_rows_scalar: tamaño máximo con el que se ejecuta la versión escalar
+        Resultado:
+        * DataFrame con los tiempos en segundos, la memoria de la matriz y el error máximo frente a la versión escalar
+        '''
+        ws = IdealistaWebScraping()
+        rng = np.random.default_rng(0)
+        references = [(IdealistaDistance.longitudCentro, IdealistaDistance.latitudCentro)] + \
+            list(zip(rng.uniform(-3.81, -3.58, n_references - 1), rng.uniform(40.33, 40.52, n_references - 1)))
+
+        filas = []
+        for n_rows in sizes:
+            base_df = self.__synthetic.listings(n_rows)
+            longitudes, latitudes = base_df['longitude'].to_numpy(), base_df['latitude'].to_numpy()
+
+            escalar, t_escalar = None, np.nan
+            if n_rows <= max_rows_scalar:
+                inicio = time.perf_counter()
+                escalar = np.array([[ws.distance(ref_lon, ref_lat, lon, lat) for ref_lon, ref_lat in references]
+                                    for lon, lat in zip(longitudes, latitudes)])
+                t_escalar = time.perf_counter() - inicio
+
+            for dtype in (np.float64, np.float32):
+                inicio = time.perf_counter()
+                matriz = IdealistaDistance(dtype=dtype).distance_matrix(longitudes, latitudes, references)
+                t_vector = time.perf_counter() - inicio
+                error = np.nan if escalar is None else np.abs(matriz - escalar).max()
+                filas.append({"rows": n_rows, "references": len(references), "dtype": np.dtype(dtype).name,
+                              "scalar_s": t_escalar, "vectorized_s": t_vector, "speedup": t_escalar / t_vector,
+                              "matrix_mb": matriz.nbytes / 2**20, "max_abs_error_m": error})
+                if self.__debug:
+                    print(filas[-1])
+
+        return pd.DataFrame(filas)
+
+    def spatial_join(self, sizes = (1000, 100000, 1000000), vertices_per_edge = 25, max_rows_brute_force = 100000):
+        '''
+        Compara IdealistaSpatialJoin con índice de rejilla frente a la comparación de cada vivienda con todos los barrios.
+
+        Parametros:
+        * sizes: número de viviendas
+        * vertices_per_edge: vértices por lado de los barrios sintéticos
+        * max_rows_brute_force: tamaño máximo con el que se ejecuta la comparación con todos los barrios
+        Resultado:
+        * DataFrame con el tiempo y las viviendas por segundo de cada método y si las asignaciones coinciden
+        '''
+        polygons, attributes = self.__synthetic.barrios(vertices_per_edge=vertices_per_edge)
+        spatial_join = IdealistaSpatialJoin()
+        inicio = time.perf_counter()
+        spatial_join.load_polygons(polygons, attributes)
+        t_carga = time.perf_counter() - inicio
+
+        filas = []
+        for n_rows in sizes:
+            base_df = self.__synthetic.listings(n_rows)
+            inicio = time.perf_counter()
+            indice = spatial_join.locate(base_df['longitude'], base_df['latitude'])
+            t_indice = time.perf_counter() - inicio
+
+            t_todos, coinciden = np.nan, None
+            if n_rows <= max_rows_brute_force:
+                inicio = time.perf_counter()
+                todos = spatial_join.locate(base_df['longitude'], base_df['latitude'], use_index=False)
+                t_todos = time.perf_counter() - inicio
+                coinciden = bool((todos == indice).all())
+
+            filas.append({"rows": n_rows, "polygons": len(polygons), "load_s": t_carga,
+                          "brute_force_s": t_todos, "grid_index_s": t_indice,
+                          "brute_force_points_s": n_rows / t_todos, "grid_index_points_s": n_rows / t_indice,
+                          "unassigned": int((indice < 0).sum()), "equal": coinciden})
+            if self.__debug:
+                print(filas[-1])
+
+        return pd.DataFrame(filas)
+
+    def prediction(self, batch_sizes = (1, 10, 100, 1000, 10000), repeats = 50, data_path = 'data', models_path = 'models',
+                   load_neural = True):
+        '''
+        Mide la latencia (p50/p99) y las viviendas por segundo de IdealistaPredictor para distintos tamaños de lote,
+        con viviendas de 'X_test.df'.
+
+        Parametros:
+        * batch_sizes: tamaños de lote
+        * repeats: número de predicciones por tamaño de lote
+        * data_path, models_path: directorios de datos y modelos
+        * load_neural: si vale True mide también el modelo de Deep Learning
+        Resultado:
+        * DataFrame con las latencias en milisegundos y las viviendas por segundo de cada tamaño de lote
+        '''
+        predictor = IdealistaPredictor(data_path=data_path, models_path=models_path, load_neural=load_neural)
+        X_test = pd.read_pickle(os.path.join(data_path, 'X_test.df'))
+        rng = np.random.default_rng(0)
+
+        filas = []
+        for batch_size in batch_sizes:
+            lote = X_test.iloc[rng.integers(0, X_test.shape[0], batch_size)]
+            tiempos = []
+            for _ in range(repeats):
+                inicio = time.perf_counter()
+                predictor.predict(lote)
+                tiempos.append(time.perf_counter() - inicio)
+            tiempos = np.array(tiempos)
+            filas.append({"batch_size": batch_size, "p50_ms": np.percentile(tiempos, 50) * 1000,
+                          "p99_ms": np.percentile(tiempos, 99) * 1000, "rows_per_second": batch_size / tiempos.mean()})
+            if self.__debug:
+                print(filas[-1])
+
+        return pd.DataFrame(filas)
+
+    def prediction_cache(self, n_requests = 20000, n_listings = 1000, zipf = 1.2, data_path = 'data',
+                         models_path = 'models'):
+        '''
+        Simula el front end de valoración: n_requests peticiones de una vivienda elegidas entre n_listings viviendas
+        de 'X_test.df' con una distribución de Zipf (unas pocas se piden muchas veces), y compara el tiempo de
+        IdealistaPredictor con el de IdealistaPredictionCache (solo memoria y con el nivel en disco).
+        Si keras no está instalado, el modelo de Deep Learning es el exportado a NumPy.
+
+        Resultado:
+        * DataFrame con los segundos, las peticiones por segundo y la tasa de aciertos de cada modo
+        '''
+        X_test = pd.read_pickle(os.path.join(data_path, 'X_test.df'))
+        rng = np.random.default_rng(self.__seed)
+        # Diccionarios como los de IdealistaWebScraping.create_info_vivienda
+        viviendas = X_test.iloc[rng.permutation(X_test.shape[0])[:n_listings]].to_dict(orient='records')
+        peticiones = np.minimum(rng.zipf(zipf, n_requests), len(viviendas)) - 1
+
+        with tempfile.TemporaryDirectory() as directorio:
+            neural_file = None
+            try:
+                import keras
+            except ImportError:
+                neural_file = os.path.join(directorio, 'idealista_model.npz')
+                export_keras_model(data_path, models_path, file=neural_file)
+
+            filas = []
+            for modo in ["predictor", "memory", "memory+disk"]:
+                predictor = IdealistaPredictor(data_path=data_path, models_path=models_path, neural_file=neural_file)
+                if modo != "predictor":
+                    disk_file = os.path.join(directorio, 'cache.sqlite') if modo == "memory+disk" else None
+                    predictor = IdealistaPredictionCache(predictor, disk_file=disk_file)
+                inicio = time.perf_counter()
+                for ind in peticiones:
+                    predictor.predict(viviendas[ind])
+                segundos = time.perf_counter() - inicio
+                filas.append({"mode": modo, "requests": n_requests, "seconds": segundos,
+                              "requests_per_second": n_requests / segundos,
+                              "hit_rate": predictor.stats()["hit_rate"] if modo != "predictor" else np.nan})
+                if self.__debug:
+                    print(filas[-1])
+
+        return pd.DataFrame(filas)
+
+    def featurehasher(self, sizes = (10000, 100000, 1000000)):
+        '''
+        Compara create_featurehasher con create_featurehasher_cached (int8, float64 y sparse) codificando
+        'codbar' (5 columnas) y 'coddistrit' (3 columnas) como en el notebook.
+
+        Parametros:
+        * sizes: número de viviendas
+        Resultado:
+        * DataFrame con el tiempo en segundos y la memoria del resultado en MB de cada método
+        '''
+        def memoria(resultado):
+            if isinstance(resultado, pd.DataFrame):
+                return resultado.memory_usage(index=False).sum() / 2**20
+            return (resultado.data.nbytes + resultado.indices.nbytes + resultado.indptr.nbytes) / 2**20
+
+        filas = []
+        for n_rows in sizes:
+            base_df = self.__synthetic.listings(n_rows)
+            columnas = [(base_df['codbar'].astype('str'), 5, 'codbar'), (base_df['coddistrit'].astype('str'), 3, 'coddistrit')]
+            metodos = [("create_featurehasher", None)] + [("cached_" + output, output) for output in ('int8', 'float64', 'sparse')]
+            referencia = None
+            for nombre, output in metodos:
+                fe = IdealistaFeatureEngineering()
+                inicio = time.perf_counter()
+                if output is None:
+                    resultados = [fe.create_featurehasher(*columna) for columna in columnas]
+                else:
+                    resultados = [fe.create_featurehasher_cached(*columna, output=output) for columna in columnas]
+                segundos = time.perf_counter() - inicio
+
+                densos = [r.toarray() if output == 'sparse' else np.asarray(r, dtype=np.float64) for r in resultados]
+                if referencia is None:
+                    referencia = densos
+                filas.append({"rows": n_rows, "method": nombre, "seconds": segundos,
+                              "memory_mb": sum(memoria(r) for r in resultados),
+                              "equal": all(np.array_equal(a, b) for a, b in zip(referencia, densos))})
+                if self.__debug:
+                    print(filas[-1])
+
+        return pd.DataFrame(filas)
+
+    def scraping(self, n_pages = 200, latency = 0.05, padding_kb = 200, max_workers = 8, requests_per_second = 50,
+                 parse_processes = None):
+        '''
+        Compara la descarga y análisis secuencial de anuncios (get_idealista_advertisement y extract_advertisement_info
+        con el parser por defecto) con IdealistaScrapingPipeline, en frío y con la caché de html ya cargada,
+        contra un servidor local IdealistaStubWeb.
+
+        Parametros:
+        * n_pages: número de anuncios
+        * latency: latencia simulada del servidor en segundos
+        * padding_kb: kilobytes de relleno de cada anuncio
+        * max_workers: hilos de descarga del pipeline
+        * requests_per_second: límite de peticiones por segundo del pipeline
+        * parse_processes: procesos de análisis del pipeline
+        Resultado:
+        * DataFrame con los anuncios, el tiempo, los anuncios por segundo de cada método y si el resultado
+          coincide con el del método secuencial
+        '''
+        stub = IdealistaStubWeb(latency=latency, padding_kb=padding_kb, seed=self.__seed)
+        url_base = stub.start()
+        urls = [url_base + str(numero) for numero in range(n_pages)]
+        columnas = ["price", "size", "rooms", "bathrooms", "priceByArea", "barrio", "distrito"]
+        filas = []
+        try:
+            ws = IdealistaWebScraping()
+            inicio = time.perf_counter()
+            secuencial_df = pd.DataFrame([ws.extract_advertisement_info(ws.get_idealista_advertisement(url), 0)
+                                          for url in urls])
+            filas.append({"method": "secuencial", "pages": n_pages, "seconds": time.perf_counter() - inicio, "equal": True})
+
+            with tempfile.TemporaryDirectory() as directorio:
+                pipeline = IdealistaScrapingPipeline(cache_dir=directorio, max_workers=max_workers,
+                                                     requests_per_second=requests_per_second,
+                                                     parse_processes=parse_processes)
+                for metodo in ["IdealistaScrapingPipeline", "IdealistaScrapingPipeline (caché)"]:
+                    inicio = time.perf_counter()
+                    pipeline_df = pipeline.run(urls, 0)
+                    filas.append({"method": metodo, "pages": n_pages, "seconds": time.perf_counter() - inicio,
+                                  "equal": pipeline_df[columnas].equals(secuencial_df[columnas])})
+        finally:
+            stub.stop()
+
+        resultado = pd.DataFrame(filas)
+        resultado["pages_per_second"] = resultado["pages"] / resultado["seconds"]
+        if self.__debug:
+            print(resultado)
+
+        return resultado
+
+    def refresh(self, delta_fraction = 0.1, data_path = 'data', neural = None):
+        '''
+        Compara el tiempo de un reentrenamiento completo (GridSearchCV, bosque y red neuronal) con el de la actualización
+        incremental de IdealistaIncrementalTrainer sobre los datos del proyecto: el último 'delta_fraction' de X_train
+        hace de anuncios nuevos.
+
+        Parametros:
+        * delta_fraction: proporción de X_train que se trata como anuncios nuevos
+        * data_path: directorio con 'X_train.df', 'y_train.serie', 'X_test.df', 'y_test.serie' y 'features_selected.npz'
+        * neural: si vale True se entrena también la red neuronal. Por defecto, solo si keras está instalado
+        Resultado:
+        * DataFrame con los segundos y el r2 en test del bosque de cada modo
+        '''
+        if neural is None:
+            try:
+                import keras
+                neural = True
+            except ImportError:
+                neural = False
+        X_train = pd.read_pickle(os.path.join(data_path, 'X_train.df'))
+        y_train = pd.read_pickle(os.path.join(data_path, 'y_train.serie'))
+        X_test = pd.read_pickle(os.path.join(data_path, 'X_test.df'))
+        y_test = pd.read_pickle(os.path.join(data_path, 'y_test.serie'))
+        features = [str(feature) for feature in np.load(os.path.join(data_path, 'features_selected.npz'),
+                                                        allow_pickle=True)['features_selected']]
+        n = int(X_train.shape[0] * (1 - delta_fraction))
+
+        def r2(trainer):
+            y_pred = trainer.predict(X_test)[0]
+            return 1 - np.sum((y_test - y_pred) ** 2) / np.sum((y_test - y_test.mean()) ** 2)
+
+        filas = []
+        completo = IdealistaIncrementalTrainer(features, neural=neural, random_state=self.__seed)
+        segundos = self.__time(completo.fit, X_train, y_train)
+        filas.append({"mode": "full", "rows": X_train.shape[0], "seconds": segundos, "r2_test": r2(completo)})
+
+        incremental = IdealistaIncrementalTrainer(features, neural=neural, random_state=self.__seed)
+        incremental.fit(X_train.iloc[:n], y_train.iloc[:n])
+        resultado = incremental.refresh(X_train.iloc[n:], y_train.iloc[n:])
+        filas.append({"mode": resultado["mode"], "rows": X_train.shape[0] - n, "seconds": resultado["seconds"],
+                      "r2_test": r2(incremental), "max_psi": resultado["max_psi"], "error_ratio": resultado["error_ratio"]})
+
+        resultado = pd.DataFrame(filas)
+        if self.__debug:
+            print(resultado)
+
+        return resultado
+
+    def model_search(self, data_path = 'data', models_path = 'models', include_svr = False):
+        '''
+        Compara los GridSearchCV secuenciales de main.ipynb con IdealistaModelSearch, sin caché y con la caché
+        de scores ya cargada, sobre X_train escalado con las features seleccionadas.
+
+        Parametros:
+        * data_path: directorio con 'X_train.df', 'y_train.serie' y 'features_selected.npz'
+        * models_path: directorio con 'minmaxscaler.scaler'
+        * include_svr: si vale True se incluye la búsqueda de SVR (320 candidatos, la más lenta)
+        Resultado:
+        * DataFrame con el mejor grid, sus parámetros, su score, los entrenamientos y el tiempo de cada método
+        '''
+        X_train = pd.read_pickle(os.path.join(data_path, 'X_train.df'))
+        y_train = pd.read_pickle(os.path.join(data_path, 'y_train.serie'))
+        features = [str(feature) for feature in np.load(os.path.join(data_path, 'features_selected.npz'),
+                                                        allow_pickle=True)['features_selected']]
+        with open(os.path.join(models_path, 'minmaxscaler.scaler'), 'rb') as archivo_entrada:
+            X_train_scal = pickle.load(archivo_entrada).transform(X_train[features])
+        grids = {nombre: grid for nombre, grid in IdealistaModelSearch.grids.items() if include_svr or nombre != 'gs_svr'}
+
+        filas = []
+        inicio = time.perf_counter()
+        resultados = []
+        for nombre, (estimator, param_grid) in grids.items():
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                gs = GridSearchCV(estimator, param_grid, cv=10, scoring='r2', n_jobs=-1).fit(X_train_scal, y_train)
+            resultados.append((gs.best_score_, nombre, gs.best_params_, len(gs.cv_results_["params"]) * 10))
+        mejor = max(resultados, key=lambda resultado: resultado[0])
+        filas.append({"method": "GridSearchCV", "best_grid": mejor[1], "best_params": mejor[2], "best_score": mejor[0],
+                      "fits": sum(resultado[3] for resultado in resultados), "seconds": time.perf_counter() - inicio})
+
+        with tempfile.TemporaryDirectory() as directorio:
+            cache_file = os.path.join(directorio, "search_cache.json")
+            for metodo in ["IdealistaModelSearch", "IdealistaModelSearch (caché)"]:
+                search = IdealistaModelSearch(grids=grids, cache_file=cache_file)
+                search.fit(X_train_scal, y_train, features=features)
+                filas.append({"method": metodo, "best_grid": search.best_grid_, "best_params": search.best_params_,
+                              "best_score": search.best_score_, "fits": search.stats["fits"],
+                              "seconds": search.stats["seconds"]})
+
+        resultado = pd.DataFrame(filas)
+        if self.__debug:
+            print(resultado)
+
+        return resultado
+
+    def correlation(self, n_rows = 20000, widths = (50, 200, 600), density = 0.1):
+        '''
+        Compara data.corr() con IdealistaML.correlation_analysis (matriz completa y solo con el target) sobre
+        DataFrames sintéticos anchos de columnas one-hot y un target 'price'.
+
+        Parametros:
+        * n_rows: número de filas
+        * widths: números de columnas one-hot a probar
+        * density: proporción de unos de cada columna one-hot
+        Resultado:
+        * DataFrame con el tiempo de cada método y la mayor diferencia absoluta con data.corr()
+        '''
+        rng = np.random.default_rng(self.__seed)
+        idealista_ml = IdealistaML()
+        filas = []
+        for width in widths:
+            data = pd.DataFrame((rng.random((n_rows, width)) < density).astype(np.uint8),
+                                columns=["onehot_" + str(n) for n in range(width)])
+            data["price"] = data.to_numpy() @ rng.random(width) + rng.random(n_rows)
+
+            inicio = time.perf_counter()
+            referencia = data.corr()
+            segundos_corr = time.perf_counter() - inicio
+            inicio = time.perf_counter()
+            correlation = idealista_ml.correlation_analysis(data)
+            segundos_matriz = time.perf_counter() - inicio
+            inicio = time.perf_counter()
+            correlation_target = idealista_ml.correlation_analysis(data, target="price")
+            segundos_target = time.perf_counter() - inicio
+
+            filas.append({"columns": width + 1, "corr_seconds": segundos_corr, "matrix_seconds": segundos_matriz,
+                          "target_seconds": segundos_target,
+                          "matrix_max_abs_diff": np.nanmax(np.abs(correlation.to_numpy() - referencia.to_numpy())),
+                          "target_max_abs_diff": np.nanmax(np.abs(correlation_target - referencia["price"]))})
+
+        resultado = pd.DataFrame(filas)
+        if self.__debug:
+            print(resultado)
+
+        return resultado
+
+    def nan_profile(self, n_rows = 1000000, chunksize = 100000, nan_fraction = 0.1):
+        '''
+        Compara nan_analysis sobre un CSV sintético leído entero con pd.read_csv con el análisis por trozos
+        (read_chunks), midiendo el tiempo y el pico de memoria (con tracemalloc).
+
+        Parametros:
+        * n_rows: filas del CSV sintético
+        * chunksize: filas de cada trozo
+        * nan_fraction: proporción de nulos de 'floor' y 'hasLift'
+        Resultado:
+        * DataFrame con el tiempo, el pico de memoria en MB de cada método y si las tablas de nulos coinciden
+        '''
+        idealista_fe = IdealistaFeatureEngineering()
+        filas = []
+        with tempfile.TemporaryDirectory() as directorio:
+            fichero = os.path.join(directorio, "listings.csv")
+            self.__synthetic.listings(n_rows, nan_fraction=nan_fraction).to_csv(fichero, index=False)
+
+            resultados = {}
+            for metodo, leer in [("pd.read_csv", lambda: pd.read_csv(fichero)),
+                                 ("read_chunks", lambda: idealista_fe.read_chunks(fichero, chunksize=chunksize))]:
+                inicio = time.perf_counter()
+                resultados[metodo] = idealista_fe.nan_analysis(leer(), display_analysis=False)
+                segundos = time.perf_counter() - inicio
+                # tracemalloc ralentiza mucho la ejecución, así que la memoria se mide en una segunda pasada
+                tracemalloc.start()
+                idealista_fe.nan_analysis(leer(), display_analysis=False)
+                pico = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                filas.append({"method": metodo, "rows": n_rows, "seconds": segundos, "peak_mb": pico / 2 ** 20})
+
+        iguales = resultados["pd.read_csv"].equals(resultados["read_chunks"])
+        resultado = pd.DataFrame(filas)
+        resultado["equal"] = iguales
+        if self.__debug:
+            print(resultado)
+
+        return resultado
+
+    def floors(self, sizes = (10000, 100000, 1000000), data_path = 'data'):
+        '''
+        Compara la conversión de la columna 'floor' con floor_str_2_number (Series.apply) y con floors_2_number
+        (vectorizada), sobre columnas sintéticas y sobre 'idealista_madrid.csv'.
+
+        Parametros:
+        * sizes: número de viviendas sintéticas
+        * data_path: directorio de 'idealista_madrid.csv' (None: solo datos sintéticos)
+        Resultado:
+        * DataFrame con el tiempo en segundos de cada método, la memoria del resultado en MB y si coinciden
+        '''
+        idealista_fe = IdealistaFeatureEngineering()
+        columnas = []
+        for n_rows in sizes:
+            rng = np.random.default_rng(self.__seed)
+            floor = rng.choice(self.__synthetic.plantas, n_rows).astype(object)
+            floor[rng.random(n_rows) < 0.1] = np.nan
+            columnas.append(("synthetic", pd.Series(floor, name='floor')))
+        if data_path is not None:
+            columnas.append(("idealista_madrid.csv",
+                             pd.read_csv(os.path.join(data_path, 'idealista_madrid.csv'), usecols=['floor'])['floor']))
+
+        filas = []
+        for origen, floor in columnas:
+            inicio = time.perf_counter()
+            antes = floor.apply(idealista_fe.floor_str_2_number).astype(np.float64)
+            segundos_antes = time.perf_counter() - inicio
+            inicio = time.perf_counter()
+            despues = idealista_fe.floors_2_number(floor)
+            segundos_despues = time.perf_counter() - inicio
+            filas.append({"data": origen, "rows": floor.shape[0], "seconds_apply": segundos_antes,
+                          "seconds_vectorized": segundos_despues, "speedup": segundos_antes / segundos_despues,
+                          "memory_mb_apply": antes.memory_usage(index=False) / 2**20,
+                          "memory_mb_vectorized": despues.memory_usage(index=False) / 2**20,
+                          "equal": despues.astype(np.float64).equals(antes)})
+            if self.__debug:
+                print(filas[-1])
+
+        return pd.DataFrame(filas)
+
+    def price_index(self, radius = 500, single_queries = 1000, data_path = 'data'):
+        '''
+        Mide IdealistaPriceIndex sobre 'idealista_madrid_clean.csv': construcción del índice, cálculo en lote del
+        'priceByArea' mediano en un radio de todas las viviendas, consultas de una sola vivienda (como en la
+        predicción) y el mismo cálculo por fuerza bruta (matriz de distancias de IdealistaDistance y mediana por fila).
+
+        Parametros:
+        * radius: radio en metros
+        * single_queries: número de consultas de una vivienda
+        * data_path: directorio de 'idealista_madrid_clean.csv'
+        Resultado:
+        * DataFrame con el tiempo total y por vivienda en milisegundos de cada operación y, para la fuerza bruta,
+          la proporción de viviendas con la misma mediana
+        '''
+        data_df = pd.read_csv(os.path.join(data_path, 'idealista_madrid_clean.csv'))
+        longitudes, latitudes = data_df['longitude'].to_numpy(), data_df['latitude'].to_numpy()
+        n = data_df.shape[0]
+
+        inicio = time.perf_counter()
+        index = IdealistaPriceIndex(radius=radius).fit(data_df)
+        segundos_fit = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        medianas, cuenta = index.local_median(longitudes, latitudes)
+        segundos_lote = time.perf_counter() - inicio
+
+        posiciones = np.random.default_rng(self.__seed).integers(0, n, single_queries)
+        inicio = time.perf_counter()
+        for posicion in posiciones:
+            index.local_median(longitudes[posicion:posicion + 1], latitudes[posicion:posicion + 1])
+        segundos_una = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        distancias = IdealistaDistance().distance_matrix(longitudes, latitudes, np.column_stack([longitudes, latitudes]))
+        valores = data_df['priceByArea'].to_numpy(dtype=np.float64)
+        fuerza_bruta = np.array([np.median(valores[fila <= radius]) for fila in distancias])
+        segundos_fuerza_bruta = time.perf_counter() - inicio
+        # Solo se comparan las viviendas con suficientes vecinos en el radio (al resto el índice les asigna los k más cercanos)
+        comparables = cuenta >= 5
+
+        filas = [{"operation": "fit", "rows": n, "seconds": segundos_fit, "ms_per_listing": 1000 * segundos_fit / n},
+                 {"operation": "local_median batch", "rows": n, "seconds": segundos_lote,
+                  "ms_per_listing": 1000 * segundos_lote / n},
+                 {"operation": "local_median single", "rows": single_queries, "seconds": segundos_una,
+                  "ms_per_listing": 1000 * segundos_una / single_queries},
+                 {"operation": "brute force", "rows": n, "seconds": segundos_fuerza_bruta,
+                  "ms_per_listing": 1000 * segundos_fuerza_bruta / n,
+                  "equal_fraction": np.mean(np.isclose(fuerza_bruta[comparables], medianas[comparables]))}]
+        resultado = pd.DataFrame(filas)
+        if self.__debug:
+            print(resultado)
+
+        return resultado
+
+    def import_time(self, modules = ('utils.idealistatools', 'utils.idealistageo', 'utils.idealistapredict',
+                                     'utils.idealistaexport'),
+                    repeats = 3):
+        '''
+        Mide con 'python -X importtime' el tiempo de importación en frío (un proceso nuevo por medida) de los módulos
+        del camino de predicción y comprueba que no cargan ninguna de las librerías de 'heavy_modules'.
+        La comprobación se ejecuta también como prueba en tests/test_import_time.py.
+
+        Parametros:
+        * modules: módulos a importar (relativos al directorio 'src')
+        * repeats: número de medidas de cada módulo (se toma la menor)
+        Resultado:
+        * DataFrame con el tiempo de importación en segundos de cada módulo, el de pandas (el mínimo
+          alcanzable), las librerías pesadas cargadas y si el módulo es ligero
+        '''
+        src = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+        def medir(module):
+            salida = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module], cwd=src,
+                                    capture_output=True, text=True, check=True).stderr
+            modulos = {}
+            for linea in salida.splitlines():
+                if linea.startswith("import time:") and "|" in linea:
+                    _, acumulado, nombre = linea[len("import time:"):].split("|")
+                    if acumulado.strip().isdigit():
+                        modulos[nombre.strip()] = int(acumulado) / 1e6
+            return modulos[module], modulos
+
+        pandas_segundos = min(medir("pandas")[0] for _ in range(repeats))
+        filas = []
+        for module in modules:
+            medidas = [medir(module) for _ in range(repeats)]
+            cargadas = sorted({pesada for pesada in self.heavy_modules for nombre in medidas[0][1]
+                               if nombre == pesada or nombre.startswith(pesada + ".")})
+            filas.append({"module": module, "seconds": min(segundos for segundos, _ in medidas),
+                          "pandas_seconds": pandas_segundos, "heavy_loaded": cargadas, "lightweight": not cargadas})
+            if self.__debug:
+                print(filas[-1])
+
+        return pd.DataFrame(filas)
+
+    def neural_export(self, data_path = 'data', models_path = 'models', repeats = 20):
+        '''
+        Compara el modelo de Deep Learning exportado a NumPy (float32 e int8) con el modelo .h5 sobre 'X_test.df':
+        diferencia de las predicciones, R2, tamaño de los pesos, tiempo de carga y latencia (ver idealistaexport.parity).
+        '''
+        resultado = parity(data_path, models_path, repeats=repeats)
+        if self.__debug:
+            print(resultado)
+
+        return resultado
+
+    def history(self, n_rows = 100000, days = 5, change_fraction = 0.03, new_fraction = 0.01, delist_fraction = 0.01):
+        '''
+        Simula varias descargas diarias completas del mercado (con una proporción de anuncios que cambian de precio o
+        de estado, nuevos y retirados) y mide IdealistaListingHistory.apply: tiempo y filas que pasan a la limpieza
+        y la predicción frente al total de anuncios de la descarga.
+
+        Parametros:
+        * n_rows: anuncios de la primera descarga
+        * days: número de descargas
+        * change_fraction, new_fraction, delist_fraction: proporción diaria de anuncios modificados, nuevos y retirados
+        Resultado:
+        * DataFrame con una fila por descarga: anuncios, inserts, updates, deletes, proporción de filas a procesar,
+          segundos de apply y si los cambios detectados coinciden con los simulados
+        '''
+        rng = np.random.default_rng(self.__seed)
+        mercado = self.__synthetic.listings(n_rows)
+        siguiente = int(mercado["propertyCode"].max()) + 1
+        filas = []
+        with tempfile.TemporaryDirectory() as directorio:
+            history = IdealistaListingHistory(directorio)
+            for dia in range(days):
+                esperado = {"insert": mercado.shape[0] if dia == 0 else 0, "update": 0, "delete": 0}
+                if dia > 0:
+                    mercado = mercado.copy()
+                    n = mercado.shape[0]
+                    cambian = rng.random(n) < change_fraction
+                    mercado.loc[cambian, "price"] = (mercado.loc[cambian, "price"] * rng.uniform(0.9, 0.99, cambian.sum())).astype('int64')
+                    retirados = rng.random(n) < delist_fraction
+                    nuevos = self.__synthetic.listings(int(n * new_fraction))
+                    nuevos["propertyCode"] = np.arange(siguiente, siguiente + nuevos.shape[0])
+                    siguiente += nuevos.shape[0]
+                    esperado = {"insert": nuevos.shape[0], "update": int((cambian & ~retirados).sum()),
+                                "delete": int(retirados.sum())}
+                    mercado = pd.concat([mercado[~retirados], nuevos], ignore_index=True)
+
+                inicio = time.perf_counter()
+                changed_df, delisted = history.apply(mercado, timestamp="dia " + str(dia))
+                segundos = time.perf_counter() - inicio
+                detectado = {"insert": int((changed_df["change"] == 'insert').sum()),
+                             "update": int((changed_df["change"] == 'update').sum()), "delete": delisted.shape[0]}
+                filas.append(dict(day=dia, listings=mercado.shape[0], **detectado,
+                                  processed_fraction=changed_df.shape[0] / mercado.shape[0], seconds=segundos,
+                                  equal=detectado == esperado))
+                if self.__debug:
+                    print(filas[-1])
+
+        return pd.DataFrame(filas)
+
+    def out_of_core(self, chunksizes = (1000, 3000), n_rows = 500000, chunksize = 50000, trees_per_chunk = 10,
+                    max_depth = 12, data_path = 'data', neural = None):
+        '''
+        Compara el entrenamiento por trozos de IdealistaOutOfCoreTrainer con el entrenamiento en memoria:
+        - Precisión: con 'X_train.df'/'y_train.serie' y 'X_test.df'/'y_test.serie' grabados con el formato de
+          'idealista_madrid_model1.csv', para cada tamaño de trozo (ver IdealistaOutOfCoreTrainer.compare).
+        - Memoria: con un dataset de n_rows anuncios (X_train repetido con un poco de ruido), pico de memoria de Python
+          (tracemalloc) de este proceso al entrenar el bosque por trozos y en memoria.
+
+        Parametros:
+        * chunksizes: tamaños de trozo de la comparación de precisión
+        * n_rows: anuncios del dataset de la comparación de memoria
+        * chunksize: tamaño de trozo de la comparación de memoria
+        * trees_per_chunk: árboles que se entrenan con cada trozo
+        * max_depth: profundidad de los árboles de la comparación de memoria
+        * data_path: directorio con 'X_train.df', 'y_train.serie', 'X_test.df', 'y_test.serie' y 'features_selected.npz'
+        * neural: si vale True se entrena también la red neuronal. Por defecto, solo si keras está instalado
+        Resultado:
+        * Tupla (accuracy_df, memory_df)
+        '''
+        if neural is None:
+            try:
+                import keras
+                neural = True
+            except ImportError:
+                neural = False
+        X_train = pd.read_pickle(os.path.join(data_path, 'X_train.df'))
+        y_train = pd.read_pickle(os.path.join(data_path, 'y_train.serie'))
+        X_test = pd.read_pickle(os.path.join(data_path, 'X_test.df'))
+        y_test = pd.read_pickle(os.path.join(data_path, 'y_test.serie'))
+        features = [str(feature) for feature in np.load(os.path.join(data_path, 'features_selected.npz'),
+                                                        allow_pickle=True)['features_selected']]
+
+        with tempfile.TemporaryDirectory() as directorio:
+            train_file = os.path.join(directorio, 'train.csv')
+            test_file = os.path.join(directorio, 'test.csv')
+            X_train.assign(price=y_train.to_numpy()).to_csv(train_file, index=False)
+            X_test.assign(price=y_test.to_numpy()).to_csv(test_file, index=False)
+
+            comparaciones = []
+            for tamano in chunksizes:
+                trainer = IdealistaOutOfCoreTrainer(features, chunksize=tamano, trees_per_chunk=trees_per_chunk,
+                                                    neural=neural, random_state=self.__seed)
+                comparacion = trainer.compare(train_file, test_file)
+                comparacion.insert(0, "chunksize", tamano)
+                comparaciones.append(comparacion)
+            accuracy_df = pd.concat(comparaciones, ignore_index=True)
+            if self.__debug:
+                print(accuracy_df)
+
+            # Dataset grande: X_train repetido con ruido en las features continuas, escrito por trozos
+            rng = np.random.default_rng(self.__seed)
+            grande_file = os.path.join(directorio, 'large.csv')
+            repeticiones = int(np.ceil(n_rows / X_train.shape[0]))
+            for n in range(repeticiones):
+                copia = X_train.assign(price=y_train.to_numpy())
+                for columna in ["size", "latitude", "longitude", "distance", "priceByArea", "price"]:
+                    copia[columna] = copia[columna] * rng.normal(1, 0.01, copia.shape[0])
+                copia.iloc[:max(0, min(copia.shape[0], n_rows - n * X_train.shape[0]))].to_csv(
+                    grande_file, mode='a', header=n == 0, index=False)
+
+            filas = []
+            tracemalloc.start()
+            trainer = IdealistaOutOfCoreTrainer(features, chunksize=chunksize, trees_per_chunk=trees_per_chunk,
+                                                max_depth=max_depth, neural=False, random_state=self.__seed)
+            inicio = time.perf_counter()
+            trainer.fit(grande_file)
+            filas.append({"training": "out_of_core", "rows": trainer.n_samples_, "trees": trainer.forest.n_estimators,
+                          "seconds": time.perf_counter() - inicio, "peak_mb": tracemalloc.get_traced_memory()[1] / 2**20})
+
+            tracemalloc.reset_peak()
+            inicio = time.perf_counter()
+            grande_df = pd.read_csv(grande_file, usecols=features + ["price"])
+            X = grande_df[features].to_numpy(np.float64)
+            from sklearn.ensemble import RandomForestRegressor
+            from sklearn.preprocessing import MinMaxScaler
+            forest = RandomForestRegressor(n_estimators=trainer.forest.n_estimators, max_depth=max_depth, n_jobs=-1,
+                                           random_state=self.__seed)
+            forest.fit(MinMaxScaler().fit_transform(X), grande_df["price"].to_numpy(np.float64))
+            filas.append({"training": "in_memory", "rows": X.shape[0], "trees": forest.n_estimators,
+                          "seconds": time.perf_counter() - inicio, "peak_mb": tracemalloc.get_traced_memory()[1] / 2**20})
+            tracemalloc.stop()
+
+        memory_df = pd.DataFrame(filas)
+        if self.__debug:
+            print(memory_df)
+
+        return accuracy_df, memory_df
+
+    def feature_selection(self, max_samples = 0.3, data_path = 'data'):
+        '''
+        Compara la selección de features secuencial de main.ipynb (data.corr(), SelectKBest y un RandomForestRegressor
+        de 200 árboles con n_jobs por defecto) con IdealistaFeatureSelector: sin caché, con la caché ya cargada, al
+        añadir una columna y con los árboles entrenados con una muestra de 'max_samples' anuncios.
+
+        Parametros:
+        * max_samples: proporción de anuncios de cada árbol en el último modo
+        * data_path: directorio con 'X_train.df', 'y_train.serie' y 'features_selected.npz'
+        Resultado:
+        * DataFrame con los segundos de cada modo y si reproduce las features de 'features_selected.npz'
+        '''
+        from sklearn.ensemble import RandomForestRegressor
+        from sklearn.feature_selection import SelectKBest, f_regression
+
+        X_train = pd.read_pickle(os.path.join(data_path, 'X_train.df'))
+        y_train = pd.read_pickle(os.path.join(data_path, 'y_train.serie'))
+        referencia = {str(feature) for feature in np.load(os.path.join(data_path, 'features_selected.npz'),
+                                                          allow_pickle=True)['features_selected']}
+
+        filas = []
+        inicio = time.perf_counter()
+        train_df = pd.concat([X_train, y_train], axis=1)
+        corr_price = np.abs(train_df.corr()['price'])
+        correlacion = train_df.drop(columns=corr_price[(corr_price < 0.1) | np.isnan(corr_price)].index.values) \
+                              .columns.drop(labels=['price', 'isParkingSpaceIncludedInPrice']).values
+        X = X_train.drop(columns=['status_newdevelopment', 'isParkingSpaceIncludedInPrice'])
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            sel = SelectKBest(f_regression, k=len(correlacion)).fit(X, y_train)
+        kbest = pd.Series(sel.scores_, index=X.columns).sort_values(ascending=False).index[:len(correlacion)]
+        rf = RandomForestRegressor(n_estimators=200, random_state=self.__seed).fit(X, y_train)
+        forest = pd.Series(rf.feature_importances_, index=X.columns).sort_values(ascending=False).index[:len(correlacion)]
+        votos = pd.Series(np.concatenate([correlacion, kbest, forest])).value_counts()
+        filas.append({"mode": "main.ipynb", "seconds": time.perf_counter() - inicio,
+                      "reproduces": set(votos[votos > 1].index) == referencia})
+
+        with tempfile.TemporaryDirectory() as directorio:
+            cache_file = os.path.join(directorio, "feature_selection_cache.json")
+            modos = [("IdealistaFeatureSelector", X_train, None), ("IdealistaFeatureSelector (caché)", X_train, None),
+                     ("IdealistaFeatureSelector (+1 columna)",
+                      X_train.assign(ruido=np.random.default_rng(self.__seed).normal(size=X_train.shape[0])), None),
+                     ("IdealistaFeatureSelector (max_samples=" + str(max_samples) + ")", X_train, max_samples)]
+            for modo, X, muestra in modos:
+                selector = IdealistaFeatureSelector(max_samples=muestra, random_state=self.__seed, cache_file=cache_file)
+                inicio = time.perf_counter()
+                features = selector.select(X, y_train)
+                filas.append({"mode": modo, "seconds": time.perf_counter() - inicio,
+                              "reproduces": set(features) == referencia, "new_columns": selector.timing_["new_columns"],
+                              "forest_cached": selector.timing_["forest_cached"]})
+                if self.__debug:
+                    print(filas[-1])
+
+        return pd.DataFrame(filas)
+
+    def __suite_stages(self, n_rows, directorio, predictor):
+        '''
+        Método "privado".
+        Prepara las etapas de 'suite' para n_rows viviendas sintéticas. Cada etapa es (nombre, función sin argumentos);
+        la preparación de los datos de entrada de cada etapa no forma parte de la medida.
+        '''
+        idealista = Idealista()
+        idealista_fe = IdealistaFeatureEngineering()
+        listings_df = self.__synthetic.listings(n_rows)
+        listings_df["isParkingSpaceIncludedInPrice"] = listings_df["hasParkingSpace"]
+        listings_df["newDevelopmentFinished"] = np.nan
+
+        # Ingestión: ficheros JSON de 50 viviendas como los que graba el crawler
+        elementos = self.__synthetic.api_elements(n_rows)
+        for pagina, inicio in enumerate(range(0, n_rows, 50)):
+            idealista.elementlist_tojson({"elementList": elementos[inicio:inicio + 50]},
+                                         os.path.join(directorio, str(pagina) + ".json"))
+
+        def ingestion():
+            idealista_df = idealista.read_jsons(directorio)
+            idealista.clean_dataframe(idealista_df)
+            return idealista_df
+
+        def cleaning(idealista_df = listings_df):
+            idealista_df = idealista_df.copy()
+            idealista_df["newDevelopmentFinished"] = idealista_df["newDevelopmentFinished"].fillna(0.0)
+            idealista_df["status"] = idealista_df["status"].fillna(idealista_df["status"].mode()[0])
+            idealista_df["floor"] = idealista_fe.floors_2_number(idealista_df["floor"]).astype(np.float64)
+            return idealista_df
+
+        limpio_df = cleaning()
+
+        def imputation():
+            idealista_df = limpio_df.copy()
+            idealista_fe.fillna_floor(idealista_df)
+            idealista_fe.fillna_haslift(idealista_df)
+            return idealista_df
+
+        imputado_df = imputation()
+
+        def encoding():
+            fe = IdealistaFeatureEngineering()
+            partes = [imputado_df.drop(columns=["codbar", "coddistrit", "codbarrio"]),
+                      fe.create_featurehasher_cached(imputado_df["codbar"].astype(str), 5, "codbar"),
+                      fe.create_featurehasher_cached(imputado_df["coddistrit"].astype(str), 3, "coddistrit")]
+            model_df = pd.concat(partes, axis=1)
+            model_df = pd.get_dummies(model_df, columns=["propertyType", "status"], dtype=np.uint8)
+            fe.feateures_bool_2_number(model_df)
+            return model_df
+
+        model_df = encoding()
+
+        etapas = [("ingestion", ingestion), ("cleaning", cleaning), ("imputation", imputation), ("encoding", encoding),
+                  ("distance", lambda: IdealistaDistance().distance_to_center(imputado_df))]
+        if predictor is not None:
+            for feature in predictor.features:
+                if feature not in model_df.columns:
+                    model_df[feature] = 0
+            etapas.append(("prediction", lambda: predictor.predict(model_df)))
+
+        return etapas
+
+    def suite(self, sizes = (10000, 100000), repeats = 3, data_path = 'data', models_path = 'models', output = None):
+        '''
+        Benchmark de extremo a extremo de las etapas del proyecto con viviendas sintéticas (esquema de
+        'idealista_madrid.csv'): ingestión (read_jsons + clean_dataframe), limpieza, imputación, codificación
+        (FeatureHasher + dummies), distancia al centro y predicción con el mejor modelo de Machine Learning.
+        Cada etapa se mide 'repeats' veces (se toma la menor) y una vez más con tracemalloc para el pico de memoria.
+        Además se ejecuta una pasada con IdealistaProfiler sobre las clases de idealistatools, para obtener el tiempo
+        y las llamadas de cada método.
+
+        Parametros:
+        * sizes: número de viviendas sintéticas
+        * repeats: repeticiones de cada medida
+        * data_path, models_path: directorios de los artefactos del predictor (si no existen se omite la predicción)
+        * output: si se indica, fichero JSON donde se graban las etapas y los métodos (ver 'compare')
+        Resultado:
+        * Tupla (DataFrame de etapas, DataFrame de métodos). Etapas: filas, segundos, filas por segundo y pico de memoria
+        '''
+        predictor = None
+        if os.path.exists(os.path.join(models_path, 'best_GridSearchCV.gs')):
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                predictor = IdealistaPredictor(data_path, models_path, load_neural=False)
+
+        filas = []
+        profiler = IdealistaProfiler()
+        for n_rows in sizes:
+            with tempfile.TemporaryDirectory() as directorio:
+                for nombre, etapa in self.__suite_stages(n_rows, directorio, predictor):
+                    segundos = min(self.__time(etapa) for _ in range(repeats))
+                    tracemalloc.start()
+                    etapa()
+                    pico = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    with profiler.instrument(Idealista, IdealistaFeatureEngineering, IdealistaImputer,
+                                             IdealistaDistance, IdealistaPredictor):
+                        with profiler.record("suite." + nombre + "." + str(n_rows)):
+                            etapa()
+                    filas.append({"stage": nombre, "rows": n_rows, "seconds": segundos,
+                                  "rows_per_second": n_rows / segundos, "peak_mb": pico / 2**20})
+                    if self.__debug:
+                        print(filas[-1])
+
+        etapas_df = pd.DataFrame(filas)
+        metodos_df = profiler.stats()
+        if output is not None:
+            with open(output, 'w') as outfile:
+                json.dump({"stages": filas, "methods": profiler.to_json()}, outfile, indent=1)
+
+        return etapas_df, metodos_df
+
+    def compare(self, stages, baseline, tolerance = 1.5):
+        '''
+        Compara las etapas de 'suite' con las de una ejecución anterior para detectar regresiones.
+
+        Parametros:
+        * stages: DataFrame de etapas de 'suite' o fichero JSON grabado por 'suite'
+        * baseline: fichero JSON grabado por 'suite' con la ejecución de referencia
+        * tolerance: una etapa es una regresión si tarda más de 'tolerance' veces lo que tardaba
+        Resultado:
+        * DataFrame con los segundos de cada etapa en la referencia y ahora, su cociente y si es una regresión
+        '''
+        def leer(etapas):
+            if isinstance(etapas, pd.DataFrame):
+                return etapas
+            with open(etapas) as infile:
+                return pd.DataFrame(json.load(infile)["stages"])
+
+        comparacion = leer(baseline)[["stage", "rows", "seconds"]].merge(
+            leer(stages)[["stage", "rows", "seconds"]], on=["stage", "rows"], suffixes=("_baseline", ""))
+        comparacion["ratio"] = comparacion["seconds"] / comparacion["seconds_baseline"]
+        comparacion["regression"] = comparacion["ratio"] > tolerance
+        if self.__debug:
+            print(comparacion)
+
+        return comparacion
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks de las herramientas del proyecto")
+    parser.add_argument("--suite", action="store_true", help="ejecutar el benchmark de extremo a extremo")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", help="fichero JSON con el resultado de la suite")
+    parser.add_argument("--baseline", help="fichero JSON de una ejecución anterior con el que comparar")
+    parser.add_argument("--tolerance", type=float, default=1.5)
+    args = parser.parse_args()
+
+    benchmark = IdealistaBenchmark(debug=True)
+    if not args.suite:
+        print(benchmark.imputation())
+    else:
+        etapas_df, metodos_df = benchmark.suite(args.sizes, args.repeats, output=args.output)
+        print(metodos_df.head(20).to_string())
+        if args.baseline:
+            # Código de salida 1 si alguna etapa es más lenta que la referencia (para el cron)
+            sys.exit(1 if benchmark.compare(etapas_df, args.baseline, args.tolerance)["regression"].any() else 0)
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .idealistatools import Idealista
+
+class IdealistaRateLimiter:
+    '''
+    Limitador de peticiones por segundo (token bucket) compartido por los hilos del crawler.
+    '''
+
+    def __init__(self, rate, capacity = 1):
+        '''
+        Constructor
+        Parametros:
+            rate: número de peticiones por segundo permitidas
+            capacity: número máximo de peticiones que se pueden acumular para hacer una ráfaga
+        '''
+        self.__rate = float(rate)
+        self.__capacity = float(capacity)
+        self.__tokens = float(capacity)
+        self.__last = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def acquire(self):
+        '''
+        Espera hasta que haya un token disponible y lo consume.
+        '''
+        while True:
+            with self.__lock:
+                now = time.monotonic()
+                self.__tokens = min(self.__capacity, self.__tokens + (now - self.__last) * self.__rate)
+                self.__last = now
+                if self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return
+                espera = (1 - self.__tokens) / self.__rate
+            time.sleep(espera)
+
+class IdealistaCrawler:
+    '''
+    Clase que descarga todas las páginas de una o varias búsquedas de la API de Idealista.
+    Las páginas se piden en paralelo con un número acotado de hilos, respetando un límite de peticiones por segundo
+    y reutilizando las conexiones HTTP. Las peticiones con error 429/5xx se reintentan con espera exponencial,
+    el token se regenera cuando caduca (401) y el progreso se guarda en un fichero de checkpoint para poder
+    reanudar una descarga interrumpida sin volver a pedir las páginas ya descargadas.
+    '''
+
+    codigos_reintento = (429, 500, 502, 503, 504)
+
+    def __init__(self, api_key = None, api_secret = None, token = None, output_dir = '', checkpoint_file = None,
+                 max_workers = 4, requests_per_second = 1.0, max_retries = 5, backoff_factor = 1.0,
+                 url_token = None, url_search = None, debug = False):
+        '''
+        Constructor
+        Parametros:
+            api_key, api_secret: credenciales de la API. Si se indican, el token se genera y se regenera al caducar
+            token: token ya generado (alternativa a api_key/api_secret). Hay que indicar api_key o token
+            output_dir: directorio donde se graba el "elementList" de cada página
+            checkpoint_file: fichero JSON con el progreso. Por defecto 'crawler_checkpoint.json' en output_dir
+            max_workers: número máximo de peticiones simultáneas
+            requests_per_second: límite de peticiones por segundo
+            max_retries: número máximo de reintentos por página
+            backoff_factor: segundos de espera del primer reintento (se duplica en cada reintento)
+            url_token, url_search: urls alternativas de la API (por ejemplo, un servidor local de pruebas)
+            debug: si vale True muestra mensajes de debug
+        '''
+        if api_key is None and token is None:
+            raise ValueError("Hay que indicar las credenciales de la API (api_key y api_secret) o un token")
+        self.__api_key = api_key
+        self.__api_secret = api_secret
+        self.__output_dir = output_dir
+        self.__checkpoint_file = checkpoint_file if checkpoint_file is not None else \
+            os.path.join(output_dir, 'crawler_checkpoint.json')
+        self.__max_workers = max_workers
+        self.__max_retries = max_retries
+        self.__backoff_factor = backoff_factor
+        self.__debug = debug
+
+        self.__session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.__session.mount('http://', adapter)
+        self.__session.mount('https://', adapter)
+
+        self.__idealista = Idealista(debug=debug, url_token=url_token, url_search=url_search, session=self.__session)
+        if token is not None:
+            self.__idealista.set_token(token)
+        self.__rate_limiter = IdealistaRateLimiter(requests_per_second)
+        self.__token_lock = threading.Lock()
+        self.__checkpoint_lock = threading.Lock()
+        self.__checkpoint = self.__load_checkpoint()
+
+    def __load_checkpoint(self):
+        if os.path.exists(self.__checkpoint_file):
+            with open(self.__checkpoint_file) as infile:
+                return json.load(infile)
+        return {}
+
+    def __save_checkpoint(self):
+        '''
+        Método "privado".
+        Graba el checkpoint en un fichero temporal y lo renombra, para no dejar un fichero a medias si se interrumpe.
+        '''
+        tmp_file = self.__checkpoint_file + '.tmp'
+        with open(tmp_file, 'w') as outfile:
+            json.dump(self.__checkpoint, outfile)
+        os.replace(tmp_file, self.__checkpoint_file)
+
+    def __search_key(self, center, distance, country, maxItems, propertyType, operation):
+        '''
+        Método "privado".
+        Clave de una búsqueda en el checkpoint y en los nombres de los ficheros: incluye todos los parámetros que
+        cambian las viviendas o la paginación, para no mezclar páginas de búsquedas distintas al reanudar.
+        '''
+        return "|".join([center, distance, country, maxItems, propertyType, operation])
+
+    def __page_file(self, key, numPage):
+        nombre = key.replace('|', '_').replace(',', '_').replace('.', '-')
+        return os.path.join(self.__output_dir, 'idealista_' + nombre + '_' + str(numPage) + '.json')
+
+    def __refresh_token(self, token_usado):
+        '''
+        Método "privado".
+        Regenera el token si nadie lo ha hecho ya desde que se hizo la petición que ha fallado.
+        '''
+        with self.__token_lock:
+            if self.__idealista.get_token() == token_usado and self.__api_key is not None:
+                if self.__debug:
+                    print("Regenerando token")
+                self.__idealista.generate_token(api_key=self.__api_key, api_secret=self.__api_secret)
+
+    def __request_page(self, api_url):
+        '''
+        Método "privado".
+        Pide una página a la API aplicando el límite de peticiones, los reintentos y la regeneración del token.
+
+        Argumentos:
+        * api_url: url de la función search
+
+        Resultado:
+        * JSON con el resultado de la función search
+        '''
+        intento, renovaciones = 0, 0
+        while intento <= self.__max_retries and renovaciones <= self.__max_retries:
+            self.__rate_limiter.acquire()
+            token = self.__idealista.get_token()
+            espera = self.__backoff_factor * 2 ** intento
+            try:
+                r = self.__session.post(api_url, headers={"Authorization": "Bearer " + token})
+            except requests.exceptions.ConnectionError as ex:
+                if self.__debug:
+                    print("Error de conexión:", ex)
+                intento += 1
+                time.sleep(espera)
+                continue
+
+            if r.status_code == 200:
+                return r.json()
+            if r.status_code == 401 and self.__api_key is not None:
+                # Los 401 por token caducado no cuentan como reintentos
+                renovaciones += 1
+                self.__refresh_token(token)
+                continue
+            if r.status_code in self.codigos_reintento:
+                retry_after = r.headers.get('Retry-After')
+                if retry_after is not None and retry_after.isdigit():
+                    espera = max(espera, float(retry_after))
+                if self.__debug:
+                    print("HTTP", r.status_code, "reintento", intento + 1, "en", espera, "s:", api_url)
+                intento += 1
+                time.sleep(espera)
+                continue
+            r.raise_for_status()
+
+        raise RuntimeError("Se ha superado el número máximo de reintentos: " + api_url)
+
+    def __fetch_page(self, key, center, numPage, country, maxItems, distance, propertyType, operation):
+        '''
+        Método "privado".
+        Descarga una página, graba su "elementList" y la marca como descargada en el checkpoint.
+
+        Resultado:
+        * Tupla (clave de la búsqueda, página, totalPages)
+        '''
+        api_url = self.__idealista.search_url(center, country, str(numPage), maxItems, distance, propertyType, operation)
+        result = self.__request_page(api_url)
+        summary = self.__idealista.summary_result(result)
+        self.__idealista.elementlist_tojson(result, self.__page_file(key, numPage))
+
+        with self.__checkpoint_lock:
+            estado = self.__checkpoint.setdefault(key, {"totalPages": None, "pages": []})
+            estado["totalPages"] = summary["totalPages"]
+            estado["pages"].append(numPage)
+            self.__save_checkpoint()
+
+        return key, numPage, summary["totalPages"]
+
+    def crawl(self, centers, country='es', maxItems='50', propertyType='homes', operation='sale'):
+        '''
+        Descarga todas las páginas de las búsquedas indicadas. Para cada búsqueda se pide la primera página
+        (si no se había descargado ya) para conocer 'totalPages' y después el resto de páginas pendientes.
+
+        Parametros:
+        * centers: lista de tuplas (center, distance), con center en formato 'latitud,longitud' y distance en metros
+        * country, maxItems, propertyType, operation: mismos argumentos que Idealista.search
+        Resultado:
+        * Lista con los ficheros JSON de todas las páginas de las búsquedas (descargadas ahora o en ejecuciones anteriores)
+        '''
+        if self.__idealista.get_token() is None:
+            self.__idealista.generate_token(api_key=self.__api_key, api_secret=self.__api_secret)
+
+        maxItems = str(maxItems)
+        busquedas = {}
+        for center, distance in centers:
+            busquedas[self.__search_key(center, str(distance), country, maxItems, propertyType, operation)] = \
+                (center, str(distance))
+
+        with ThreadPoolExecutor(max_workers=self.__max_workers) as executor:
+            def submit(key, numPage):
+                center, distance = busquedas[key]
+                return executor.submit(self.__fetch_page, key, center, numPage, country, maxItems,
+                                       distance, propertyType, operation)
+
+            def submit_pendientes(key, totalPages):
+                with self.__checkpoint_lock:
+                    descargadas = set(self.__checkpoint.get(key, {}).get("pages", []))
+                return [submit(key, pagina) for pagina in range(1, totalPages + 1) if pagina not in descargadas]
+
+            pendientes = []
+            for key in busquedas:
+                totalPages = self.__checkpoint.get(key, {}).get("totalPages")
+                if totalPages is None:
+                    pendientes.append(submit(key, 1))
+                else:
+                    pendientes.extend(submit_pendientes(key, totalPages))
+
+            while pendientes:
+                siguientes = []
+                for future in as_completed(pendientes):
+                    key, numPage, totalPages = future.result()
+                    if self.__debug:
+                        print(key, "página", numPage, "de", totalPages)
+                    if numPage == 1:
+                        siguientes.extend(submit_pendientes(key, totalPages))
+                pendientes = siguientes
+
+        ficheros = []
+        for key in busquedas:
+            estado = self.__checkpoint.get(key, {})
+            ficheros.extend(self.__page_file(key, pagina) for pagina in sorted(estado.get("pages", [])))
+
+        return ficheros
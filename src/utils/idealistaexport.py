@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import pickle
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+class IdealistaNumpyNetwork:
+    '''
+    Red densa (Dense + activación) ejecutada con NumPy, exportada del modelo de Deep Learning de main.ipynb
+    ('idealista_model.h5') sin necesidad de TensorFlow ni keras:
+    - Los pesos se leen del fichero .h5 con h5py.
+    - El MinMaxScaler de las features se integra en la primera capa (W' = diag(scale) W, b' = b + min W), de modo
+      que la red recibe las features sin escalar.
+    - El MinMaxScaler del target se aplica a la salida, así que predict devuelve directamente el precio.
+    - Los pesos se guardan en float32 o en int8 con una escala por fila (por feature de entrada de cada capa);
+      con int8 la entrada de la capa se multiplica por la escala antes del producto con los pesos enteros.
+      int8 no es equivalente: sobre X_test el error llega a unos 69.000 € (unos 30.000 € de media) frente a
+      céntimos con float32, así que solo tiene sentido si el tamaño de los pesos importa más que la precisión.
+    El resultado se graba en un único .npz sin pickle.
+    '''
+
+    activaciones = {
+        "linear": lambda x: x,
+        "tanh": np.tanh,
+        "relu": lambda x: np.maximum(x, 0),
+        "sigmoid": lambda x: 1 / (1 + np.exp(-x))
+    }
+
+    def __init__(self, layers, y_min = 0.0, y_range = 1.0, features = None, debug = False):
+        '''
+        Constructor
+        Parametros:
+            layers: lista de diccionarios con 'kernel' (n_entrada, n_salida), 'bias', 'activation' y, si los pesos
+                    son int8, 'scale' (n_entrada)
+            y_min, y_range: mínimo y rango del target con los que se escaló para el entrenamiento
+            features: lista de features de la entrada, en orden
+            debug: si vale True muestra mensajes de debug
+        '''
+        for layer in layers:
+            if layer["activation"] not in self.activaciones:
+                raise ValueError("Activación no soportada: " + str(layer["activation"]))
+        self.layers = layers
+        self.y_min = float(y_min)
+        self.y_range = float(y_range)
+        self.features = None if features is None else [str(feature) for feature in features]
+        self.__debug = debug
+
+    @staticmethod
+    def read_h5(file):
+        '''
+        Lee las capas Dense de un modelo Sequential grabado por keras en formato .h5 (pesos en float64).
+
+        Parametros:
+        * file: fichero .h5 (p. ej. 'models/idealista_model.h5')
+        Resultado:
+        * Lista de capas con el formato del constructor
+        '''
+        import h5py
+
+        layers = []
+        with h5py.File(file, 'r') as h5:
+            config = json.loads(h5.attrs['model_config'])
+            pesos = h5['model_weights'] if 'model_weights' in h5 else h5
+            for capa in config['config']['layers']:
+                if capa['class_name'] == 'InputLayer':
+                    continue
+                if capa['class_name'] != 'Dense':
+                    raise ValueError("Capa no soportada: " + capa['class_name'])
+                grupo = pesos[capa['config']['name']]
+                nombres = [nombre.decode('utf-8') if isinstance(nombre, bytes) else nombre
+                           for nombre in grupo.attrs['weight_names']]
+                kernel = np.asarray(grupo[nombres[0]], dtype=np.float64)
+                bias = np.asarray(grupo[nombres[1]], dtype=np.float64) if capa['config'].get('use_bias', True) \
+                    else np.zeros(kernel.shape[1])
+                layers.append({"kernel": kernel, "bias": bias, "activation": capa['config']['activation']})
+
+        return layers
+
+    @staticmethod
+    def write_h5(file, layers):
+        '''
+        Reescribe en un fichero .h5 de keras los pesos de sus capas Dense (el resto del fichero no cambia).
+
+        Parametros:
+        * file: fichero .h5 con la misma arquitectura (p. ej. 'models/idealista_model.h5')
+        * layers: lista de capas con el formato del constructor, sin cuantizar
+        '''
+        import h5py
+
+        with h5py.File(file, 'r+') as h5:
+            config = json.loads(h5.attrs['model_config'])
+            pesos = h5['model_weights'] if 'model_weights' in h5 else h5
+            densas = [capa for capa in config['config']['layers'] if capa['class_name'] == 'Dense']
+            if len(densas) != len(layers):
+                raise ValueError("El fichero tiene " + str(len(densas)) + " capas Dense y se han pasado " + str(len(layers)))
+            for capa, layer in zip(densas, layers):
+                grupo = pesos[capa['config']['name']]
+                nombres = [nombre.decode('utf-8') if isinstance(nombre, bytes) else nombre
+                           for nombre in grupo.attrs['weight_names']]
+                grupo[nombres[0]][...] = np.asarray(layer["kernel"], dtype=grupo[nombres[0]].dtype)
+                if capa['config'].get('use_bias', True):
+                    grupo[nombres[1]][...] = np.asarray(layer["bias"], dtype=grupo[nombres[1]].dtype)
+
+    def fold_scaler(self, scale, min_):
+        '''
+        Integra en la primera capa un escalado X * scale + min_ (el de MinMaxScaler.transform).
+        Con pesos int8 el escalado se integra en la escala de cada fila y el bias se calcula con los pesos ya
+        cuantizados, para que el desplazamiento min_ se cancele exactamente (por eso en int8 hay que cuantizar antes).
+        '''
+        primera = self.layers[0]
+        scale = np.asarray(scale, dtype=np.float64)
+        min_ = np.asarray(min_, dtype=np.float64)
+        if "scale" in primera:
+            filas = primera["scale"].astype(np.float64)
+            kernel = primera["kernel"].astype(np.float64)
+            primera["bias"] = (primera["bias"] + (min_ * filas) @ kernel).astype(primera["bias"].dtype)
+            primera["scale"] = (filas * scale).astype(primera["scale"].dtype)
+        else:
+            primera["bias"] = (primera["bias"] + min_ @ primera["kernel"]).astype(primera["bias"].dtype)
+            primera["kernel"] = (scale[:, np.newaxis] * primera["kernel"]).astype(primera["kernel"].dtype)
+
+        return self
+
+    def quantize(self, dtype = 'float32'):
+        '''
+        Convierte los pesos al tipo indicado.
+
+        Parametros:
+        * dtype: 'float32' o 'int8'. Con 'int8' cada fila del kernel se escala a [-127, 127] (cuantización simétrica
+          por feature de entrada, que se adapta a las escalas muy distintas de las features tras integrar el
+          MinMaxScaler); los bias se mantienen en float32. Con 'int8' las predicciones se alejan hasta unos 69.000 €
+          (unos 30.000 € de media sobre X_test) de las del modelo .h5
+        '''
+        if dtype not in ('float32', 'int8'):
+            raise ValueError("dtype debe ser 'float32' o 'int8': " + str(dtype))
+        for layer in self.layers:
+            if "scale" in layer:
+                raise ValueError("Los pesos ya están cuantizados")
+            kernel = np.asarray(layer["kernel"], dtype=np.float64)
+            if dtype == 'int8':
+                escala = np.abs(kernel).max(axis=1) / 127
+                escala[escala == 0] = 1
+                layer["kernel"] = np.round(kernel / escala[:, np.newaxis]).astype(np.int8)
+                layer["scale"] = escala.astype(np.float32)
+            else:
+                layer["kernel"] = kernel.astype(np.float32)
+            layer["bias"] = np.asarray(layer["bias"], dtype=np.float32)
+
+        return self
+
+    def predict(self, X):
+        '''
+        Predice el precio de un lote de viviendas.
+
+        Parametros:
+        * X: array (n, nro. de features) con las features sin escalar, en el orden de 'features', o un DataFrame
+          con esas columnas
+        Resultado:
+        * Array de n elementos con el precio
+        '''
+        if isinstance(X, pd.DataFrame):
+            X = X[self.features] if self.features is not None else X
+        dtype = np.float64 if self.layers[0]["kernel"].dtype == np.float64 else np.float32
+        salida = np.asarray(X, dtype=dtype)
+        for layer in self.layers:
+            if "scale" in layer:
+                salida = salida * layer["scale"]
+            salida = self.activaciones[layer["activation"]](salida @ layer["kernel"] + layer["bias"])
+
+        return salida[:, 0].astype(np.float64) * self.y_range + self.y_min
+
+    def nbytes(self):
+        '''
+        Memoria en bytes de los pesos.
+        '''
+        return sum(array.nbytes for layer in self.layers for clave, array in layer.items() if clave != "activation")
+
+    def save(self, file = 'models/idealista_model.npz'):
+        '''
+        Graba la red en un fichero .npz (sin pickle).
+        '''
+        arrays = {"y": np.array([self.y_min, self.y_range]),
+                  "activations": np.array([layer["activation"] for layer in self.layers])}
+        if self.features is not None:
+            arrays["features"] = np.array(self.features)
+        for n, layer in enumerate(self.layers):
+            for clave in ("kernel", "bias", "scale"):
+                if clave in layer:
+                    arrays[clave + "_" + str(n)] = layer[clave]
+        np.savez(file, **arrays)
+        if self.__debug:
+            print("Red grabada en", file, ":", self.nbytes(), "bytes de pesos")
+
+    @staticmethod
+    def load(file = 'models/idealista_model.npz'):
+        '''
+        Carga una red grabada con save.
+        '''
+        with np.load(file, allow_pickle=False) as data:
+            layers = []
+            for n, activation in enumerate(data["activations"]):
+                layer = {"kernel": data["kernel_" + str(n)], "bias": data["bias_" + str(n)], "activation": str(activation)}
+                if "scale_" + str(n) in data:
+                    layer["scale"] = data["scale_" + str(n)]
+                layers.append(layer)
+            features = list(data["features"]) if "features" in data else None
+
+            return IdealistaNumpyNetwork(layers, data["y"][0], data["y"][1], features)
+
+def export_keras_model(data_path = 'data', models_path = 'models', dtype = 'float32', file = None, debug = False):
+    '''
+    Exporta 'idealista_model.h5' a una IdealistaNumpyNetwork con el MinMaxScaler ('minmaxscaler.scaler') integrado
+    en la primera capa y el escalado del target calculado sobre 'y_train.serie', como en main.ipynb.
+
+    Parametros:
+    * data_path: directorio con 'features_selected.npz' e 'y_train.serie'
+    * models_path: directorio con 'idealista_model.h5' y 'minmaxscaler.scaler'
+    * dtype: 'float32', 'int8' o 'float64' (sin cuantizar, como referencia)
+    * file: si se indica, la red se graba en ese fichero .npz
+    * debug: si vale True muestra mensajes de debug
+    Resultado:
+    * La IdealistaNumpyNetwork
+    '''
+    data = np.load(os.path.join(data_path, 'features_selected.npz'), allow_pickle=True)
+    features = [str(feature) for feature in data['features_selected']]
+    with open(os.path.join(models_path, 'minmaxscaler.scaler'), 'rb') as archivo_entrada:
+        scaler = pickle.load(archivo_entrada)
+    y_train = pd.read_pickle(os.path.join(data_path, 'y_train.serie'))
+
+    network = IdealistaNumpyNetwork(IdealistaNumpyNetwork.read_h5(os.path.join(models_path, 'idealista_model.h5')),
+                                    float(y_train.min()), float(y_train.max()) - float(y_train.min()), features,
+                                    debug=debug)
+    if dtype == 'int8':
+        network.quantize(dtype).fold_scaler(scaler.scale_, scaler.min_)
+    elif dtype == 'float32':
+        network.fold_scaler(scaler.scale_, scaler.min_).quantize(dtype)
+    else:
+        network.fold_scaler(scaler.scale_, scaler.min_)
+    if file is not None:
+        network.save(file)
+
+    return network
+
+def parity(data_path = 'data', models_path = 'models', repeats = 20, debug = False):
+    '''
+    Compara las predicciones de la red exportada (float32 e int8) sobre 'X_test.df' con las del modelo .h5, y mide
+    la latencia de predicción de cada una.
+    La referencia es la ejecución con keras si está instalado; si no, la misma red en float64 sin integrar el
+    MinMaxScaler (el cálculo que hace keras, con más precisión), y la paridad con keras queda sin verificar: la
+    columna 'verified' vale False y la diferencia de la fila de referencia es NaN.
+    Los ficheros .npz se graban en un directorio temporal, no en 'models_path'.
+
+    Parametros:
+    * data_path: directorio con 'X_test.df', 'y_test.serie', 'y_train.serie' y 'features_selected.npz'
+    * models_path: directorio de los modelos
+    * repeats: número de repeticiones de cada medida de latencia
+    * debug: si vale True muestra mensajes de debug
+    Resultado:
+    * DataFrame con, por cada versión, la diferencia máxima y media con la referencia (en euros), si la referencia es
+      keras ('verified'), el R2 sobre y_test, los bytes de los pesos, el tiempo de carga y la latencia de un lote de 1 y de todo X_test
+    '''
+    from sklearn.metrics import r2_score
+
+    X_test = pd.read_pickle(os.path.join(data_path, 'X_test.df'))
+    y_test = pd.read_pickle(os.path.join(data_path, 'y_test.serie'))
+    referencia = export_keras_model(data_path, models_path, dtype='float64')
+    X = X_test[referencia.features].to_numpy(dtype=np.float64)
+
+    with open(os.path.join(models_path, 'minmaxscaler.scaler'), 'rb') as archivo_entrada:
+        scaler = pickle.load(archivo_entrada)
+    X_scal = X * scaler.scale_ + scaler.min_
+    try:
+        import keras.models
+
+        inicio = time.perf_counter()
+        keras_model = keras.models.load_model(os.path.join(models_path, 'idealista_model.h5'))
+        carga = time.perf_counter() - inicio
+        predecir = lambda X_lote: keras_model.predict(X_lote * scaler.scale_ + scaler.min_, verbose=0).ravel() * \
+            referencia.y_range + referencia.y_min
+        nombre_referencia = "keras"
+        verificado = True
+    except ImportError:
+        sin_integrar = IdealistaNumpyNetwork(IdealistaNumpyNetwork.read_h5(os.path.join(models_path, 'idealista_model.h5')),
+                                             referencia.y_min, referencia.y_range)
+        carga = None
+        predecir = lambda X_lote: sin_integrar.predict(X_lote * scaler.scale_ + scaler.min_)
+        nombre_referencia = "numpy float64 (keras no instalado)"
+        verificado = False
+    y_referencia = predecir(X)
+
+    def latencia(funcion, X_lote):
+        funcion(X_lote)
+        inicio = time.perf_counter()
+        for _ in range(repeats):
+            funcion(X_lote)
+        return (time.perf_counter() - inicio) / repeats
+
+    diferencia_referencia = 0.0 if verificado else np.nan
+    filas = [{"model": nombre_referencia, "max_abs_diff": diferencia_referencia, "mean_abs_diff": diferencia_referencia,
+              "verified": verificado, "r2": r2_score(y_test, y_referencia), "weights_bytes": None, "load_seconds": carga,
+              "latency_ms_1": 1000 * latencia(predecir, X[:1]), "latency_ms_batch": 1000 * latencia(predecir, X)}]
+    with tempfile.TemporaryDirectory() as directorio:
+        for dtype in ('float32', 'int8'):
+            fichero = os.path.join(directorio, 'idealista_model_' + dtype + '.npz')
+            export_keras_model(data_path, models_path, dtype=dtype, file=fichero)
+            inicio = time.perf_counter()
+            network = IdealistaNumpyNetwork.load(fichero)
+            carga = time.perf_counter() - inicio
+            y_pred = network.predict(X)
+            diferencia = np.abs(y_pred - y_referencia)
+            filas.append({"model": "numpy " + dtype, "max_abs_diff": diferencia.max(),
+                          "mean_abs_diff": diferencia.mean(), "verified": verificado, "r2": r2_score(y_test, y_pred),
+                          "weights_bytes": network.nbytes(), "load_seconds": carga,
+                          "latency_ms_1": 1000 * latencia(network.predict, X[:1]),
+                          "latency_ms_batch": 1000 * latencia(network.predict, X)})
+    resultado = pd.DataFrame(filas)
+    resultado["rows_batch"] = X.shape[0]
+    resultado["h5_bytes"] = os.path.getsize(os.path.join(models_path, 'idealista_model.h5'))
+    if debug:
+        print(resultado.to_string())
+        if not verificado:
+            print("keras no está instalado: la paridad con el modelo .h5 no está verificada")
+
+    return resultado
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exporta el modelo de Deep Learning a NumPy")
+    parser.add_argument("--data-path", default="data")
+    parser.add_argument("--models-path", default="models")
+    parser.add_argument("--dtype", default="float32", choices=["float32", "int8"],
+                        help="float32 (recomendado) o int8: pesos 2,4 veces más pequeños pero errores de hasta "
+                             "unos 69.000 € (unos 30.000 € de media sobre X_test)")
+    parser.add_argument("--output", default=None, help="fichero .npz (por defecto models/idealista_model.npz)")
+    parser.add_argument("--parity", action="store_true", help="comparar con el modelo .h5 y medir la latencia")
+    args = parser.parse_args()
+
+    if args.parity:
+        parity(args.data_path, args.models_path, debug=True)
+    else:
+        if args.dtype == 'int8':
+            print("Aviso: con int8 las predicciones se alejan hasta unos 69.000 € de las del modelo .h5")
+        export_keras_model(args.data_path, args.models_path, args.dtype,
+                           args.output or os.path.join(args.models_path, 'idealista_model.npz'), debug=True)
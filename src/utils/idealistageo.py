@@ -0,0 +1,456 @@
+# -*- coding: utf-8 -*-
+
+import json
+import pickle
+
+import numpy as np
+import pandas as pd
+
+class IdealistaDistance:
+    '''
+    Clase con el cálculo vectorizado (NumPy) de distancias en metros entre coordenadas longitud/latitud.
+    Usa la misma fórmula que IdealistaWebScraping.distance, pero para arrays de viviendas y varios puntos de referencia.
+    '''
+
+    # approximate radius of earth in km (el mismo que IdealistaWebScraping.distance)
+    R = 6373.0
+
+    '''
+    Coordenada del centro de la ciudad de Madrid (Puerta del Sol)
+    '''
+    longitudCentro = -3.703834
+    latitudCentro = 40.416639
+
+    def __init__(self, chunk_size = 100000, dtype = np.float64, debug = False):
+        '''
+        Constructor
+        Parametros:
+            chunk_size: número de viviendas que se procesan a la vez, para acotar la memoria de los arrays intermedios
+            dtype: tipo del resultado. Con np.float32 la matriz de distancias ocupa la mitad
+            debug: si vale True muestra mensajes de debug
+        '''
+        self.__chunk_size = chunk_size
+        self.__dtype = dtype
+        self.__debug = debug
+
+    def distance_matrix(self, longitudes, latitudes, references):
+        '''
+        Calcula la distancia en metros de cada vivienda a cada punto de referencia.
+
+        Parametros:
+        * longitudes, latitudes: arrays o Series con las coordenadas de las viviendas (n elementos)
+        * references: lista de tuplas (longitud, latitud) con los puntos de referencia (k elementos)
+        Resultado:
+        * Array de tamaño (n x k) con las distancias en metros
+        '''
+        lon1 = np.radians(np.asarray(longitudes, dtype=np.float64))
+        lat1 = np.radians(np.asarray(latitudes, dtype=np.float64))
+        references = np.asarray(references, dtype=np.float64).reshape(-1, 2)
+        lon2 = np.radians(references[:, 0])[np.newaxis, :]
+        lat2 = np.radians(references[:, 1])[np.newaxis, :]
+        cos_lat2 = np.cos(lat2)
+
+        n = lon1.shape[0]
+        distances = np.empty((n, references.shape[0]), dtype=self.__dtype)
+        for inicio in range(0, n, self.__chunk_size):
+            fin = min(inicio + self.__chunk_size, n)
+            lon = lon1[inicio:fin, np.newaxis]
+            lat = lat1[inicio:fin, np.newaxis]
+
+            a = np.sin((lat2 - lat) / 2)**2 + np.cos(lat) * cos_lat2 * np.sin((lon2 - lon) / 2)**2
+            c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+            distances[inicio:fin, :] = self.R * c * 1000
+            if self.__debug:
+                print("Distancias calculadas:", fin, "de", n)
+
+        return distances
+
+    def distance_features(self, data_frame, references, prefix = 'distance_', longitude = 'longitude', latitude = 'latitude'):
+        '''
+        Calcula un DataFrame con una columna de distancia por cada punto de referencia.
+
+        Parametros:
+        * data_frame: DataFrame con las coordenadas de las viviendas
+        * references: diccionario {nombre: (longitud, latitud)} con los puntos de referencia (Sol, metro, parques...)
+        * prefix: prefijo de las columnas del resultado
+        * longitude, latitude: nombres de las columnas con las coordenadas
+        Resultado:
+        * DataFrame con el mismo índice que data_frame y una columna prefix + nombre por punto de referencia
+        '''
+        distances = self.distance_matrix(data_frame[longitude], data_frame[latitude], list(references.values()))
+        columns = [prefix + nombre for nombre in references]
+
+        return pd.DataFrame(distances, index=data_frame.index, columns=columns)
+
+    def distance_to_center(self, data_frame, longitude = 'longitude', latitude = 'latitude'):
+        '''
+        Calcula la variable 'distance' (distancia en metros a la Puerta del Sol) de todas las viviendas de un DataFrame.
+
+        Parametros:
+        * data_frame: DataFrame con las coordenadas de las viviendas
+        * longitude, latitude: nombres de las columnas con las coordenadas
+        Resultado:
+        * Serie con la distancia de cada vivienda
+        '''
+        distances = self.distance_matrix(data_frame[longitude], data_frame[latitude],
+                                         [(self.longitudCentro, self.latitudCentro)])
+
+        return pd.Series(distances[:, 0], index=data_frame.index, name='distance')
+
+class IdealistaSpatialJoin:
+    '''
+    Clase que asigna a cada vivienda el barrio y el distrito en el que se encuentra (spatial join punto en polígono),
+    sustituyendo al fichero 'Idealista_SpatialJoinBarrios.xls' generado con una herramienta GIS externa.
+    Los polígonos de los barrios se cargan una vez y se indexan con una rejilla regular, de modo que cada
+    vivienda solo se compara con los barrios cuya caja envolvente toca su celda. La comprobación punto en
+    polígono (regla par-impar, que resuelve también huecos y multipolígonos) se hace con NumPy para lotes de viviendas.
+    '''
+
+    columnas = ["codbar", "coddistrit", "codbarrio", "barrio", "distrito"]
+
+    def __init__(self, grid_size = 64, chunk_size = 4000000, debug = False):
+        '''
+        Constructor
+        Parametros:
+            grid_size: número de celdas de la rejilla del índice espacial en cada eje
+            chunk_size: número máximo de pares (vivienda, lado de polígono) que se evalúan a la vez
+            debug: si vale True muestra mensajes de debug
+        '''
+        self.__grid_size = grid_size
+        self.__chunk_size = chunk_size
+        self.__debug = debug
+        self.attributes = None
+        self.__edges = None
+
+    def load_polygons(self, polygons, attributes):
+        '''
+        Carga los polígonos de los barrios y construye el índice espacial.
+
+        Parametros:
+        * polygons: lista con un elemento por barrio. Cada elemento es una lista de anillos (exteriores o huecos,
+          de uno o varios polígonos) y cada anillo un array (k, 2) de coordenadas longitud/latitud
+        * attributes: DataFrame con una fila por barrio (en el mismo orden) y las columnas 'codbar', 'coddistrit',
+          'barrio' y 'distrito'. Si no tiene 'codbarrio' se calcula como '<coddistrit>-<último dígito de codbar>'
+        '''
+        self.attributes = attributes.reset_index(drop=True).copy()
+        if "codbarrio" not in self.attributes.columns:
+            self.attributes["codbarrio"] = self.attributes["coddistrit"].astype(int).astype(str) + "-" + \
+                (self.attributes["codbar"].astype(int) % 10).astype(str)
+
+        self.__edges = []
+        bboxes = np.empty((len(polygons), 4))
+        for ind, rings in enumerate(polygons):
+            rings = [np.asarray(ring, dtype=np.float64) for ring in rings]
+            # Lados (x1, y1, x2, y2) de todos los anillos del barrio
+            self.__edges.append(np.vstack([np.hstack([ring, np.roll(ring, -1, axis=0)]) for ring in rings]))
+            todos = np.vstack(rings)
+            bboxes[ind] = [todos[:, 0].min(), todos[:, 1].min(), todos[:, 0].max(), todos[:, 1].max()]
+
+        # Rejilla regular sobre la caja envolvente de todos los barrios
+        self.__origin = bboxes[:, :2].min(axis=0)
+        self.__cell = (bboxes[:, 2:].max(axis=0) - self.__origin) / self.__grid_size
+        self.__cell[self.__cell == 0] = 1.0
+        ini = self.__cells(bboxes[:, 0], bboxes[:, 1])
+        fin = self.__cells(bboxes[:, 2], bboxes[:, 3])
+        # cell_polygons[p, celda] vale True si la caja del barrio p toca la celda
+        self.__cell_polygons = np.zeros((len(polygons), self.__grid_size * self.__grid_size), dtype=bool)
+        for ind in range(len(polygons)):
+            cx, cy = np.meshgrid(np.arange(ini[0][ind], fin[0][ind] + 1), np.arange(ini[1][ind], fin[1][ind] + 1))
+            self.__cell_polygons[ind, (cy * self.__grid_size + cx).ravel()] = True
+        if self.__debug:
+            print("Barrios cargados:", len(polygons), "lados:", sum(edges.shape[0] for edges in self.__edges))
+
+    def load_geojson(self, file, fields = None):
+        '''
+        Carga los barrios desde un fichero GeoJSON (FeatureCollection de Polygon/MultiPolygon en longitud/latitud, EPSG:4326),
+        por ejemplo la capa de barrios del portal de datos abiertos del Ayuntamiento de Madrid.
+
+        Parametros:
+        * file: fichero GeoJSON
+        * fields: diccionario {columna: propiedad del GeoJSON} para 'codbar', 'coddistrit', 'barrio' y 'distrito'.
+          Por defecto las propiedades se llaman igual que las columnas
+        '''
+        fields = fields if fields is not None else {columna: columna for columna in ["codbar", "coddistrit", "barrio", "distrito"]}
+        with open(file, encoding='utf-8') as infile:
+            features = json.load(infile)["features"]
+
+        polygons, filas = [], []
+        for feature in features:
+            geometry = feature["geometry"]
+            partes = geometry["coordinates"] if geometry["type"] == "MultiPolygon" else [geometry["coordinates"]]
+            polygons.append([np.asarray(ring)[:, :2] for parte in partes for ring in parte])
+            filas.append({columna: feature["properties"][propiedad] for columna, propiedad in fields.items()})
+
+        attributes = pd.DataFrame(filas)
+        attributes["codbar"] = attributes["codbar"].astype('float64')
+        attributes["coddistrit"] = attributes["coddistrit"].astype('float64')
+        self.load_polygons(polygons, attributes)
+
+    def __cells(self, longitudes, latitudes):
+        cx = np.clip(((longitudes - self.__origin[0]) / self.__cell[0]).astype(np.int64), 0, self.__grid_size - 1)
+        cy = np.clip(((latitudes - self.__origin[1]) / self.__cell[1]).astype(np.int64), 0, self.__grid_size - 1)
+        return cx, cy
+
+    def __points_in_polygon(self, px, py, edges):
+        '''
+        Método "privado".
+        Regla par-impar vectorizada: cuenta los lados que cruza un rayo horizontal desde cada punto.
+
+        Argumentos:
+        * px, py: coordenadas de los puntos
+        * edges: array (e, 4) con los lados del polígono
+
+        Resultado:
+        * Array booleano con True para los puntos dentro del polígono
+        '''
+        x1, y1, x2, y2 = (edges[:, i][np.newaxis, :] for i in range(4))
+        dentro = np.zeros(px.shape[0], dtype=bool)
+        paso = max(1, self.__chunk_size // max(1, edges.shape[0]))
+        for inicio in range(0, px.shape[0], paso):
+            x = px[inicio:inicio + paso, np.newaxis]
+            y = py[inicio:inicio + paso, np.newaxis]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                cruza = ((y1 > y) != (y2 > y)) & (x < (x2 - x1) * (y - y1) / (y2 - y1) + x1)
+            dentro[inicio:inicio + paso] = np.count_nonzero(cruza, axis=1) % 2 == 1
+
+        return dentro
+
+    def locate(self, longitudes, latitudes, use_index = True):
+        '''
+        Obtiene el barrio en el que se encuentra cada punto.
+
+        Parametros:
+        * longitudes, latitudes: arrays o Series con las coordenadas
+        * use_index: si vale False compara cada punto con todos los barrios (sin índice espacial)
+        Resultado:
+        * Array con la posición del barrio en 'attributes' (-1 si el punto no está en ningún barrio)
+        '''
+        px = np.asarray(longitudes, dtype=np.float64)
+        py = np.asarray(latitudes, dtype=np.float64)
+        resultado = np.full(px.shape[0], -1, dtype=np.int64)
+        celdas = None
+        if use_index:
+            cx, cy = self.__cells(px, py)
+            celdas = cy * self.__grid_size + cx
+            # Los puntos fuera de la rejilla no pueden estar en ningún barrio
+            fuera = (px < self.__origin[0]) | (py < self.__origin[1]) | \
+                (px > self.__origin[0] + self.__cell[0] * self.__grid_size) | \
+                (py > self.__origin[1] + self.__cell[1] * self.__grid_size)
+
+        for ind, edges in enumerate(self.__edges):
+            candidatos = resultado < 0
+            if use_index:
+                candidatos &= self.__cell_polygons[ind, celdas] & ~fuera
+            posiciones = np.flatnonzero(candidatos)
+            if posiciones.shape[0] == 0:
+                continue
+            dentro = self.__points_in_polygon(px[posiciones], py[posiciones], edges)
+            resultado[posiciones[dentro]] = ind
+
+        return resultado
+
+    def join(self, data_frame, longitude = 'longitude', latitude = 'latitude'):
+        '''
+        Calcula las variables 'codbar', 'coddistrit', 'codbarrio', 'barrio' y 'distrito' de las viviendas de un DataFrame,
+        con el mismo formato que el Excel 'Idealista_SpatialJoinBarrios.xls'.
+
+        Parametros:
+        * data_frame: DataFrame con las coordenadas de las viviendas
+        * longitude, latitude: nombres de las columnas con las coordenadas
+        Resultado:
+        * DataFrame con el mismo índice que data_frame y las columnas del barrio (nulos si la vivienda no está en ningún barrio)
+        '''
+        posiciones = self.locate(data_frame[longitude], data_frame[latitude])
+        join_df = self.attributes[self.columnas].reindex(posiciones)
+        join_df.index = data_frame.index
+        if self.__debug:
+            print("Viviendas sin barrio:", int((posiciones < 0).sum()))
+
+        return join_df
+
+class IdealistaPriceIndex:
+    '''
+    Índice espacial de precios: un KDTree sobre las coordenadas de las viviendas (proyectadas a metros) con su
+    'priceByArea', que responde en lote a consultas de los k vecinos más cercanos y de los vecinos a menos de
+    un radio, y calcula la variable 'precio por m2 mediano en un radio' de una vivienda, tanto para añadirla
+    al DataFrame de entrenamiento como para calcularla en el momento de la predicción.
+
+    La proyección es equirectangular centrada en la Puerta del Sol: en el ámbito de Madrid la diferencia con la
+    distancia de IdealistaDistance es de unos pocos metros por kilómetro.
+    '''
+
+    def __init__(self, radius = 500, min_neighbors = 5, leaf_size = 40, debug = False):
+        '''
+        Constructor
+        Parametros:
+            radius: radio en metros por defecto de las consultas
+            min_neighbors: número mínimo de vecinos de la mediana. Si en el radio hay menos, se usa la mediana
+                           de los min_neighbors vecinos más cercanos
+            leaf_size: tamaño de las hojas del KDTree
+            debug: si vale True muestra mensajes de debug
+        '''
+        self.__radius = radius
+        self.__min_neighbors = min_neighbors
+        self.__leaf_size = leaf_size
+        self.__debug = debug
+        self.__tree = None
+        self.values = None
+
+    def project(self, longitudes, latitudes):
+        '''
+        Proyecta coordenadas longitud/latitud a metros (x hacia el este, y hacia el norte desde la Puerta del Sol).
+
+        Parametros:
+        * longitudes, latitudes: arrays o Series con las coordenadas
+        Resultado:
+        * Array (n, 2) con las coordenadas en metros
+        '''
+        radio = IdealistaDistance.R * 1000
+        lon = np.radians(np.asarray(longitudes, dtype=np.float64) - IdealistaDistance.longitudCentro)
+        lat = np.radians(np.asarray(latitudes, dtype=np.float64) - IdealistaDistance.latitudCentro)
+
+        return np.column_stack([radio * np.cos(np.radians(IdealistaDistance.latitudCentro)) * lon, radio * lat])
+
+    def fit(self, data_frame, value = 'priceByArea', longitude = 'longitude', latitude = 'latitude'):
+        '''
+        Construye el índice con las viviendas de un DataFrame (p. ej. 'idealista_madrid_clean.csv').
+        Las viviendas sin coordenadas o sin valor no se indexan.
+
+        Parametros:
+        * data_frame: DataFrame con las viviendas
+        * value: columna con el valor cuya mediana se calcula
+        * longitude, latitude: nombres de las columnas con las coordenadas
+        '''
+        from sklearn.neighbors import KDTree
+
+        validas = data_frame[[value, longitude, latitude]].notna().all(axis=1).to_numpy()
+        self.__positions = np.flatnonzero(validas)
+        self.values = data_frame[value].to_numpy(dtype=np.float64)[validas]
+        self.__tree = KDTree(self.project(data_frame[longitude].to_numpy()[validas],
+                                          data_frame[latitude].to_numpy()[validas]), leaf_size=self.__leaf_size)
+        if self.__debug:
+            print("Viviendas indexadas:", self.values.shape[0], "de", data_frame.shape[0])
+
+        return self
+
+    def query(self, longitudes, latitudes, k = 5):
+        '''
+        Obtiene los k vecinos más cercanos de cada punto.
+
+        Parametros:
+        * longitudes, latitudes: arrays o Series con las coordenadas (n elementos)
+        * k: número de vecinos
+        Resultado:
+        * Tupla (distancias en metros, posiciones en 'values'), dos arrays (n, k) ordenados por distancia
+        '''
+        return self.__tree.query(self.project(longitudes, latitudes), k=k)
+
+    def query_radius(self, longitudes, latitudes, radius = None):
+        '''
+        Obtiene los vecinos de cada punto a menos de un radio.
+
+        Parametros:
+        * longitudes, latitudes: arrays o Series con las coordenadas (n elementos)
+        * radius: radio en metros (por defecto el del constructor)
+        Resultado:
+        * Array de n elementos en el que cada elemento es un array con las posiciones de los vecinos en 'values'
+        '''
+        return self.__tree.query_radius(self.project(longitudes, latitudes), r=self.__radius if radius is None else radius)
+
+    def __medians(self, vecinos, excluidos = None):
+        '''
+        Método "privado".
+        Mediana de 'values' de cada lista de vecinos, sin bucles de Python: se concatenan todas las listas,
+        se ordenan los valores por (fila, valor) y se toma el elemento central de cada fila.
+        Si se indica 'excluidos' se quita de la lista de cada fila la posición excluidos[fila].
+        '''
+        filas = np.repeat(np.arange(len(vecinos)), [len(v) for v in vecinos])
+        posiciones = np.concatenate(list(vecinos)) if len(vecinos) > 0 else np.empty(0, dtype=np.int64)
+        if excluidos is not None:
+            quedan = posiciones != excluidos[filas]
+            filas, posiciones = filas[quedan], posiciones[quedan]
+        valores = self.values[posiciones]
+        orden = np.lexsort((valores, filas))
+        valores = valores[orden]
+        cuenta = np.bincount(filas, minlength=len(vecinos))
+        inicio = np.concatenate([[0], np.cumsum(cuenta)[:-1]])
+        medianas = np.full(len(vecinos), np.nan)
+        con_vecinos = cuenta > 0
+        bajo = inicio[con_vecinos] + (cuenta[con_vecinos] - 1) // 2
+        alto = inicio[con_vecinos] + cuenta[con_vecinos] // 2
+        medianas[con_vecinos] = (valores[bajo] + valores[alto]) / 2
+
+        return medianas, cuenta
+
+    def local_median(self, longitudes, latitudes, radius = None, exclude_self = False):
+        '''
+        Calcula el 'priceByArea' mediano de las viviendas a menos de un radio de cada punto.
+
+        Parametros:
+        * longitudes, latitudes: arrays o Series con las coordenadas (n elementos)
+        * radius: radio en metros (por defecto el del constructor)
+        * exclude_self: si vale True los puntos son las viviendas del fit (en el mismo orden) y a cada una se le
+          quita su propio precio, para no filtrar el target en la variable de entrenamiento
+        Resultado:
+        * Tupla (medianas, número de vecinos usados), dos arrays de n elementos
+        '''
+        propios = None
+        if exclude_self:
+            if np.shape(longitudes)[0] != self.values.shape[0]:
+                raise ValueError("Con exclude_self los puntos deben ser las viviendas del fit")
+            propios = np.arange(self.values.shape[0])
+        medianas, cuenta = self.__medians(self.query_radius(longitudes, latitudes, radius), propios)
+
+        pocos = np.flatnonzero(cuenta < self.__min_neighbors)
+        if pocos.shape[0] > 0:
+            k = min(self.__min_neighbors + (1 if exclude_self else 0), self.values.shape[0])
+            _, cercanos = self.query(np.asarray(longitudes, dtype=np.float64)[pocos],
+                                     np.asarray(latitudes, dtype=np.float64)[pocos], k=k)
+            medianas[pocos], cuenta[pocos] = self.__medians(list(cercanos),
+                                                            None if propios is None else propios[pocos])
+        if self.__debug:
+            print("Puntos con menos de", self.__min_neighbors, "vecinos en el radio:", pocos.shape[0])
+
+        return medianas, cuenta
+
+    def add_feature(self, data_frame, radius = None, name = None, exclude_self = False,
+                    longitude = 'longitude', latitude = 'latitude'):
+        '''
+        Añade a un DataFrame la variable con el 'priceByArea' mediano en un radio.
+
+        Parametros:
+        * data_frame: DataFrame con las coordenadas de las viviendas
+        * radius: radio en metros (por defecto el del constructor)
+        * name: nombre de la columna (por defecto 'priceByArea_median_<radio>m')
+        * exclude_self: True si data_frame es el DataFrame del fit (ver local_median)
+        * longitude, latitude: nombres de las columnas con las coordenadas
+        Resultado:
+        * El DataFrame con la nueva columna
+        '''
+        radius = self.__radius if radius is None else radius
+        name = 'priceByArea_median_' + str(int(radius)) + 'm' if name is None else name
+        if exclude_self:
+            # Las medianas se calculan por posición de 'values': las viviendas sin coordenadas o precio quedan a nulo
+            medianas, _ = self.local_median(data_frame[longitude].to_numpy()[self.__positions],
+                                            data_frame[latitude].to_numpy()[self.__positions], radius, True)
+            data_frame[name] = np.nan
+            data_frame.iloc[self.__positions, data_frame.columns.get_loc(name)] = medianas
+        else:
+            data_frame[name] = self.local_median(data_frame[longitude], data_frame[latitude], radius)[0]
+
+        return data_frame
+
+    def save(self, file = 'models/price_index.pkl'):
+        '''
+        Graba el índice con pickle.
+        '''
+        with open(file, 'wb') as archivo_salida:
+            pickle.dump(self, archivo_salida)
+
+    @staticmethod
+    def load(file = 'models/price_index.pkl'):
+        '''
+        Carga un índice grabado con save.
+        '''
+        with open(file, 'rb') as archivo_entrada:
+            return pickle.load(archivo_entrada)
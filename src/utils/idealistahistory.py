@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+class IdealistaListingHistory:
+    '''
+    Histórico de anuncios por 'propertyCode' (change data capture entre descargas).
+    En lugar de concatenar todas las descargas y quedarse con la última versión de cada anuncio
+    (drop_duplicates(subset='propertyCode', keep='last') de main.ipynb), cada lote nuevo (resultado de
+    Idealista.search/read_jsons o de IdealistaCrawler) se compara con el estado guardado mediante un hash de los
+    campos que interesan ('price', 'priceByArea', 'status', 'hasParkingSpace') y se clasifica cada anuncio en:
+    - 'insert': anuncio nuevo (o que vuelve a publicarse después de haber desaparecido)
+    - 'update': anuncio existente con algún campo distinto
+    - 'delete': anuncio activo que no aparece en el lote (solo si el lote es una descarga completa)
+    Los anuncios sin cambios no se devuelven, de modo que la limpieza y la predicción solo procesan los que cambian.
+
+    En el directorio del histórico se guardan:
+    - 'state.pkl': estado actual de cada anuncio (hash, valores de los campos, primera y última vez visto, activo),
+      grabado con pickle como los DataFrames de data/ porque se reescribe en cada descarga
+    - 'changes.csv': registro de cambios, al que solo se añaden filas (historia de precios de cada anuncio)
+    '''
+
+    campos = ["price", "priceByArea", "status", "hasParkingSpace"]
+
+    def __init__(self, history_dir = 'data/listing_history', fields = None, debug = False):
+        '''
+        Constructor
+        Parametros:
+            history_dir: directorio del histórico
+            fields: campos cuyo cambio se registra (por defecto 'campos')
+            debug: si vale True muestra mensajes de debug
+        '''
+        self.__history_dir = history_dir
+        self.__fields = list(self.campos if fields is None else fields)
+        self.__debug = debug
+        os.makedirs(history_dir, exist_ok=True)
+        self.__state_file = os.path.join(history_dir, 'state.pkl')
+        self.__changes_file = os.path.join(history_dir, 'changes.csv')
+        if os.path.exists(self.__state_file):
+            self.state = pd.read_pickle(self.__state_file)
+        else:
+            self.state = pd.DataFrame(columns=["hash"] + self.__fields + ["first_seen", "last_seen", "active"],
+                                      index=pd.Index([], name="propertyCode", dtype=object))
+
+    def __fields_frame(self, batch):
+        '''
+        Método "privado".
+        Obtiene del lote los campos a comparar con un formato estable entre descargas: números (y booleanos) como
+        float64 y textos como str, para que 100, 100.0 o True/1.0 no cambien el hash.
+        'hasParkingSpace' se obtiene de 'parkingSpace' si el lote aún no se ha aplanado con Idealista.clean_dataframe.
+        '''
+        campos = pd.DataFrame(index=batch.index)
+        for campo in self.__fields:
+            if campo in batch.columns:
+                valores = batch[campo]
+            elif campo in ("hasParkingSpace", "isParkingSpaceIncludedInPrice") and "parkingSpace" in batch.columns:
+                valores = batch["parkingSpace"].map(lambda parking: parking.get(campo, np.nan)
+                                                    if isinstance(parking, dict) else np.nan)
+            else:
+                valores = pd.Series(np.nan, index=batch.index)
+            numeros = pd.to_numeric(valores.astype(object), errors='coerce')
+            if numeros.isna().equals(valores.isna()):
+                campos[campo] = numeros.astype(np.float64)
+            else:
+                campos[campo] = valores.astype(object).where(valores.notna(), None).astype(str)
+
+        return campos
+
+    def hash_rows(self, batch):
+        '''
+        Calcula el hash (int64) de los campos de cada anuncio de un lote.
+
+        Parametros:
+        * batch: DataFrame con los anuncios
+        Resultado:
+        * Series de int64 con el mismo índice que batch
+        '''
+        hashes = pd.util.hash_pandas_object(self.__fields_frame(batch), index=False)
+
+        return pd.Series(hashes.to_numpy().view(np.int64), index=batch.index)
+
+    def diff(self, batch, full_snapshot = True):
+        '''
+        Compara un lote con el estado guardado sin modificar el histórico.
+
+        Parametros:
+        * batch: DataFrame con los anuncios (si un 'propertyCode' se repite se usa la última fila, como en el notebook)
+        * full_snapshot: True si el lote es una descarga completa del mercado, de modo que los anuncios activos que no
+          aparecen en él se consideran retirados
+        Resultado:
+        * Tupla (changed_df, delisted): las filas del lote que son 'insert' o 'update' (con la columna 'change')
+          y el índice de los 'propertyCode' retirados
+        '''
+        batch = batch.copy()
+        batch["propertyCode"] = batch["propertyCode"].astype(str)
+        batch = batch.drop_duplicates(subset='propertyCode', keep='last')
+        codigos = pd.Index(batch["propertyCode"])
+        hashes = self.hash_rows(batch).to_numpy()
+
+        # Búsqueda por posición (reindex introduciría nulos y convertiría los hashes int64 a float64)
+        posiciones = self.state.index.get_indexer(codigos)
+        activos = posiciones >= 0
+        activos[activos] = self.state["active"].to_numpy(dtype=bool)[posiciones[activos]]
+        nuevo = ~activos
+        cambiado = np.zeros(codigos.shape[0], dtype=bool)
+        cambiado[activos] = self.state["hash"].to_numpy(dtype=np.int64)[posiciones[activos]] != hashes[activos]
+
+        changed_df = batch[nuevo | cambiado].copy()
+        changed_df["change"] = np.where(nuevo[nuevo | cambiado], 'insert', 'update')
+        delisted = pd.Index([], name="propertyCode", dtype=object)
+        if full_snapshot:
+            activos_antes = self.state.index[self.state["active"].astype(bool)]
+            delisted = activos_antes.difference(codigos)
+
+        return changed_df, delisted
+
+    def apply(self, batch, timestamp = None, full_snapshot = True):
+        '''
+        Compara un lote con el estado guardado, actualiza el estado y añade los cambios al registro.
+
+        Parametros:
+        * batch: DataFrame con los anuncios
+        * timestamp: momento de la descarga (por defecto, ahora) en formato ISO
+        * full_snapshot: ver diff
+        Resultado:
+        * Tupla (changed_df, delisted) de diff: solo estas filas deben pasar a la limpieza y la predicción
+        '''
+        timestamp = timestamp if timestamp is not None else time.strftime('%Y-%m-%dT%H:%M:%S')
+        changed_df, delisted = self.diff(batch, full_snapshot)
+        codigos = pd.Index(batch["propertyCode"].astype(str).unique(), name="propertyCode")
+
+        # Los anuncios sin cambios solo actualizan cuándo se han visto por última vez
+        vistos = codigos.intersection(self.state.index)
+        self.state.loc[vistos, "last_seen"] = timestamp
+
+        cambios = []
+        if changed_df.shape[0] > 0:
+            filas = self.__fields_frame(changed_df).set_axis(pd.Index(changed_df["propertyCode"], name="propertyCode"))
+            filas["hash"] = self.hash_rows(changed_df).to_numpy()
+            filas["last_seen"] = timestamp
+            filas["active"] = True
+            previos = self.state.reindex(filas.index)
+            filas["first_seen"] = previos["first_seen"].where(previos["first_seen"].notna(), timestamp)
+            registro = filas[self.__fields].copy()
+            registro.insert(0, "change", changed_df["change"].to_numpy())
+            registro["previous_price"] = previos["price"].to_numpy() if "price" in self.__fields else np.nan
+            cambios.append(registro)
+            resto = self.state.drop(filas.index, errors='ignore')
+            self.state = filas[self.state.columns] if resto.shape[0] == 0 else pd.concat([resto, filas[self.state.columns]])
+        if delisted.shape[0] > 0:
+            self.state.loc[delisted, "active"] = False
+            registro = pd.DataFrame({"change": 'delete'}, index=delisted)
+            for campo in self.__fields:
+                registro[campo] = np.nan
+            registro["previous_price"] = self.state.loc[delisted, "price"].to_numpy() if "price" in self.__fields \
+                else np.nan
+            cambios.append(registro)
+
+        self.__save_state()
+        if cambios:
+            registro = pd.concat(cambios)
+            registro.insert(0, "timestamp", timestamp)
+            registro.to_csv(self.__changes_file, mode='a', header=not os.path.exists(self.__changes_file),
+                            index_label="propertyCode")
+        if self.__debug:
+            print(timestamp, ":", batch.shape[0], "anuncios,", (changed_df["change"] == 'insert').sum(), "nuevos,",
+                  (changed_df["change"] == 'update').sum(), "modificados,", delisted.shape[0], "retirados")
+
+        return changed_df, delisted
+
+    def __save_state(self):
+        self.state.to_pickle(self.__state_file + '.tmp')
+        os.replace(self.__state_file + '.tmp', self.__state_file)
+
+    def changes(self, property_code = None):
+        '''
+        Devuelve el registro de cambios (la historia de precios), de todos los anuncios o de uno.
+
+        Parametros:
+        * property_code: 'propertyCode' del anuncio (None: todos)
+        Resultado:
+        * DataFrame con el momento, el tipo de cambio, los campos y el precio anterior de cada cambio
+        '''
+        if not os.path.exists(self.__changes_file):
+            return pd.DataFrame(columns=["propertyCode", "timestamp", "change"] + self.__fields + ["previous_price"])
+        registro = pd.read_csv(self.__changes_file, dtype={"propertyCode": str})
+        if property_code is not None:
+            registro = registro[registro["propertyCode"] == str(property_code)]
+
+        return registro.reset_index(drop=True)
+
+    def active(self):
+        '''
+        Devuelve los 'propertyCode' de los anuncios activos.
+        '''
+        return self.state.index[self.state["active"].astype(bool)]
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+import glob
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+class IdealistaIngest:
+    '''
+    Clase que carga de forma incremental los ficheros JSON con el "elementList" de la API de Idealista
+    (los generados por Idealista.elementlist_tojson) en un almacén Parquet particionado (por defecto por distrito).
+    Los ficheros se procesan por lotes, de modo que la memoria usada no depende del número de ficheros,
+    y un manifiesto registra los ficheros ya procesados para que cada ejecución cargue solo los nuevos.
+    Cada lote se graba como un fichero nuevo de cada partición (district=<distrito>/part-<secuencia>.parquet), sin leer
+    los datos ya cargados: los duplicados de 'propertyCode' se resuelven al leer (read) quedándose con el de mayor
+    'ingestSeq', y 'compact' junta los ficheros de cada partición cuando hay muchos.
+    '''
+
+    manifest_name = "manifest.json"
+
+    def __init__(self, store_dir, partition_by = 'district', batch_files = 100, debug = False):
+        '''
+        Constructor
+        Parametros:
+            store_dir: directorio del almacén Parquet
+            partition_by: columna por la que se particiona el almacén
+            batch_files: número de ficheros JSON que se procesan en cada lote
+            debug: si vale True muestra mensajes de debug
+        '''
+        self.__store_dir = store_dir
+        self.__partition_by = partition_by
+        self.__batch_files = batch_files
+        self.__debug = debug
+        os.makedirs(store_dir, exist_ok=True)
+        self.__manifest = self.__load_manifest()
+
+    def __load_manifest(self):
+        manifest_file = os.path.join(self.__store_dir, self.manifest_name)
+        if os.path.exists(manifest_file):
+            with open(manifest_file) as infile:
+                return json.load(infile)
+        return {"files": {}, "partitions": {}, "sequence": 0}
+
+    def __save_manifest(self):
+        manifest_file = os.path.join(self.__store_dir, self.manifest_name)
+        with open(manifest_file + '.tmp', 'w') as outfile:
+            json.dump(self.__manifest, outfile, indent=1)
+        os.replace(manifest_file + '.tmp', manifest_file)
+
+    def __flatten(self, element):
+        '''
+        Método "privado".
+        Aplana un elemento del "elementList" igual que Idealista.clean_dataframe: extrae 'subTypology' de 'detailedType'
+        y 'hasParkingSpace'/'isParkingSpaceIncludedInPrice' de 'parkingSpace'. El resto de diccionarios (p. ej. 'suggestedTexts')
+        se guardan como texto, igual que en los CSV del proyecto.
+        '''
+        fila = dict(element)
+        detailed_type = fila.pop("detailedType", None) or {}
+        parking_space = fila.pop("parkingSpace", None)
+        fila["subTypology"] = detailed_type.get('subTypology', '')
+        fila["hasParkingSpace"] = parking_space['hasParkingSpace'] if parking_space else np.nan
+        fila["isParkingSpaceIncludedInPrice"] = parking_space['isParkingSpaceIncludedInPrice'] if parking_space else np.nan
+        for key, value in fila.items():
+            if isinstance(value, (dict, list)):
+                fila[key] = str(value)
+
+        return fila
+
+    def __partition_dir(self, partition):
+        nombre = re.sub(r'[^\w\-]+', '_', str(partition), flags=re.UNICODE)
+        return self.__partition_by + "=" + nombre
+
+    def __part_files(self, registro):
+        # Los almacenes anteriores guardaban un único fichero por partición
+        partes = registro["parts"] if "parts" in registro else [registro["file"]]
+        return [os.path.join(self.__store_dir, parte) for parte in partes]
+
+    def __write_part(self, partition_df, fichero):
+        table = pa.Table.from_pandas(partition_df, preserve_index=False)
+        pq.write_table(table, fichero + '.tmp')
+        os.replace(fichero + '.tmp', fichero)
+
+    def __pending_files(self, directory):
+        '''
+        Método "privado".
+        Devuelve los ficheros JSON nuevos o modificados desde la última ejecución, ordenados por fecha de modificación
+        para que, entre duplicados, prevalezca el anuncio más reciente.
+        '''
+        pendientes = []
+        for fichero in glob.glob(os.path.join(directory, '*.json')):
+            stat = os.stat(fichero)
+            registro = self.__manifest["files"].get(os.path.abspath(fichero))
+            if registro is None or registro["mtime"] != stat.st_mtime or registro["size"] != stat.st_size:
+                pendientes.append((stat.st_mtime, fichero, stat))
+        pendientes.sort()
+
+        return [(fichero, stat) for _, fichero, stat in pendientes]
+
+    def __append_partition(self, partition, batch_df):
+        '''
+        Método "privado".
+        Graba un lote como un fichero nuevo de la partición, sin leer los ficheros anteriores.
+        '''
+        directorio = self.__partition_dir(partition)
+        os.makedirs(os.path.join(self.__store_dir, directorio), exist_ok=True)
+        parte = os.path.join(directorio, "part-%012d.parquet" % batch_df["ingestSeq"].max())
+        self.__write_part(batch_df, os.path.join(self.__store_dir, parte))
+
+        registro = self.__manifest["partitions"].setdefault(str(partition), {"parts": [], "rows": 0})
+        if "parts" not in registro:
+            registro["parts"] = [registro.pop("file")]
+        registro["parts"].append(parte)
+        registro["rows"] += batch_df.shape[0]
+
+    def ingest(self, directory = ''):
+        '''
+        Carga en el almacén los ficheros JSON nuevos de un directorio.
+
+        Parametros:
+        * directory: directorio donde se encuentran los ficheros JSON
+        Resultado:
+        * Número de anuncios leídos de los ficheros nuevos
+        '''
+        pendientes = self.__pending_files(directory)
+        if self.__debug:
+            print("Ficheros nuevos:", len(pendientes))
+
+        total = 0
+        for inicio in range(0, len(pendientes), self.__batch_files):
+            lote = pendientes[inicio:inicio + self.__batch_files]
+            filas = []
+            for fichero, stat in lote:
+                with open(fichero) as infile:
+                    elementos = json.load(infile)
+                for element in elementos:
+                    fila = self.__flatten(element)
+                    self.__manifest["sequence"] += 1
+                    fila["ingestSeq"] = self.__manifest["sequence"]
+                    filas.append(fila)
+
+            if filas:
+                batch_df = pd.DataFrame(filas)
+                batch_df["propertyCode"] = batch_df["propertyCode"].astype(str)
+                particiones = batch_df[self.__partition_by].fillna('unknown')
+                for partition, partition_df in batch_df.groupby(particiones, sort=False):
+                    self.__append_partition(partition, partition_df)
+
+            for fichero, stat in lote:
+                self.__manifest["files"][os.path.abspath(fichero)] = {"mtime": stat.st_mtime, "size": stat.st_size}
+            self.__save_manifest()
+            total += len(filas)
+            if self.__debug:
+                print("Lote de", len(lote), "ficheros con", len(filas), "anuncios")
+
+        return total
+
+    def read(self, columns = None, partitions = None):
+        '''
+        Lee el almacén como un DataFrame, con un anuncio por 'propertyCode' (el más reciente).
+
+        Parametros:
+        * columns: columnas a leer (None: todas)
+        * partitions: valores de la columna de partición a leer (None: todas)
+        Resultado:
+        * El DataFrame
+        '''
+        columnas = None
+        if columns is not None:
+            columnas = list(dict.fromkeys(list(columns) + ["propertyCode", "ingestSeq"]))
+
+        list_df = []
+        for partition, registro in self.__manifest["partitions"].items():
+            if partitions is None or partition in partitions:
+                list_df.extend(pd.read_parquet(fichero, columns=columnas) for fichero in self.__part_files(registro))
+        if not list_df:
+            return None
+
+        idealista_df = pd.concat(list_df, ignore_index=True)
+        # Un anuncio puede estar en varios lotes y haber cambiado de partición entre descargas
+        idealista_df.sort_values(by="ingestSeq", inplace=True, kind='mergesort')
+        idealista_df.drop_duplicates(subset="propertyCode", keep='last', inplace=True)
+        idealista_df.reset_index(drop=True, inplace=True)
+        if columns is not None:
+            idealista_df = idealista_df[list(columns)]
+
+        return idealista_df
+
+    def compact(self, min_parts = 2):
+        '''
+        Junta los ficheros de cada partición en uno solo, eliminando los duplicados de 'propertyCode' (se queda con el
+        de mayor 'ingestSeq'). Se lee una partición cada vez, así que la memoria usada es la de la partición más grande.
+        Un anuncio que ha cambiado de partición sigue en las dos hasta la lectura (read resuelve el más reciente).
+
+        Parametros:
+        * min_parts: solo se compactan las particiones con al menos ese número de ficheros
+        Resultado:
+        * Número de particiones compactadas
+        '''
+        compactadas = 0
+        for partition, registro in self.__manifest["partitions"].items():
+            ficheros = self.__part_files(registro)
+            if len(ficheros) < min_parts:
+                continue
+            partition_df = pd.concat([pd.read_parquet(fichero) for fichero in ficheros], ignore_index=True)
+            partition_df.sort_values(by="ingestSeq", inplace=True, kind='mergesort')
+            partition_df.drop_duplicates(subset="propertyCode", keep='last', inplace=True)
+
+            parte = os.path.join(self.__partition_dir(partition),
+                                 "part-%012d.parquet" % partition_df["ingestSeq"].max())
+            # Sustituye al fichero del último lote (contiene todos sus anuncios), así que leer antes de grabar
+            # el manifiesto sigue siendo correcto
+            self.__write_part(partition_df, os.path.join(self.__store_dir, parte))
+            self.__manifest["partitions"][partition] = {"parts": [parte], "rows": partition_df.shape[0]}
+            self.__save_manifest()
+            for fichero in ficheros:
+                if os.path.abspath(fichero) != os.path.abspath(os.path.join(self.__store_dir, parte)):
+                    os.remove(fichero)
+            compactadas += 1
+            if self.__debug:
+                print("Partición", partition, ":", len(ficheros), "ficheros,", partition_df.shape[0], "anuncios")
+
+        return compactadas
@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+
+import math
+import os
+import pickle
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.preprocessing import MinMaxScaler
+
+from .idealistatools import IdealistaFeatureEngineering
+
+def _fit_subforest(X, y, n_estimators, params, random_state):
+    '''
+    Entrena en un proceso del pool el bosque de un trozo del dataset.
+    '''
+    forest = RandomForestRegressor(n_estimators=n_estimators, n_jobs=1, random_state=random_state, **params)
+
+    return forest.fit(X, y)
+
+class IdealistaOutOfCoreTrainer:
+    '''
+    Entrenamiento de los modelos de main.ipynb (RandomForestRegressor y red neuronal) sin cargar el dataset en memoria.
+    El dataset (con el formato de 'idealista_madrid_model1.csv': las features y la columna 'price') se lee por trozos:
+    - Primera pasada: el MinMaxScaler de las features y el del target se ajustan con partial_fit (el resultado es el
+      mismo que con fit sobre todo el dataset).
+    - Segunda pasada: cada trozo se escala y se envía a un proceso del pool, que entrena un bosque pequeño con él.
+      Los bosques de los trozos se unen en un único RandomForestRegressor (la predicción de un bosque es la media de
+      sus árboles, así que basta con juntar los árboles). Como mucho hay 'max_workers' trozos en vuelo a la vez.
+    - La red neuronal (misma arquitectura que en main.ipynb) se entrena con un generador de minibatches que recorre el
+      fichero por trozos en cada época (barajando las filas dentro de cada trozo).
+    La memoria usada depende del tamaño del trozo y no del dataset, salvo los propios árboles: su tamaño crece con el
+    número de trozos, y el de cada árbol con el tamaño del trozo si no se limita con max_depth o min_samples_leaf.
+    '''
+
+    def __init__(self, features, target = 'price', chunksize = 100000, trees_per_chunk = 10, max_depth = None,
+                 min_samples_leaf = 1, max_workers = None, epochs = 100, batch_size = 64, neural = True,
+                 random_state = 42, debug = False):
+        '''
+        Constructor
+        Parametros:
+            features: lista de features de los modelos (p. ej. 'features_selected')
+            target: columna con el precio
+            chunksize: filas de cada trozo
+            trees_per_chunk: árboles que se entrenan con cada trozo
+            max_depth: profundidad máxima de los árboles
+            min_samples_leaf: mínimo de anuncios en cada hoja de los árboles
+            max_workers: procesos del pool que entrenan los bosques de los trozos (None: uno por CPU)
+            epochs: épocas de la red neuronal
+            batch_size: anuncios de cada minibatch de la red neuronal
+            neural: si vale True se entrena también la red neuronal (requiere keras)
+            random_state: semilla
+            debug: si vale True muestra mensajes de debug
+        '''
+        self.features = list(features)
+        self.__target = target
+        self.__chunksize = chunksize
+        self.__trees_per_chunk = trees_per_chunk
+        self.__tree_params = {"max_depth": max_depth, "min_samples_leaf": min_samples_leaf}
+        self.__max_workers = max_workers if max_workers is not None else (os.cpu_count() or 1)
+        self.__epochs = epochs
+        self.__batch_size = batch_size
+        self.__neural = neural
+        self.__random_state = random_state
+        self.__debug = debug
+        self.__idealista_fe = IdealistaFeatureEngineering()
+
+        self.scaler = None
+        self.y_scaler = None
+        self.forest = None
+        self.dl_model = None
+        self.n_samples_ = 0
+        self.__chunk_rows = []
+
+    def __getstate__(self):
+        # El modelo de keras se graba aparte en formato h5
+        estado = self.__dict__.copy()
+        estado['dl_model'] = None
+        return estado
+
+    def chunks(self, file):
+        '''
+        Lee el dataset por trozos.
+
+        Parametros:
+        * file: fichero '.csv' o '.parquet' con las features y el target
+        Resultado:
+        * Iterador de tuplas (X, y) de float64, con las columnas de X en el orden de 'features'
+        '''
+        for chunk in self.__idealista_fe.read_chunks(file, self.__chunksize, self.features + [self.__target]):
+            yield chunk[self.features].to_numpy(np.float64), chunk[self.__target].to_numpy(np.float64)
+
+    def fit_scaler(self, file):
+        '''
+        Ajusta el MinMaxScaler de las features y el del target en una sola pasada con partial_fit.
+
+        Parametros:
+        * file: fichero con el dataset
+        Resultado:
+        * El propio objeto
+        '''
+        self.scaler, self.y_scaler = MinMaxScaler(), MinMaxScaler()
+        self.__chunk_rows = []
+        for X, y in self.chunks(file):
+            self.scaler.partial_fit(X)
+            self.y_scaler.partial_fit(y.reshape(-1, 1))
+            self.__chunk_rows.append(X.shape[0])
+        self.n_samples_ = int(sum(self.__chunk_rows))
+        if self.__debug:
+            print("Scaler ajustado con", self.n_samples_, "anuncios en", len(self.__chunk_rows), "trozos")
+
+        return self
+
+    def fit_forest(self, file):
+        '''
+        Entrena un bosque con cada trozo del dataset en un pool de procesos y los une en un único
+        RandomForestRegressor (entrenado con las features escaladas, como en main.ipynb). Requiere fit_scaler.
+
+        Parametros:
+        * file: fichero con el dataset
+        Resultado:
+        * El RandomForestRegressor con trees_per_chunk árboles por trozo
+        '''
+        bosques = {}
+        en_vuelo = {}
+        with ProcessPoolExecutor(max_workers=self.__max_workers) as executor:
+            for n, (X, y) in enumerate(self.chunks(file)):
+                if len(en_vuelo) >= self.__max_workers:
+                    # Se espera a que acabe algún trozo antes de leer el siguiente para acotar la memoria
+                    terminados, _ = wait(en_vuelo, return_when=FIRST_COMPLETED)
+                    for future in terminados:
+                        bosques[en_vuelo.pop(future)] = future.result()
+                # Los árboles de scikit-learn trabajan en float32: se envía así al proceso para no copiar el doble
+                X_scal = self.scaler.transform(X).astype(np.float32)
+                en_vuelo[executor.submit(_fit_subforest, X_scal, y, self.__trees_per_chunk, self.__tree_params,
+                                         self.__random_state + n)] = n
+            for future in list(en_vuelo):
+                bosques[en_vuelo.pop(future)] = future.result()
+
+        # Se unen en el orden de los trozos para que el resultado no dependa de qué proceso acaba antes
+        self.forest = bosques[0]
+        for n in range(1, len(bosques)):
+            self.forest.estimators_.extend(bosques[n].estimators_)
+        self.forest.n_estimators = len(self.forest.estimators_)
+        self.forest.set_params(n_jobs=-1)
+        if self.__debug:
+            print("Bosque con", self.forest.n_estimators, "árboles de", len(bosques), "trozos")
+
+        return self.forest
+
+    def batches(self, file, batch_size = None, shuffle = True, epoch = 0):
+        '''
+        Generador de minibatches de una época para la red neuronal: features escaladas y target escalado con el
+        MinMaxScaler del target. Los minibatches no mezclan trozos (el último de cada trozo puede ser más pequeño).
+
+        Parametros:
+        * file: fichero con el dataset
+        * batch_size: anuncios de cada minibatch (por defecto el del constructor)
+        * shuffle: si vale True se barajan las filas de cada trozo
+        * epoch: número de época (cambia el orden al barajar)
+        Resultado:
+        * Iterador de tuplas (X, y) de float32
+        '''
+        batch_size = batch_size if batch_size is not None else self.__batch_size
+        rng = np.random.default_rng([self.__random_state, epoch])
+        for X, y in self.chunks(file):
+            X_scal = self.scaler.transform(X).astype(np.float32)
+            y_scal = self.y_scaler.transform(y.reshape(-1, 1)).astype(np.float32)
+            orden = rng.permutation(X.shape[0]) if shuffle else np.arange(X.shape[0])
+            for inicio in range(0, X.shape[0], batch_size):
+                seleccion = orden[inicio:inicio + batch_size]
+                yield X_scal[seleccion], y_scal[seleccion]
+
+    def steps_per_epoch(self, batch_size = None):
+        '''
+        Número de minibatches de una época (según los trozos leídos en fit_scaler).
+        '''
+        batch_size = batch_size if batch_size is not None else self.__batch_size
+
+        return int(sum(math.ceil(filas / batch_size) for filas in self.__chunk_rows))
+
+    def __endless_batches(self, file):
+        '''
+        Método "privado".
+        Generador sin fin que keras consume con steps_per_epoch minibatches por época.
+        '''
+        epoch = 0
+        while True:
+            yield from self.batches(file, epoch=epoch)
+            epoch += 1
+
+    def __build_network(self, n_features):
+        from keras.models import Sequential
+        from keras.layers import Dense
+
+        model = Sequential()
+        model.add(Dense(input_shape = (n_features,), units=14, activation='tanh'))
+        model.add(Dense(units=6, activation='tanh'))
+        model.add(Dense(units=1))
+        model.compile(loss = "mean_squared_error", optimizer="adam")
+
+        return model
+
+    def fit_network(self, file):
+        '''
+        Entrena la red neuronal con el generador de minibatches. Requiere fit_scaler.
+
+        Parametros:
+        * file: fichero con el dataset
+        Resultado:
+        * El modelo de keras
+        '''
+        self.dl_model = self.__build_network(len(self.features))
+        self.dl_model.fit(self.__endless_batches(file), steps_per_epoch=self.steps_per_epoch(), epochs=self.__epochs,
+                          verbose=0)
+
+        return self.dl_model
+
+    def fit(self, file):
+        '''
+        Entrenamiento completo por trozos: MinMaxScaler, bosque y (si neural vale True) red neuronal.
+
+        Parametros:
+        * file: fichero con el dataset
+        Resultado:
+        * El propio objeto
+        '''
+        inicio = time.perf_counter()
+        self.fit_scaler(file)
+        self.fit_forest(file)
+        if self.__neural:
+            self.fit_network(file)
+        if self.__debug:
+            print("Entrenamiento por trozos en", time.perf_counter() - inicio, "s")
+
+        return self
+
+    def predict(self, X):
+        '''
+        Predice el precio con el bosque y, si está entrenada, con la red neuronal.
+
+        Parametros:
+        * X: DataFrame con al menos las columnas de 'features' (o matriz en ese orden), sin escalar
+        Resultado:
+        * Tupla (predicción del bosque, predicción de la red neuronal o None)
+        '''
+        X = X[self.features].to_numpy(np.float64) if hasattr(X, 'columns') else np.asarray(X, dtype=np.float64)
+        X_scal = self.scaler.transform(X)
+        dl_prediction = None
+        if self.dl_model is not None:
+            dl_prediction = self.y_scaler.inverse_transform(self.dl_model.predict(X_scal, verbose=0)).ravel()
+
+        return self.forest.predict(X_scal), dl_prediction
+
+    def evaluate(self, file):
+        '''
+        Calcula el R2 y el error absoluto medio de los modelos recorriendo un dataset por trozos.
+
+        Parametros:
+        * file: fichero con el dataset de test
+        Resultado:
+        * Diccionario {modelo: {"r2": ..., "mae": ...}} con 'forest' y, si está entrenada, 'neural'
+        '''
+        n, media, m2 = 0, 0.0, 0.0
+        errores = {}
+        for X, y in self.chunks(file):
+            forest_prediction, dl_prediction = self.predict(X)
+            # Media y suma de cuadrados de las desviaciones combinando las de cada trozo (sin perder precisión)
+            delta = y.mean() - media
+            m2 += np.square(y - y.mean()).sum() + delta * delta * n * y.shape[0] / (n + y.shape[0])
+            media += delta * y.shape[0] / (n + y.shape[0])
+            n += y.shape[0]
+            for modelo, y_pred in (("forest", forest_prediction), ("neural", dl_prediction)):
+                if y_pred is None:
+                    continue
+                sse, sae = errores.get(modelo, (0.0, 0.0))
+                errores[modelo] = (sse + np.square(y - y_pred).sum(), sae + np.abs(y - y_pred).sum())
+
+        return {modelo: {"r2": 1 - sse / m2, "mae": sae / n} for modelo, (sse, sae) in errores.items()}
+
+    def compare(self, train_file, test_file):
+        '''
+        Entrena por trozos con train_file y compara el resultado en test_file con el del entrenamiento en memoria
+        (MinMaxScaler.fit, un RandomForestRegressor con el mismo número de árboles y los mismos parámetros y la red
+        neuronal con todo el dataset cargado).
+        Unir los bosques de los trozos no es gratis: cada árbol solo ve un trozo, así que con trozos pequeños el bosque
+        pierde precisión frente al entrenado en memoria. Con 'X_train.df'/'X_test.df' y 10 árboles por trozo
+        (IdealistaBenchmark.out_of_core), el bosque unido obtiene R2 0,978 y MAE 33.600 € con trozos de 1.000 filas
+        y R2 0,987 y MAE 25.700 € con trozos de 3.000, frente a R2 0,995 y MAE 13.400-14.000 € en memoria: el trozo
+        debe ser tan grande como permita la memoria.
+
+        Parametros:
+        * train_file: fichero con el dataset de entrenamiento
+        * test_file: fichero con el dataset de test
+        Resultado:
+        * DataFrame con una fila por modelo y modo de entrenamiento ('out_of_core' o 'in_memory'): R2, error absoluto
+          medio y segundos de entrenamiento
+        '''
+        filas = []
+        inicio = time.perf_counter()
+        self.fit(train_file)
+        segundos = time.perf_counter() - inicio
+        for modelo, metricas in self.evaluate(test_file).items():
+            filas.append(dict(model=modelo, training='out_of_core', seconds=segundos, **metricas))
+
+        # Mismo lector que el entrenamiento por trozos (CSV o Parquet), juntando todos los trozos
+        X, y = (np.concatenate(partes) for partes in zip(*self.chunks(train_file)))
+        X_test, y_test = (np.concatenate(partes) for partes in zip(*self.chunks(test_file)))
+
+        from sklearn.metrics import mean_absolute_error, r2_score
+
+        inicio = time.perf_counter()
+        scaler = MinMaxScaler().fit(X)
+        forest = RandomForestRegressor(n_estimators=self.forest.n_estimators, n_jobs=-1,
+                                       random_state=self.__random_state, **self.__tree_params)
+        forest.fit(scaler.transform(X), y)
+        y_pred = forest.predict(scaler.transform(X_test))
+        filas.append(dict(model='forest', training='in_memory', seconds=time.perf_counter() - inicio,
+                          r2=r2_score(y_test, y_pred), mae=mean_absolute_error(y_test, y_pred)))
+
+        if self.dl_model is not None:
+            inicio = time.perf_counter()
+            y_scaler = MinMaxScaler().fit(y.reshape(-1, 1))
+            dl_model = self.__build_network(len(self.features))
+            dl_model.fit(scaler.transform(X), y_scaler.transform(y.reshape(-1, 1)), batch_size=self.__batch_size,
+                         epochs=self.__epochs, verbose=0)
+            y_pred = y_scaler.inverse_transform(dl_model.predict(scaler.transform(X_test), verbose=0)).ravel()
+            filas.append(dict(model='neural', training='in_memory', seconds=time.perf_counter() - inicio,
+                              r2=r2_score(y_test, y_pred), mae=mean_absolute_error(y_test, y_pred)))
+
+        comparacion = pd.DataFrame(filas, columns=["model", "training", "r2", "mae", "seconds"])
+        if self.__debug:
+            print(comparacion)
+
+        return comparacion.sort_values(["model", "training"]).reset_index(drop=True)
+
+    def save(self, models_path = 'models', name = 'out_of_core'):
+        '''
+        Graba el estado en '<name>.trainer' (pickle, como el resto de modelos del proyecto), el MinMaxScaler en
+        '<name>_minmaxscaler.scaler' y la red neuronal en '<name>_model.h5'.
+        '''
+        with open(os.path.join(models_path, name + '.trainer'), 'wb') as archivo_salida:
+            pickle.dump(self, archivo_salida)
+        with open(os.path.join(models_path, name + '_minmaxscaler.scaler'), 'wb') as archivo_salida:
+            pickle.dump(self.scaler, archivo_salida)
+        if self.dl_model is not None:
+            self.dl_model.save(os.path.join(models_path, name + '_model.h5'))
+
+    @staticmethod
+    def load(models_path = 'models', name = 'out_of_core'):
+        '''
+        Carga un estado grabado con save.
+        '''
+        with open(os.path.join(models_path, name + '.trainer'), 'rb') as archivo_entrada:
+            trainer = pickle.load(archivo_entrada)
+        fichero_h5 = os.path.join(models_path, name + '_model.h5')
+        if os.path.exists(fichero_h5):
+            import keras.models
+            trainer.dl_model = keras.models.load_model(fichero_h5)
+
+        return trainer
@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import inspect
+import json
+import os
+import threading
+import time
+import tracemalloc
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+
+from .idealistaprofile import IdealistaProfiler
+from .idealistatools import IdealistaFeatureEngineering
+
+class IdealistaPipeline:
+    '''
+    Ejecutor de un pipeline declarativo de etapas sobre DataFrames.
+    Cada etapa declara sus entradas (ficheros fuente u otras etapas) y produce un DataFrame. La salida de cada etapa
+    se guarda en una caché con la clave hash(código y parámetros de la etapa, código de los módulos de los que
+    dependen las etapas, hash del contenido de sus entradas), de modo que solo se vuelven a ejecutar las etapas cuyas
+    entradas o código han cambiado (si una etapa se repite y produce el mismo resultado, las siguientes no se repiten).
+    El código de la etapa es el de su función; el de las funciones que llama solo cuenta si está en 'dependencies'
+    (por defecto, idealistatools.py). Si cambia cualquier otra cosa de la que dependa una etapa (otro módulo, la
+    versión de pandas...), hay que ejecutar con run(force=True).
+    Las etapas independientes se ejecutan en paralelo y de cada etapa se registra el tiempo, el tamaño de su salida
+    y, si track_memory vale True, el pico de memoria de Python (tracemalloc) durante la etapa. Con varias etapas en
+    paralelo ese pico incluye lo que reservan a la vez las demás (tracemalloc es global); con max_workers=1 es el de
+    la etapa.
+    '''
+
+    manifest_name = "manifest.json"
+
+    def __init__(self, cache_dir = 'data/pipeline_cache', max_workers = 4, dependencies = None, track_memory = True,
+                 debug = False):
+        '''
+        Constructor
+        Parametros:
+            cache_dir: directorio de la caché de salidas
+            max_workers: número máximo de etapas ejecutándose a la vez
+            dependencies: ficheros de código cuyo contenido forma parte de la clave de todas las etapas
+              (por defecto, idealistatools.py, donde están las funciones de IdealistaFeatureEngineering que usan)
+            track_memory: si vale True se mide el pico de memoria de cada etapa con tracemalloc
+            debug: si vale True muestra mensajes de debug
+        '''
+        self.__cache_dir = cache_dir
+        self.__max_workers = max_workers
+        self.__track_memory = track_memory
+        self.__debug = debug
+        if dependencies is None:
+            dependencies = [inspect.getsourcefile(IdealistaFeatureEngineering)]
+        self.__code_hash = hashlib.sha256()
+        for dependencia in dependencies:
+            self.__code_hash.update(self.__file_hash(dependencia).encode('utf-8'))
+        self.__code_hash = self.__code_hash.hexdigest()
+        self.__sources = {}
+        self.__stages = {}
+        self.__lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        manifest_file = os.path.join(cache_dir, self.manifest_name)
+        self.__manifest = {}
+        if os.path.exists(manifest_file):
+            with open(manifest_file) as infile:
+                self.__manifest = json.load(infile)
+        self.log = None
+
+    def __save_manifest(self):
+        manifest_file = os.path.join(self.__cache_dir, self.manifest_name)
+        with open(manifest_file + '.tmp', 'w') as outfile:
+            json.dump(self.__manifest, outfile, indent=1)
+        os.replace(manifest_file + '.tmp', manifest_file)
+
+    def add_source(self, name, file, reader = pd.read_csv, **kwargs):
+        '''
+        Declara un fichero fuente del pipeline.
+
+        Parametros:
+        * name: nombre con el que lo usan las etapas
+        * file: fichero
+        * reader: función que lo lee (por defecto pd.read_csv)
+        * kwargs: argumentos del reader
+        '''
+        self.__sources[name] = {"file": file, "reader": reader, "kwargs": kwargs}
+        return self
+
+    def add_stage(self, name, function, inputs = (), output_file = None, **params):
+        '''
+        Declara una etapa del pipeline.
+
+        Parametros:
+        * name: nombre de la etapa (y de su salida)
+        * function: función que recibe los DataFrames de las entradas (en orden) y los params, y devuelve un DataFrame.
+          No debe modificar sus entradas
+        * inputs: nombres de las fuentes o etapas de las que depende
+        * output_file: si se indica, la salida se graba también en ese CSV
+        * params: parámetros de la función (forman parte de la clave de la caché)
+        '''
+        for entrada in inputs:
+            if entrada not in self.__sources and entrada not in self.__stages:
+                raise ValueError("La entrada '" + entrada + "' de la etapa '" + name + "' no está declarada")
+        self.__stages[name] = {"function": function, "inputs": list(inputs), "output_file": output_file, "params": params}
+        return self
+
+    def __file_hash(self, file):
+        sha = hashlib.sha256()
+        with open(file, 'rb') as infile:
+            for bloque in iter(lambda: infile.read(1 << 20), b''):
+                sha.update(bloque)
+        return sha.hexdigest()
+
+    def __frame_hash(self, data_frame):
+        '''
+        Método "privado".
+        Hash del contenido de un DataFrame (valores, índice, columnas y tipos).
+        '''
+        sha = hashlib.sha256()
+        sha.update(json.dumps([[str(c), str(t)] for c, t in data_frame.dtypes.items()]).encode('utf-8'))
+        sha.update(pd.util.hash_pandas_object(data_frame, index=True).to_numpy().tobytes())
+        return sha.hexdigest()
+
+    def __stage_key(self, name, input_hashes):
+        stage = self.__stages[name]
+        try:
+            codigo = inspect.getsource(stage["function"])
+        except (OSError, TypeError):
+            codigo = getattr(stage["function"], '__qualname__', repr(stage["function"]))
+        texto = json.dumps([name, codigo, repr(sorted(stage["params"].items())), self.__code_hash, input_hashes])
+        return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+    def __run_stage(self, name, entradas, profiler):
+        stage = self.__stages[name]
+        inicio = time.perf_counter()
+        with profiler.record(name):
+            salida = stage["function"](*entradas, **stage["params"])
+        segundos = time.perf_counter() - inicio
+        pico = None
+        if self.__track_memory:
+            stats_df = profiler.stats()
+            pico = float(stats_df.loc[stats_df["name"] == name, "peak_mb"].iloc[0])
+        return salida, segundos, pico
+
+    def __write_output(self, nombre, salida, clave):
+        '''
+        Método "privado".
+        Graba la salida de una etapa en su output_file si no existe o si su contenido no es el de esta salida
+        (según el hash del CSV guardado en el manifiesto).
+        '''
+        output_file = self.__stages[nombre]["output_file"]
+        if output_file is None:
+            return
+        registro = self.__manifest[clave]
+        if os.path.exists(output_file) and registro.get("output_file_hash") == self.__file_hash(output_file):
+            return
+        if salida is None:
+            salida = pd.read_pickle(os.path.join(self.__cache_dir, registro["file"]))
+        salida.to_csv(output_file, index=False)
+        with self.__lock:
+            registro["output_file_hash"] = self.__file_hash(output_file)
+            self.__save_manifest()
+
+    def run(self, targets = None, force = False):
+        '''
+        Ejecuta el pipeline.
+
+        Parametros:
+        * targets: etapas cuyo resultado se quiere (None: las etapas finales, de las que no depende ninguna otra)
+        * force: si vale True se ignora la caché (necesario si ha cambiado código que no está en 'dependencies')
+        Resultado:
+        * Diccionario {etapa: DataFrame} con las salidas de targets
+        '''
+        if targets is None:
+            entradas = {entrada for stage in self.__stages.values() for entrada in stage["inputs"]}
+            targets = [nombre for nombre in self.__stages if nombre not in entradas]
+        inicio_total = time.perf_counter()
+
+        # Etapas necesarias para obtener los targets
+        necesarias, pendientes = [], list(targets)
+        while pendientes:
+            nombre = pendientes.pop()
+            if nombre in self.__stages and nombre not in necesarias:
+                necesarias.append(nombre)
+                pendientes.extend(self.__stages[nombre]["inputs"])
+
+        hashes, datos, log = {}, {}, []
+        for nombre, source in self.__sources.items():
+            hashes[nombre] = self.__file_hash(source["file"])
+
+        def cargar(nombre):
+            # Carga perezosa: una salida solo se lee de la caché si la necesita una etapa que se ejecuta o un target
+            with self.__lock:
+                if nombre not in datos:
+                    if nombre in self.__sources:
+                        source = self.__sources[nombre]
+                        datos[nombre] = source["reader"](source["file"], **source["kwargs"])
+                    else:
+                        datos[nombre] = pd.read_pickle(os.path.join(self.__cache_dir, self.__manifest[claves[nombre]]["file"]))
+                return datos[nombre]
+
+        claves = {}
+        hechas = set()
+        en_curso = {}
+        profiler = IdealistaProfiler(memory=self.__track_memory)
+        tracemalloc_propio = self.__track_memory and not tracemalloc.is_tracing()
+        if tracemalloc_propio:
+            tracemalloc.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.__max_workers) as executor:
+                while len(hechas) < len(necesarias):
+                    avance = False
+                    for nombre in necesarias:
+                        if nombre in hechas or nombre in en_curso.values():
+                            continue
+                        entradas = self.__stages[nombre]["inputs"]
+                        if any(entrada in self.__stages and entrada not in hechas for entrada in entradas):
+                            continue
+                        claves[nombre] = self.__stage_key(nombre, [hashes[entrada] for entrada in entradas])
+                        registro = self.__manifest.get(claves[nombre])
+                        if not force and registro is not None and \
+                                os.path.exists(os.path.join(self.__cache_dir, registro["file"])):
+                            hashes[nombre] = registro["output_hash"]
+                            # Aunque la salida esté en la caché, el CSV puede faltar (otro output_path, borrado...)
+                            self.__write_output(nombre, None, claves[nombre])
+                            hechas.add(nombre)
+                            avance = True
+                            log.append({"stage": nombre, "status": "cached", "seconds": 0.0,
+                                        "output_mb": registro["output_mb"], "peak_mb": None})
+                            continue
+                        future = executor.submit(lambda n: self.__run_stage(
+                            n, [cargar(e) for e in self.__stages[n]["inputs"]], profiler), nombre)
+                        en_curso[future] = nombre
+
+                    if not en_curso:
+                        # Sin etapas en curso, solo se puede seguir si alguna etapa ha salido de la caché
+                        if not avance:
+                            raise ValueError("Dependencias circulares entre las etapas: " +
+                                             ", ".join(nombre for nombre in necesarias if nombre not in hechas))
+                        continue
+                    # Se bloquea hasta que termine alguna etapa (no hay nada nuevo que lanzar hasta entonces)
+                    terminados, _ = wait(list(en_curso), return_when=FIRST_COMPLETED)
+                    for future in terminados:
+                        nombre = en_curso.pop(future)
+                        salida, segundos, pico = future.result()
+                        hashes[nombre] = self.__frame_hash(salida)
+                        fichero = nombre + "_" + claves[nombre][:16] + ".pkl"
+                        salida.to_pickle(os.path.join(self.__cache_dir, fichero))
+                        output_mb = salida.memory_usage(deep=True).sum() / 2 ** 20
+                        with self.__lock:
+                            datos[nombre] = salida
+                            self.__manifest[claves[nombre]] = {"stage": nombre, "file": fichero,
+                                                               "output_hash": hashes[nombre], "output_mb": output_mb}
+                            self.__save_manifest()
+                        self.__write_output(nombre, salida, claves[nombre])
+                        hechas.add(nombre)
+                        log.append({"stage": nombre, "status": "run", "seconds": segundos, "output_mb": output_mb,
+                                    "peak_mb": pico})
+                        if self.__debug:
+                            print("Etapa", nombre, "ejecutada en", round(segundos, 3), "s")
+        finally:
+            if tracemalloc_propio:
+                tracemalloc.stop()
+
+        self.log = pd.DataFrame(log)
+        self.total_seconds = time.perf_counter() - inicio_total
+        if self.__debug:
+            print(self.log)
+            print("Tiempo total:", self.total_seconds)
+
+        return {nombre: cargar(nombre) for nombre in targets}
+
+# Etapas de main.ipynb, desde idealista.csv hasta idealista_madrid_model1.csv
+
+def _dedupe(idealista_df):
+    return idealista_df.drop_duplicates(subset='propertyCode', keep='last')
+
+def _barrios(spatial_join_df):
+    return spatial_join_df.drop(columns=['OBJECTID', 'Join_Count', 'TARGET_FID'])
+
+def _madrid(idealista_df, barrios_df):
+    idealista_df2 = idealista_df.merge(barrios_df, how='left', left_on='propertyCode', right_on='propertyCode')
+    return idealista_df2[idealista_df2['barrio'].notna()].reset_index(drop=True)
+
+def _clean(idealista_madrid_df):
+    idealista_fe = IdealistaFeatureEngineering()
+    idealista_madrid_df = idealista_madrid_df.copy()
+    idealista_madrid_df['newDevelopmentFinished'] = idealista_madrid_df['newDevelopmentFinished'].fillna(0.0)
+    # Al releer el CSV, como hace el notebook, estas columnas pasan a ser bool
+    idealista_madrid_df['hasParkingSpace'] = idealista_madrid_df['hasParkingSpace'].astype('boolean').fillna(False).astype(bool)
+    idealista_madrid_df['isParkingSpaceIncludedInPrice'] = \
+        idealista_madrid_df['isParkingSpaceIncludedInPrice'].astype('boolean').fillna(False).astype(bool)
+    idealista_madrid_df['status'] = idealista_madrid_df['status'].fillna(idealista_madrid_df['status'].mode()[0])
+
+    propertytype_2_floor = { "chalet": 0, "duplex": 0 }
+    sin_floor = idealista_madrid_df['floor'].isna()
+    idealista_madrid_df.loc[sin_floor, "floor"] = idealista_madrid_df.loc[sin_floor, "propertyType"].map(propertytype_2_floor)
+    idealista_madrid_df["floor"] = idealista_fe.floors_2_number(idealista_madrid_df['floor']).astype(np.float64)
+    idealista_fe.fillna_floor(idealista_madrid_df)
+    idealista_madrid_df["floor"] = idealista_madrid_df["floor"].round()
+
+    idealista_madrid_df.loc[idealista_madrid_df['hasLift'].isna() & (idealista_madrid_df['propertyType'] == 'chalet'),
+                            'hasLift'] = 0.0
+    idealista_fe.fillna_haslift(idealista_madrid_df)
+
+    return idealista_madrid_df
+
+def _clean2(idealista_madrid_clean_df, variables_a_eliminar):
+    return idealista_madrid_clean_df.drop(columns=list(variables_a_eliminar))
+
+def _featurehasher(idealista_madrid_clean_df2, column, n_features):
+    idealista_fe = IdealistaFeatureEngineering()
+    return idealista_fe.create_featurehasher(idealista_madrid_clean_df2[column].astype('str'), n_features, column)
+
+def _model1(idealista_madrid_clean_df2, codbar_df, coddistrit_df):
+    idealista_fe = IdealistaFeatureEngineering()
+    idealista_madrid_clean_df2 = idealista_madrid_clean_df2.copy()
+    idealista_madrid_clean_df2['hasLift'] = idealista_madrid_clean_df2['hasLift'].astype('int32')
+    idealista_madrid_clean_df2['newDevelopmentFinished'] = idealista_madrid_clean_df2['newDevelopmentFinished'].astype('int32')
+    idealista_fe.feateures_bool_2_number(idealista_madrid_clean_df2)
+    idealista_madrid_clean_df2 = pd.get_dummies(idealista_madrid_clean_df2, columns=['propertyType'], dtype=np.uint8)
+    idealista_madrid_clean_df2 = pd.get_dummies(idealista_madrid_clean_df2, columns=['status'], dtype=np.uint8)
+    idealista_madrid_clean_df2 = pd.concat([idealista_madrid_clean_df2.reset_index(drop=True), codbar_df, coddistrit_df],
+                                           axis = 1)
+
+    return idealista_madrid_clean_df2.drop(columns=['codbar', 'coddistrit'])
+
+'''
+Variables que main.ipynb elimina de idealista_madrid_clean.csv para crear idealista_madrid_clean2.csv
+'''
+variables_a_eliminar = ['propertyCode', 'externalReference', 'operation', 'address', 'province', 'municipality', 'country',
+                        'district', 'neighborhood', 'barrio', 'distrito', 'codbarrio', 'thumbnail', 'numPhotos',
+                        'showAddress', 'url', 'hasVideo', 'suggestedTexts', 'hasPlan', 'has3DTour', 'has360', 'hasStaging',
+                        'subTypology']
+
+def notebook_pipeline(data_path = 'data', output_path = None, cache_dir = None, max_workers = 4, debug = False):
+    '''
+    Construye el pipeline de limpieza de main.ipynb. Si existe 'idealista.csv' el pipeline empieza en él (quitar
+    duplicados y unir con el Excel del spatial join); si no, empieza en 'idealista_madrid.csv'.
+
+    Parametros:
+    * data_path: directorio de los datos de entrada
+    * output_path: si se indica, las salidas se graban en ese directorio con los nombres de los CSV del notebook
+    * cache_dir: directorio de la caché (por defecto 'pipeline_cache' en data_path)
+    * max_workers: número máximo de etapas ejecutándose a la vez
+    * debug: si vale True muestra mensajes de debug
+    Resultado:
+    * El IdealistaPipeline
+    '''
+    def output(nombre):
+        return None if output_path is None else os.path.join(output_path, nombre)
+
+    pipeline = IdealistaPipeline(cache_dir=cache_dir if cache_dir is not None else os.path.join(data_path, 'pipeline_cache'),
+                                 max_workers=max_workers, debug=debug)
+    if os.path.exists(os.path.join(data_path, 'idealista.csv')):
+        pipeline.add_source('idealista', os.path.join(data_path, 'idealista.csv'))
+        pipeline.add_source('spatial_join', os.path.join(data_path, 'Idealista_SpatialJoinBarrios.xls'), reader=pd.read_excel)
+        pipeline.add_stage('dedupe', _dedupe, ['idealista'])
+        pipeline.add_stage('barrios', _barrios, ['spatial_join'])
+        pipeline.add_stage('madrid', _madrid, ['dedupe', 'barrios'], output_file=output('idealista_madrid.csv'))
+        madrid = 'madrid'
+    else:
+        pipeline.add_source('idealista_madrid', os.path.join(data_path, 'idealista_madrid.csv'))
+        madrid = 'idealista_madrid'
+    pipeline.add_stage('clean', _clean, [madrid], output_file=output('idealista_madrid_clean.csv'))
+    pipeline.add_stage('clean2', _clean2, ['clean'], output_file=output('idealista_madrid_clean2.csv'),
+                       variables_a_eliminar=tuple(variables_a_eliminar))
+    pipeline.add_stage('codbar_hasher', _featurehasher, ['clean2'], column='codbar', n_features=5)
+    pipeline.add_stage('coddistrit_hasher', _featurehasher, ['clean2'], column='coddistrit', n_features=3)
+    pipeline.add_stage('model1', _model1, ['clean2', 'codbar_hasher', 'coddistrit_hasher'],
+                       output_file=output('idealista_madrid_model1.csv'))
+
+    return pipeline
+
+if __name__ == "__main__":
+    notebook_pipeline(debug=True).run()
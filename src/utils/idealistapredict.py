@@ -0,0 +1,771 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from .idealistaexport import IdealistaNumpyNetwork
+from .idealistageo import IdealistaDistance
+from .idealistastore import IdealistaFeatureStore
+
+class IdealistaFeatureEncoder:
+    '''
+    Clase que convierte viviendas "en bruto" (con 'propertyType', 'barrio', 'distrito', booleanos...) directamente en la
+    matriz float32 de features del modelo, en el orden de 'features_selected.npz'.
+    Se ajusta una vez con la tabla barrio/distrito -> columnas FeatureHasher ('barrio_dist_df.csv') y guarda esa tabla
+    como un array NumPy, de modo que la codificación de un lote no construye diccionarios ni DataFrames por vivienda.
+    Sustituye al relleno manual de IdealistaWebScraping.create_info_vivienda del notebook.
+    '''
+
+    prefijos_hash = ("codbar_", "coddistrit_")
+    prefijos_dummies = {"propertyType_": "propertyType", "status_": "status"}
+
+    def __init__(self, features, debug = False):
+        '''
+        Constructor
+        Parametros:
+            features: lista de features del modelo, en orden (p. ej. 'features_selected' de 'features_selected.npz')
+            debug: si vale True muestra mensajes de debug
+        '''
+        self.features = [str(feature) for feature in features]
+        self.__debug = debug
+        self.__distance = IdealistaDistance()
+        self.__hash_features = [f for f in self.features if f.startswith(self.prefijos_hash)]
+        self.__barrios = None
+        self.__table = None
+
+    def __keys(self, distritos, barrios):
+        '''
+        Método "privado".
+        Normaliza los nombres de distrito y barrio (sin espacios y en minúsculas, porque los nombres obtenidos
+        por web scraping no tienen espacios) y devuelve las claves de la tabla de barrios.
+        '''
+        normalizar = lambda nombres: pd.Series(nombres, dtype=object).astype(str).str.replace(' ', '').str.lower()
+        return pd.MultiIndex.from_arrays([normalizar(distritos), normalizar(barrios)])
+
+    def fit(self, data_frame):
+        '''
+        Construye la tabla barrio/distrito -> columnas FeatureHasher.
+
+        Parametros:
+        * data_frame: DataFrame con las columnas 'barrio', 'distrito' y las columnas 'codbar_*'/'coddistrit_*'
+          (barrio_dist_df.csv o el DataFrame de entrenamiento antes de eliminar 'barrio' y 'distrito')
+        Resultado:
+        * El propio codificador
+        '''
+        barrios_df = data_frame.drop_duplicates(subset=["barrio", "distrito"])
+        self.__barrios = self.__keys(barrios_df["distrito"], barrios_df["barrio"])
+        # La última fila (NaN) es la de los barrios desconocidos
+        self.__table = np.vstack([barrios_df[self.__hash_features].to_numpy(dtype=np.float32),
+                                  np.full((1, len(self.__hash_features)), np.nan, dtype=np.float32)])
+        if self.__debug:
+            print("Barrios:", self.__barrios.shape[0], "columnas hash:", self.__hash_features)
+
+        return self
+
+    def __column(self, listings, column, n):
+        '''
+        Método "privado".
+        Devuelve una columna del lote como array, tanto si el lote es columnar (DataFrame o dict de listas) como una lista de diccionarios.
+        '''
+        if isinstance(listings, list):
+            return np.array([listing.get(column, np.nan) for listing in listings])
+        if column in listings:
+            return np.asarray(listings[column])
+        return np.full(n, np.nan)
+
+    def transform(self, listings):
+        '''
+        Codifica un lote de viviendas.
+
+        Parametros:
+        * listings: DataFrame, diccionario de columnas, lista de diccionarios o un único diccionario. Cada vivienda
+          tiene las variables numéricas del modelo y, en lugar de las columnas codificadas, 'propertyType', 'status',
+          'barrio' y 'distrito'. Si falta 'distance' (o es nula) se calcula a partir de 'longitude' y 'latitude'
+        Resultado:
+        * Array contiguo (n, nro. de features) de tipo float32
+        '''
+        if isinstance(listings, dict) and not isinstance(next(iter(listings.values())), (list, np.ndarray, pd.Series)):
+            listings = [listings]
+        if isinstance(listings, pd.DataFrame):
+            n = listings.shape[0]
+        elif isinstance(listings, dict):
+            n = len(next(iter(listings.values())))
+        else:
+            n = len(listings)
+
+        X = np.empty((n, len(self.features)), dtype=np.float32)
+        cache = {}
+        def column(nombre):
+            if nombre not in cache:
+                cache[nombre] = self.__column(listings, nombre, n)
+            return cache[nombre]
+
+        posiciones_hash = None
+        if self.__hash_features:
+            posiciones_hash = self.__barrios.get_indexer(self.__keys(column("distrito"), column("barrio")))
+            posiciones_hash[posiciones_hash < 0] = self.__table.shape[0] - 1
+
+        for ind, feature in enumerate(self.features):
+            if feature in self.__hash_features:
+                X[:, ind] = self.__table[posiciones_hash, self.__hash_features.index(feature)]
+            elif feature.startswith(tuple(self.prefijos_dummies)):
+                prefijo = next(p for p in self.prefijos_dummies if feature.startswith(p))
+                X[:, ind] = column(self.prefijos_dummies[prefijo]) == feature[len(prefijo):]
+            elif feature == "distance":
+                distancias = pd.to_numeric(column("distance"), errors='coerce').astype(np.float64)
+                faltan = np.isnan(distancias)
+                if faltan.any():
+                    centro = [(self.__distance.longitudCentro, self.__distance.latitudCentro)]
+                    distancias[faltan] = self.__distance.distance_matrix(column("longitude")[faltan],
+                                                                         column("latitude")[faltan], centro)[:, 0]
+                X[:, ind] = distancias
+            else:
+                X[:, ind] = column(feature).astype(np.float32)
+
+        return X
+
+class IdealistaPredictor:
+    '''
+    Clase que carga una sola vez los artefactos del proyecto (lista de features, MinMaxScaler, mejor modelo de
+    Machine Learning y modelo de Deep Learning) y predice el precio de lotes de viviendas.
+    La selección de columnas y el escalado se hacen sobre una única matriz NumPy para todo el lote.
+    '''
+
+    def __init__(self, data_path = 'data', models_path = 'models', load_neural = True, store_path = None,
+                 neural_file = None, debug = False):
+        '''
+        Constructor
+        Parametros:
+            data_path: directorio con 'features_selected.npz', 'barrio_dist_df.csv' e 'y_train.serie'
+            models_path: directorio con 'minmaxscaler.scaler', 'best_GridSearchCV.gs' e 'idealista_model.h5'
+            load_neural: si vale True carga también el modelo de Deep Learning (requiere keras)
+            store_path: si se indica, la lista de features e 'y_train' se leen sin pickle del IdealistaFeatureStore
+              de ese directorio en lugar de 'features_selected.npz' e 'y_train.serie'
+            neural_file: si se indica, el modelo de Deep Learning se carga de ese fichero .npz exportado con
+              idealistaexport (IdealistaNumpyNetwork, sin TensorFlow) en lugar de 'idealista_model.h5'
+            debug: si vale True muestra mensajes de debug
+        '''
+        self.__debug = debug
+        self.__params = dict(data_path=data_path, models_path=models_path, load_neural=load_neural,
+                             store_path=store_path, neural_file=neural_file, debug=debug)
+
+        store = IdealistaFeatureStore(store_path) if store_path is not None else None
+        if store is not None:
+            self.features = store.read_list('features_selected')
+        else:
+            data = np.load(os.path.join(data_path, 'features_selected.npz'), allow_pickle=True)
+            self.features = [str(feature) for feature in data['features_selected']]
+        self.encoder = IdealistaFeatureEncoder(self.features).fit(pd.read_csv(os.path.join(data_path, 'barrio_dist_df.csv')))
+
+        # Ficheros de los modelos cargados (si cambian, las predicciones cacheadas dejan de valer)
+        self.artifacts = [os.path.join(models_path, 'minmaxscaler.scaler'), os.path.join(models_path, 'best_GridSearchCV.gs')]
+        with open(self.artifacts[0], 'rb') as archivo_entrada:
+            scaler = pickle.load(archivo_entrada)
+        # MinMaxScaler.transform es X * scale_ + min_
+        self.__scale = scaler.scale_.astype(np.float64)
+        self.__min = scaler.min_.astype(np.float64)
+
+        with open(self.artifacts[1], 'rb') as archivo_entrada:
+            self.ml_model = pickle.load(archivo_entrada).best_estimator_
+
+        self.dl_model = None
+        if load_neural and neural_file is not None:
+            # La red exportada ya incluye el MinMaxScaler de las features y el del target
+            self.dl_model = IdealistaNumpyNetwork.load(neural_file)
+            self.artifacts.append(neural_file)
+        elif load_neural:
+            import keras.models
+            self.artifacts.append(os.path.join(models_path, 'idealista_model.h5'))
+            self.dl_model = keras.models.load_model(self.artifacts[-1])
+            # El modelo de Deep Learning se entrenó con el target escalado con un MinMaxScaler sobre y_train
+            if store is not None:
+                y_train = store.read('y_train')
+            else:
+                y_train = pd.read_pickle(os.path.join(data_path, 'y_train.serie'))
+            self.__y_min = float(y_train.min())
+            self.__y_range = float(y_train.max()) - self.__y_min
+
+        if self.__debug:
+            print("Features:", self.features)
+            print("Modelo ML:", self.ml_model)
+            print("Modelo DL cargado:", self.dl_model is not None)
+
+    def reload(self):
+        '''
+        Vuelve a cargar los artefactos con los mismos parámetros del constructor (p. ej. después de reentrenar).
+        '''
+        self.__init__(**self.__params)
+
+    def to_matrix(self, listings):
+        '''
+        Convierte un lote de viviendas en la matriz de features del modelo (en el orden de 'features_selected').
+
+        Parametros:
+        * listings: DataFrame, lista de diccionarios (p. ej. el resultado de IdealistaWebScraping.create_info_vivienda)
+          o un único diccionario
+        Resultado:
+        * Array (n, nro. de features) de tipo float64
+        '''
+        if isinstance(listings, pd.DataFrame):
+            return listings[self.features].to_numpy(dtype=np.float64)
+        if isinstance(listings, dict):
+            listings = [listings]
+
+        return np.array([[listing[feature] for feature in self.features] for listing in listings], dtype=np.float64)
+
+    def predict_matrix(self, X):
+        '''
+        Escala una matriz de features y predice el precio con los dos modelos.
+
+        Parametros:
+        * X: array (n, nro. de features) en el orden de 'features_selected'
+        Resultado:
+        * Tupla (predicciones del modelo de ML, predicciones del modelo de DL o None)
+        '''
+        X_scal = X * self.__scale + self.__min
+        ml_pred = self.ml_model.predict(X_scal)
+
+        dl_pred = None
+        if isinstance(self.dl_model, IdealistaNumpyNetwork):
+            dl_pred = self.dl_model.predict(X)
+        elif self.dl_model is not None:
+            dl_pred = self.dl_model.predict(X_scal, verbose=0).ravel() * self.__y_range + self.__y_min
+
+        return ml_pred, dl_pred
+
+    def predict(self, listings):
+        '''
+        Predice el precio de un lote de viviendas.
+
+        Parametros:
+        * listings: DataFrame, lista de diccionarios o un único diccionario con las features del modelo
+        Resultado:
+        * DataFrame con las columnas 'ml_prediction' y, si se ha cargado el modelo de Deep Learning, 'dl_prediction'
+        '''
+        ml_pred, dl_pred = self.predict_matrix(self.to_matrix(listings))
+        prediccion_df = pd.DataFrame({"ml_prediction": ml_pred})
+        if dl_pred is not None:
+            prediccion_df["dl_prediction"] = dl_pred
+        if isinstance(listings, pd.DataFrame):
+            prediccion_df.index = listings.index
+
+        return prediccion_df
+
+    def predict_listings(self, listings):
+        '''
+        Predice el precio de un lote de viviendas sin codificar (ver IdealistaFeatureEncoder.transform).
+
+        Parametros:
+        * listings: DataFrame, diccionario de columnas, lista de diccionarios o un único diccionario
+        Resultado:
+        * DataFrame con las columnas 'ml_prediction' y, si se ha cargado el modelo de Deep Learning, 'dl_prediction'
+        '''
+        ml_pred, dl_pred = self.predict_matrix(self.encoder.transform(listings).astype(np.float64))
+        prediccion_df = pd.DataFrame({"ml_prediction": ml_pred})
+        if dl_pred is not None:
+            prediccion_df["dl_prediction"] = dl_pred
+        if isinstance(listings, pd.DataFrame):
+            prediccion_df.index = listings.index
+
+        return prediccion_df
+
+class IdealistaPredictionCache:
+    '''
+    Caché de predicciones delante de un IdealistaPredictor, para las viviendas que se valoran una y otra vez
+    (usuarios que recargan la página, anuncios que se vuelven a descargar con extract_advertisement_info).
+    - La clave es el vector de entrada del modelo normalizado (las features en el orden de create_info_vivienda /
+      'features_selected', como float64 con -0.0 y NaN normalizados): en memoria, sus bytes (que el diccionario
+      hashea) y en disco, un hash BLAKE2 de la versión de los modelos y de esos bytes.
+    - Nivel en memoria LRU con caducidad (TTL) y, opcionalmente, un nivel en disco (SQLite en modo WAL) compartido
+      entre los procesos que sirven predicciones con los mismos modelos.
+    - La versión de los modelos es el hash del contenido de los artefactos cargados por el predictor
+      ('minmaxscaler.scaler', 'best_GridSearchCV.gs' e 'idealista_model.h5' o la red exportada). Cada
+      'check_interval' segundos se comprueba la fecha y el tamaño de esos ficheros; si han cambiado se recargan
+      los modelos y se descartan las predicciones de la versión anterior.
+    - El bloqueo solo protege la consulta y la actualización de la caché: los modelos y la escritura en disco se
+      ejecutan sin él, y si varios hilos piden a la vez una vivienda que no está en la caché, solo uno la predice
+      y los demás esperan su resultado.
+    Tiene la misma interfaz que IdealistaPredictor (to_matrix, predict_matrix, predict, predict_listings), así que
+    se puede usar con IdealistaMicroBatcher y serve.
+    '''
+
+    def __init__(self, predictor, max_entries = 100000, ttl = 3600, disk_file = None, check_interval = 1.0,
+                 debug = False):
+        '''
+        Constructor
+        Parametros:
+            predictor: IdealistaPredictor
+            max_entries: número máximo de predicciones en memoria
+            ttl: segundos que vale una predicción (None: sin caducidad)
+            disk_file: si se indica, fichero SQLite del nivel en disco
+            check_interval: segundos entre comprobaciones de los artefactos de los modelos
+            debug: si vale True muestra mensajes de debug
+        '''
+        self.__predictor = predictor
+        self.__max_entries = max_entries
+        self.__ttl = ttl if ttl is not None else np.inf
+        self.__check_interval = check_interval
+        self.__debug = debug
+        self.__lock = threading.RLock()
+        self.__disk_lock = threading.Lock()
+        self.__memoria = OrderedDict()
+        self.__en_curso = {}
+        self.__metricas = {"hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "expirations": 0,
+                           "invalidations": 0}
+
+        self.__firmas = self.__signatures()
+        self.version = self.__version()
+        self.__comprobado = time.monotonic()
+
+        self.__disk = None
+        if disk_file is not None:
+            self.__disk = sqlite3.connect(disk_file, timeout=30, check_same_thread=False, isolation_level=None)
+            self.__disk.execute("PRAGMA journal_mode=WAL")
+            # Una caché puede perder las últimas escrituras si se cae la máquina: no hace falta sincronizar cada una
+            self.__disk.execute("PRAGMA synchronous=NORMAL")
+            self.__disk.execute("CREATE TABLE IF NOT EXISTS predictions (key TEXT PRIMARY KEY, version TEXT, "
+                                "ml REAL, dl REAL, expires REAL)")
+
+    def __signatures(self):
+        '''
+        Método "privado".
+        Fecha de modificación y tamaño de cada artefacto (comprobación barata de si han cambiado).
+        '''
+        firmas = []
+        for artefacto in self.__predictor.artifacts:
+            estado = os.stat(artefacto)
+            firmas.append((artefacto, estado.st_mtime_ns, estado.st_size))
+
+        return firmas
+
+    def __version(self):
+        '''
+        Método "privado".
+        Hash del contenido de los artefactos y de la lista de features.
+        '''
+        sha = hashlib.sha256(json.dumps(self.__predictor.features).encode('utf-8'))
+        for artefacto in self.__predictor.artifacts:
+            with open(artefacto, 'rb') as infile:
+                for bloque in iter(lambda: infile.read(1 << 20), b''):
+                    sha.update(bloque)
+
+        return sha.hexdigest()[:16]
+
+    def check_version(self):
+        '''
+        Comprueba si han cambiado los artefactos de los modelos y, si es así, recarga el predictor y descarta las
+        predicciones cacheadas de la versión anterior.
+
+        Resultado:
+        * True si ha cambiado la versión de los modelos
+        '''
+        with self.__lock:
+            self.__comprobado = time.monotonic()
+            firmas = self.__signatures()
+            if firmas == self.__firmas:
+                return False
+            self.__firmas = firmas
+            version = self.__version()
+            if version == self.version:
+                # Solo ha cambiado la fecha (p. ej. se ha vuelto a copiar el mismo fichero)
+                return False
+
+            self.__predictor.reload()
+            self.__firmas = self.__signatures()
+            self.version = self.__version()
+            self.__memoria.clear()
+            self.__metricas["invalidations"] += 1
+            if self.__disk is not None:
+                with self.__disk_lock:
+                    self.__disk.execute("DELETE FROM predictions WHERE version != ?", (self.version,))
+            if self.__debug:
+                print("Modelos recargados, versión:", self.version)
+
+            return True
+
+    def __rows(self, X):
+        '''
+        Método "privado".
+        Bytes de cada fila de la matriz normalizada: float64, -0.0 como 0.0 y un único NaN.
+        '''
+        X = np.array(X, dtype=np.float64, order='C') + 0.0
+        X[np.isnan(X)] = np.nan
+
+        return X.view(np.dtype((np.void, X.shape[1] * 8))).ravel().tolist()
+
+    def __disk_key(self, fila, version):
+        sha = hashlib.blake2b(version.encode('utf-8'), digest_size=16)
+        sha.update(fila)
+        return sha.hexdigest()
+
+    def keys(self, X):
+        '''
+        Calcula la clave de la caché en disco de cada fila de una matriz de features.
+
+        Parametros:
+        * X: array (n, nro. de features) en el orden de 'features_selected'
+        Resultado:
+        * Lista de claves (hexadecimales)
+        '''
+        return [self.__disk_key(fila, self.version) for fila in self.__rows(X)]
+
+    def __put(self, clave, valor):
+        self.__memoria[clave] = valor
+        self.__memoria.move_to_end(clave)
+        while len(self.__memoria) > self.__max_entries:
+            self.__memoria.popitem(last=False)
+            self.__metricas["evictions"] += 1
+
+    def __disk_get(self, claves, ahora):
+        '''
+        Método "privado".
+        Busca las claves en el nivel en disco (en grupos, por el límite de parámetros de SQLite).
+        '''
+        encontradas = {}
+        for inicio in range(0, len(claves), 500):
+            grupo = claves[inicio:inicio + 500]
+            consulta = ("SELECT key, ml, dl, expires FROM predictions WHERE expires > ? AND key IN (" +
+                        ",".join("?" * len(grupo)) + ")")
+            for clave, ml, dl, expira in self.__disk.execute(consulta, [ahora] + grupo):
+                encontradas[clave] = (ml, dl, expira)
+
+        return encontradas
+
+    def __fill(self, ml_pred, dl_pred, filas, valores):
+        '''
+        Método "privado".
+        Copia las predicciones (ml, dl, caducidad) en las filas indicadas.
+        '''
+        if filas:
+            ml_pred[filas] = [valor[0] for valor in valores]
+            if dl_pred is not None:
+                dl_pred[filas] = [valor[1] for valor in valores]
+
+    def predict_matrix(self, X):
+        '''
+        Predice el precio de una matriz de features con los dos modelos, usando la caché.
+
+        Parametros:
+        * X: array (n, nro. de features) en el orden de 'features_selected'
+        Resultado:
+        * Tupla (predicciones del modelo de ML, predicciones del modelo de DL o None), como IdealistaPredictor
+        '''
+        if time.monotonic() - self.__comprobado >= self.__check_interval:
+            self.check_version()
+
+        claves = self.__rows(X)
+        n = len(claves)
+        ahora = time.time()
+        with self.__lock:
+            # Las predicciones calculadas con una versión solo se guardan si sigue siendo la actual
+            version = self.version
+            ml_pred = np.empty(n, dtype=np.float64)
+            dl_pred = np.empty(n, dtype=np.float64) if self.__predictor.dl_model is not None else None
+
+            faltan, filas, valores = [], [], []
+            for ind, clave in enumerate(claves):
+                valor = self.__memoria.get(clave)
+                if valor is not None and valor[2] <= ahora:
+                    del self.__memoria[clave]
+                    self.__metricas["expirations"] += 1
+                    valor = None
+                if valor is None:
+                    faltan.append(ind)
+                else:
+                    self.__memoria.move_to_end(clave)
+                    filas.append(ind)
+                    valores.append(valor)
+            self.__metricas["hits"] += len(filas)
+        self.__fill(ml_pred, dl_pred, filas, valores)
+
+        if faltan and self.__disk is not None:
+            claves_disco = {claves[ind]: self.__disk_key(claves[ind], version) for ind in faltan}
+            with self.__disk_lock:
+                encontradas = self.__disk_get(list(set(claves_disco.values())), ahora)
+            siguen, filas, valores = [], [], []
+            for ind in faltan:
+                valor = encontradas.get(claves_disco[claves[ind]])
+                if valor is None or (dl_pred is not None and valor[1] is None):
+                    siguen.append(ind)
+                else:
+                    filas.append(ind)
+                    valores.append(valor)
+            with self.__lock:
+                if self.version == version:
+                    for ind, valor in zip(filas, valores):
+                        self.__put(claves[ind], valor)
+                self.__metricas["disk_hits"] += len(filas)
+            self.__fill(ml_pred, dl_pred, filas, valores)
+            faltan = siguen
+
+        if faltan:
+            # Las viviendas repetidas dentro del lote, o que otro hilo ya está prediciendo, se predicen una sola vez
+            unicas = {}
+            for ind in faltan:
+                unicas.setdefault(claves[ind], ind)
+            propias, ajenas = {}, {}
+            with self.__lock:
+                for clave in unicas:
+                    futuro = self.__en_curso.get(clave)
+                    if futuro is None:
+                        propias[clave] = self.__en_curso[clave] = Future()
+                    else:
+                        ajenas[clave] = futuro
+                self.__metricas["misses"] += len(faltan)
+                self.__metricas["coalesced"] += len(ajenas)
+
+            nuevas = {}
+            if propias:
+                try:
+                    ml_nuevas, dl_nuevas = self.__predictor.predict_matrix(
+                        np.asarray(X, dtype=np.float64)[[unicas[clave] for clave in propias]])
+                except BaseException as ex:
+                    with self.__lock:
+                        for clave, futuro in propias.items():
+                            del self.__en_curso[clave]
+                            futuro.set_exception(ex)
+                    raise
+                expira = ahora + self.__ttl
+                for pos, clave in enumerate(propias):
+                    nuevas[clave] = (float(ml_nuevas[pos]), float(dl_nuevas[pos]) if dl_nuevas is not None else None, expira)
+                with self.__lock:
+                    if self.version == version:
+                        for clave, valor in nuevas.items():
+                            self.__put(clave, valor)
+                    for clave, futuro in propias.items():
+                        del self.__en_curso[clave]
+                        futuro.set_result(nuevas[clave])
+                if self.__disk is not None and self.version == version:
+                    with self.__disk_lock:
+                        self.__disk.executemany("INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?)",
+                                                [(self.__disk_key(clave, version), version, ml, dl, min(expira, 1e300))
+                                                 for clave, (ml, dl, expira) in nuevas.items()])
+            for clave, futuro in ajenas.items():
+                nuevas[clave] = futuro.result()
+            self.__fill(ml_pred, dl_pred, faltan, [nuevas[claves[ind]] for ind in faltan])
+
+        return ml_pred, dl_pred
+
+    def to_matrix(self, listings):
+        '''
+        Ver IdealistaPredictor.to_matrix.
+        '''
+        return self.__predictor.to_matrix(listings)
+
+    def __frame(self, listings, ml_pred, dl_pred):
+        prediccion_df = pd.DataFrame({"ml_prediction": ml_pred})
+        if dl_pred is not None:
+            prediccion_df["dl_prediction"] = dl_pred
+        if isinstance(listings, pd.DataFrame):
+            prediccion_df.index = listings.index
+
+        return prediccion_df
+
+    def predict(self, listings):
+        '''
+        Ver IdealistaPredictor.predict.
+        '''
+        return self.__frame(listings, *self.predict_matrix(self.__predictor.to_matrix(listings)))
+
+    def predict_listings(self, listings):
+        '''
+        Ver IdealistaPredictor.predict_listings.
+        '''
+        return self.__frame(listings, *self.predict_matrix(self.__predictor.encoder.transform(listings)))
+
+    def clear(self):
+        '''
+        Vacía la caché (los dos niveles) sin cambiar las métricas.
+        '''
+        with self.__lock:
+            self.__memoria.clear()
+            if self.__disk is not None:
+                with self.__disk_lock:
+                    self.__disk.execute("DELETE FROM predictions")
+
+    def stats(self):
+        '''
+        Devuelve las métricas de la caché.
+
+        Resultado:
+        * Diccionario con los aciertos (en memoria y en disco), fallos, fallos resueltos por la predicción de otro
+          hilo ('coalesced'), desalojos, caducadas, invalidaciones,
+          la tasa de aciertos, las entradas en memoria y la versión de los modelos
+        '''
+        with self.__lock:
+            metricas = dict(self.__metricas)
+            metricas["entries"] = len(self.__memoria)
+        total = metricas["hits"] + metricas["disk_hits"] + metricas["misses"]
+        metricas["hit_rate"] = (metricas["hits"] + metricas["disk_hits"]) / total if total else 0.0
+        metricas["version"] = self.version
+
+        return metricas
+
+class IdealistaMicroBatcher:
+    '''
+    Clase que agrupa en un único lote las peticiones de predicción concurrentes (por ejemplo, las de varios
+    clientes HTTP) para que los modelos hagan una sola predicción vectorizada por lote.
+    '''
+
+    def __init__(self, predictor, max_batch_rows = 1024, max_wait_ms = 5, debug = False):
+        '''
+        Constructor
+        Parametros:
+            predictor: IdealistaPredictor
+            max_batch_rows: número máximo de viviendas por lote
+            max_wait_ms: tiempo máximo que espera una petición a que lleguen otras para formar el lote
+            debug: si vale True muestra mensajes de debug
+        '''
+        self.__predictor = predictor
+        self.__max_batch_rows = max_batch_rows
+        self.__max_wait = max_wait_ms / 1000.0
+        self.__debug = debug
+        self.__queue = queue.Queue()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def submit(self, listings):
+        '''
+        Encola un lote de viviendas.
+
+        Parametros:
+        * listings: DataFrame, lista de diccionarios o un único diccionario con las features del modelo
+        Resultado:
+        * Future cuyo resultado es el DataFrame de IdealistaPredictor.predict
+        '''
+        future = Future()
+        self.__queue.put((self.__predictor.to_matrix(listings), future))
+        return future
+
+    def predict(self, listings):
+        '''
+        Predice el precio de un lote de viviendas esperando a que se procese su micro-lote.
+        '''
+        return self.submit(listings).result()
+
+    def __run(self):
+        while True:
+            peticiones = [self.__queue.get()]
+            filas = peticiones[0][0].shape[0]
+            limite = time.monotonic() + self.__max_wait
+            while filas < self.__max_batch_rows:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    peticion = self.__queue.get(timeout=restante)
+                except queue.Empty:
+                    break
+                peticiones.append(peticion)
+                filas += peticion[0].shape[0]
+
+            try:
+                ml_pred, dl_pred = self.__predictor.predict_matrix(np.vstack([X for X, _ in peticiones]))
+            except Exception as ex:
+                for _, future in peticiones:
+                    future.set_exception(ex)
+                continue
+            if self.__debug:
+                print("Micro-lote:", len(peticiones), "peticiones,", filas, "viviendas")
+
+            inicio = 0
+            for X, future in peticiones:
+                fin = inicio + X.shape[0]
+                prediccion_df = pd.DataFrame({"ml_prediction": ml_pred[inicio:fin]})
+                if dl_pred is not None:
+                    prediccion_df["dl_prediction"] = dl_pred[inicio:fin]
+                future.set_result(prediccion_df)
+                inicio = fin
+
+def serve(predictor, host = '127.0.0.1', port = 8000, max_batch_rows = 1024, max_wait_ms = 5):
+    '''
+    Arranca un servidor HTTP local con el endpoint POST /predict, que recibe un JSON con una lista de viviendas
+    (o una sola) y devuelve una lista con las predicciones de cada una.
+
+    Parametros:
+    * predictor: IdealistaPredictor
+    * host, port: dirección del servidor
+    * max_batch_rows, max_wait_ms: parámetros de IdealistaMicroBatcher
+    '''
+    batcher = IdealistaMicroBatcher(predictor, max_batch_rows=max_batch_rows, max_wait_ms=max_wait_ms)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            codigo = 200
+            try:
+                if self.path != "/predict":
+                    codigo, cuerpo = 404, {"error": "not found"}
+                else:
+                    listings = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+                    cuerpo = batcher.predict(listings).to_dict(orient='records')
+            except (KeyError, ValueError, TypeError) as ex:
+                codigo, cuerpo = 400, {"error": str(ex)}
+            except Exception as ex:
+                # Cualquier otro fallo (p. ej. del modelo) se devuelve como JSON en vez de cortar la conexión
+                codigo, cuerpo = 500, {"error": type(ex).__name__ + ": " + str(ex)}
+            datos = json.dumps(cuerpo).encode("utf-8")
+            self.send_response(codigo)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(datos)))
+            self.end_headers()
+            self.wfile.write(datos)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    print("Sirviendo predicciones en http://" + host + ":" + str(server.server_address[1]) + "/predict")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Predicción del precio de viviendas de Idealista")
+    parser.add_argument("--data-path", default="data")
+    parser.add_argument("--models-path", default="models")
+    parser.add_argument("--store-path", help="directorio del IdealistaFeatureStore (lectura sin pickle)")
+    parser.add_argument("--no-neural", action="store_true", help="no cargar el modelo de Deep Learning")
+    parser.add_argument("--neural-file", help="modelo de Deep Learning exportado a NumPy (.npz, sin TensorFlow)")
+    parser.add_argument("--input", help="CSV con las features de las viviendas a predecir")
+    parser.add_argument("--output", help="CSV donde se graban las predicciones (por defecto, la salida estándar)")
+    parser.add_argument("--serve", action="store_true", help="arrancar el servidor HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--cache-size", type=int, default=0, help="predicciones en la caché en memoria (0: sin caché)")
+    parser.add_argument("--cache-ttl", type=float, default=3600, help="segundos que vale una predicción cacheada")
+    parser.add_argument("--cache-file", help="fichero SQLite de la caché en disco compartida entre procesos")
+    args = parser.parse_args()
+
+    predictor = IdealistaPredictor(data_path=args.data_path, models_path=args.models_path, load_neural=not args.no_neural,
+                                   store_path=args.store_path, neural_file=args.neural_file)
+    if args.cache_size > 0:
+        predictor = IdealistaPredictionCache(predictor, max_entries=args.cache_size, ttl=args.cache_ttl,
+                                             disk_file=args.cache_file)
+    if args.serve:
+        serve(predictor, host=args.host, port=args.port)
+    elif args.input:
+        prediccion_df = predictor.predict(pd.read_csv(args.input))
+        if args.output:
+            prediccion_df.to_csv(args.output, index=False)
+        else:
+            print(prediccion_df.to_csv(index=False))
+    else:
+        parser.print_help()
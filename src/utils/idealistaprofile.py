@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+import functools
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+class IdealistaProfiler:
+    '''
+    Instrumentación opcional de las clases del proyecto: sustituye los métodos públicos de las clases indicadas
+    por envoltorios que registran, por método, el número de llamadas, el tiempo (total, medio y máximo) y,
+    si se pide, el pico de memoria de Python (tracemalloc) de cada llamada. Al terminar se restauran los métodos
+    originales, así que sin instrumentar el código no paga ningún coste.
+    Los tiempos de un método incluyen los de los métodos que llama. Con varios hilos, el pico de memoria es el
+    del proceso durante la llamada (tracemalloc es global).
+
+    Uso:
+        with IdealistaProfiler(memory=True).instrument(IdealistaFeatureEngineering, IdealistaImputer) as profiler:
+            ...
+        profiler.to_json('profile.json')
+    '''
+
+    def __init__(self, memory = False, debug = False):
+        '''
+        Constructor
+        Parametros:
+            memory: si vale True mide también el pico de memoria de cada llamada (con tracemalloc, más lento)
+            debug: si vale True muestra mensajes de debug
+        '''
+        self.__memory = memory
+        self.__debug = debug
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__originales = []
+        self.__tracemalloc_propio = False
+        self.__stats = {}
+
+    def __stack(self):
+        if not hasattr(self.__local, 'stack'):
+            self.__local.stack = []
+        return self.__local.stack
+
+    def __record(self, name, segundos, pico):
+        with self.__lock:
+            registro = self.__stats.setdefault(name, {"calls": 0, "total_seconds": 0.0, "max_seconds": 0.0,
+                                                      "peak_mb": 0.0})
+            registro["calls"] += 1
+            registro["total_seconds"] += segundos
+            registro["max_seconds"] = max(registro["max_seconds"], segundos)
+            if pico is not None:
+                registro["peak_mb"] = max(registro["peak_mb"], pico / 2**20)
+
+    @contextmanager
+    def record(self, name):
+        '''
+        Registra un bloque de código con el nombre indicado (p. ej. una etapa de un benchmark).
+        '''
+        medir_memoria = self.__memory and tracemalloc.is_tracing()
+        stack = self.__stack()
+        if medir_memoria:
+            # reset_peak borra el pico de la llamada que nos contiene, así que se guarda en la pila y se recupera al salir
+            actual, pico_padre = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1] = max(stack[-1], pico_padre)
+            tracemalloc.reset_peak()
+            stack.append(0)
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            segundos = time.perf_counter() - inicio
+            pico = None
+            if medir_memoria:
+                pico_hijos = stack.pop()
+                pico_total = max(tracemalloc.get_traced_memory()[1], pico_hijos)
+                if stack:
+                    stack[-1] = max(stack[-1], pico_total)
+                pico = pico_total - actual
+            self.__record(name, segundos, pico)
+
+    def __wrap(self, name, function):
+        '''
+        Método "privado".
+        Envoltorio de una función que registra cada llamada con 'record'.
+        '''
+        profiler = self
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with profiler.record(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    def instrument(self, *classes, methods = None):
+        '''
+        Instrumenta los métodos públicos (los que no empiezan por '_') de las clases indicadas.
+
+        Parametros:
+        * classes: clases a instrumentar (p. ej. Idealista, IdealistaFeatureEngineering, IdealistaWebScraping)
+        * methods: si se indica, lista de nombres de métodos a instrumentar
+        Resultado:
+        * El propio profiler (para usarlo con 'with')
+        '''
+        if self.__memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.__tracemalloc_propio = True
+        for cls in classes:
+            for nombre, atributo in list(vars(cls).items()):
+                if nombre.startswith('_') or (methods is not None and nombre not in methods):
+                    continue
+                clave = cls.__name__ + "." + nombre
+                if isinstance(atributo, staticmethod):
+                    nuevo = staticmethod(self.__wrap(clave, atributo.__func__))
+                elif isinstance(atributo, classmethod):
+                    nuevo = classmethod(self.__wrap(clave, atributo.__func__))
+                elif callable(atributo) and not isinstance(atributo, type):
+                    nuevo = self.__wrap(clave, atributo)
+                else:
+                    continue
+                self.__originales.append((cls, nombre, atributo))
+                setattr(cls, nombre, nuevo)
+                if self.__debug:
+                    print("Instrumentado:", clave)
+
+        return self
+
+    def restore(self):
+        '''
+        Restaura los métodos originales de las clases instrumentadas.
+        '''
+        for cls, nombre, atributo in reversed(self.__originales):
+            setattr(cls, nombre, atributo)
+        self.__originales = []
+        if self.__tracemalloc_propio:
+            tracemalloc.stop()
+            self.__tracemalloc_propio = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.restore()
+
+    def reset(self):
+        '''
+        Borra las medidas registradas.
+        '''
+        with self.__lock:
+            self.__stats = {}
+
+    def stats(self):
+        '''
+        Devuelve las medidas registradas.
+
+        Resultado:
+        * DataFrame con una fila por método o bloque: llamadas, segundos totales, medios y máximos y pico de memoria
+          en MB (0 si no se mide la memoria), ordenado por el tiempo total
+        '''
+        with self.__lock:
+            filas = [dict(name=nombre, **registro) for nombre, registro in self.__stats.items()]
+        stats_df = pd.DataFrame(filas, columns=["name", "calls", "total_seconds", "max_seconds", "peak_mb"])
+        stats_df.insert(3, "mean_seconds", stats_df["total_seconds"] / stats_df["calls"])
+
+        return stats_df.sort_values("total_seconds", ascending=False).reset_index(drop=True)
+
+    def to_json(self, file = None):
+        '''
+        Exporta las medidas como JSON.
+
+        Parametros:
+        * file: si se indica, el JSON se graba en ese fichero
+        Resultado:
+        * Lista de diccionarios con las medidas de cada método
+        '''
+        registros = self.stats().to_dict(orient='records')
+        if file is not None:
+            with open(file, 'w') as outfile:
+                json.dump(registros, outfile, indent=1)
+
+        return registros
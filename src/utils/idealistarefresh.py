@@ -0,0 +1,419 @@
+# -*- coding: utf-8 -*-
+
+import os
+import pickle
+import shutil
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.model_selection import GridSearchCV
+from sklearn.preprocessing import MinMaxScaler
+from sklearn.tree import DecisionTreeRegressor
+
+from .idealistaexport import IdealistaNumpyNetwork
+
+class IdealistaIncrementalTrainer:
+    '''
+    Clase que mantiene actualizados los modelos del proyecto con los anuncios nuevos sin repetir el entrenamiento completo:
+    - El MinMaxScaler de las features se actualiza con partial_fit. Como el cambio de escala es afín y creciente, los
+      umbrales de los árboles ya entrenados y la primera capa de la red se reescriben para que sigan dando las mismas
+      predicciones con la nueva escala (en los árboles, salvo el redondeo a float32 que hace scikit-learn de las
+      features). La escala del target de la red no cambia: es la de 'y_train', la que usa IdealistaPredictor.
+    - El RandomForestRegressor (warm_start) añade árboles entrenados solo con los anuncios nuevos.
+    - La red neuronal (misma arquitectura que en main.ipynb) se reentrena unas pocas épocas con los anuncios nuevos.
+    Antes de actualizar se comprueba si hay drift (PSI de las features o aumento del error). En ese caso, si se
+    dispone del histórico, se hace un reentrenamiento completo.
+
+    Para actualizar los modelos que usa IdealistaPredictor, el estado inicial se crea con 'from_artifacts' a partir de
+    'minmaxscaler.scaler', 'best_GridSearchCV.gs' e 'idealista_model.h5', y 'save' los vuelve a grabar en su sitio.
+    El mejor modelo de Machine Learning de main.ipynb es un DecisionTreeRegressor(max_depth=9): ese árbol pasa a ser
+    los 'n_estimators' primeros árboles (el mismo objeto, que cuenta como 'n_estimators' árboles en la media) de un
+    RandomForestRegressor con su profundidad, así que hasta la primera actualización predice exactamente lo mismo, y
+    cada actualización le añade 'new_trees' árboles. El bosque se graba como 'best_estimator_' de
+    'best_GridSearchCV.gs'.
+    '''
+
+    def __init__(self, features, n_estimators = 200, new_trees = 20, max_depth = None, epochs = 100, refresh_epochs = 5,
+                 psi_threshold = 0.25, error_threshold = 1.5, neural = True, random_state = 42, debug = False):
+        '''
+        Constructor
+        Parametros:
+            features: lista de features de los modelos (p. ej. 'features_selected')
+            n_estimators: árboles del bosque en el entrenamiento completo
+            new_trees: árboles que se añaden en cada actualización
+            max_depth: profundidad de los árboles. Si es None se elige con GridSearchCV igual que en main.ipynb
+            epochs: épocas de la red neuronal en el entrenamiento completo
+            refresh_epochs: épocas de la red neuronal en cada actualización
+            psi_threshold: PSI máximo de una feature antes de considerar que hay drift
+            error_threshold: cociente máximo entre la mediana del error relativo en los anuncios nuevos y la mediana del
+              error relativo out-of-bag del entrenamiento (la mediana no se dispara por unos pocos anuncios atípicos)
+            neural: si vale True se entrena también la red neuronal (requiere keras; con 'from_artifacts' y sin keras
+              la red no se reentrena, solo se reescriben sus pesos para la nueva escala de las features)
+            random_state: semilla
+            debug: si vale True muestra mensajes de debug
+        '''
+        self.features = list(features)
+        self.__n_estimators = n_estimators
+        self.__new_trees = new_trees
+        self.__max_depth = max_depth
+        self.__epochs = epochs
+        self.__refresh_epochs = refresh_epochs
+        self.__psi_threshold = psi_threshold
+        self.__error_threshold = error_threshold
+        self.__neural = neural
+        self.__random_state = random_state
+        self.__debug = debug
+
+        self.scaler = None
+        self.y_scaler = None
+        self.forest = None
+        self.dl_model = None
+        self.search = None
+        self.__network = None
+        self.__h5_file = None
+        self.__reference = None
+
+    def __getstate__(self):
+        # El modelo de keras se graba aparte en formato h5
+        estado = self.__dict__.copy()
+        estado['dl_model'] = None
+        return estado
+
+    def __matrix(self, X):
+        return X[self.features].to_numpy(np.float64) if hasattr(X, 'columns') else np.asarray(X, dtype=np.float64)
+
+    def __reference_stats(self, X, y_pred, y):
+        '''
+        Método "privado".
+        Guarda los cortes por cuantiles y las proporciones de cada feature (para el PSI) y el error de referencia.
+        '''
+        cortes, proporciones = [], []
+        for n in range(X.shape[1]):
+            corte = np.unique(np.quantile(X[:, n], np.linspace(0, 1, 11)[1:-1]))
+            cortes.append(corte)
+            proporciones.append(np.bincount(np.searchsorted(corte, X[:, n], side='right'), minlength=corte.size + 1) / X.shape[0])
+        self.__reference = {"cuts": cortes, "proportions": proporciones, "error": self.__error(y_pred, y)}
+
+    @staticmethod
+    def from_artifacts(data_path = 'data', models_path = 'models', new_trees = 20, base_trees = 200,
+                       refresh_epochs = 5, psi_threshold = 0.25, error_threshold = 1.5, neural = True,
+                       random_state = 42, debug = False):
+        '''
+        Crea el estado inicial a partir de los artefactos de main.ipynb, los mismos que carga IdealistaPredictor.
+
+        Parametros:
+        * data_path: directorio con 'features_selected.npz', 'X_train.df', 'y_train.serie', 'X_test.df' e 'y_test.serie'
+          (las features de X_train son la referencia del PSI y el error en X_test, la del error)
+        * models_path: directorio con 'minmaxscaler.scaler', 'best_GridSearchCV.gs' e 'idealista_model.h5'
+        * base_trees: número de árboles que cuenta el árbol de 'best_GridSearchCV.gs' en el bosque (cuanto mayor,
+          menos pesan los árboles de cada actualización)
+        * Resto: como en el constructor
+        Resultado:
+        * El IdealistaIncrementalTrainer
+        '''
+        features = [str(feature) for feature in np.load(os.path.join(data_path, 'features_selected.npz'),
+                                                        allow_pickle=True)['features_selected']]
+        trainer = IdealistaIncrementalTrainer(features, n_estimators=base_trees, new_trees=new_trees,
+                                              refresh_epochs=refresh_epochs, psi_threshold=psi_threshold,
+                                              error_threshold=error_threshold, neural=neural,
+                                              random_state=random_state, debug=debug)
+        with open(os.path.join(models_path, 'minmaxscaler.scaler'), 'rb') as archivo_entrada:
+            trainer.scaler = pickle.load(archivo_entrada)
+        with warnings.catch_warnings():
+            # El GridSearchCV se grabó con otra versión de scikit-learn
+            warnings.simplefilter("ignore")
+            with open(os.path.join(models_path, 'best_GridSearchCV.gs'), 'rb') as archivo_entrada:
+                trainer.search = pickle.load(archivo_entrada)
+
+        modelo = trainer.search.best_estimator_
+        if isinstance(modelo, RandomForestRegressor):
+            # Artefactos ya actualizados con 'save'
+            trainer.forest = modelo
+        elif isinstance(modelo, DecisionTreeRegressor):
+            trainer.forest = RandomForestRegressor(n_estimators=base_trees, max_depth=modelo.max_depth, warm_start=True,
+                                                   n_jobs=-1, random_state=random_state)
+            trainer.forest.estimators_ = [modelo] * base_trees
+            trainer.forest.n_features_in_ = modelo.n_features_in_
+            trainer.forest.n_outputs_ = modelo.n_outputs_
+        else:
+            raise ValueError("Modelo no soportado en best_GridSearchCV.gs: " + type(modelo).__name__)
+
+        y_train = pd.read_pickle(os.path.join(data_path, 'y_train.serie'))
+        trainer.y_scaler = MinMaxScaler().fit(y_train.to_numpy(np.float64).reshape(-1, 1))
+        # Los cortes del PSI son los de X_train y la referencia del error, el de X_test (el árbol no lo ha visto)
+        X_test = trainer.__matrix(pd.read_pickle(os.path.join(data_path, 'X_test.df')))
+        y_test = pd.read_pickle(os.path.join(data_path, 'y_test.serie')).to_numpy(np.float64)
+        trainer.__reference_stats(trainer.__matrix(pd.read_pickle(os.path.join(data_path, 'X_train.df'))),
+                                  trainer.forest.predict(trainer.scaler.transform(X_test)), y_test)
+
+        if neural:
+            trainer.__h5_file = os.path.join(models_path, 'idealista_model.h5')
+            try:
+                import keras.models
+                trainer.dl_model = keras.models.load_model(trainer.__h5_file)
+            except ImportError:
+                trainer.__network = IdealistaNumpyNetwork.read_h5(trainer.__h5_file)
+                if debug:
+                    print("keras no está instalado: la red no se reentrena, solo se reescala")
+
+        return trainer
+
+    def __error(self, y_pred, y):
+        return float(np.median(np.abs(y_pred - y) / np.abs(y)))
+
+    def __build_network(self, n_features):
+        from keras.models import Sequential
+        from keras.layers import Dense
+
+        model = Sequential()
+        model.add(Dense(input_shape = (n_features,), units=14, activation='tanh'))
+        model.add(Dense(units=6, activation='tanh'))
+        model.add(Dense(units=1))
+        model.compile(loss = "mean_squared_error", optimizer="adam")
+
+        return model
+
+    def fit(self, X, y):
+        '''
+        Entrenamiento completo: MinMaxScaler, GridSearchCV de la profundidad (si max_depth es None), bosque y red neuronal.
+        La escala del target de la red es la del primer entrenamiento (o la de 'y_train' con 'from_artifacts').
+
+        Parametros:
+        * X: DataFrame con al menos las columnas de 'features' (o matriz en ese orden)
+        * y: target (precio)
+        Resultado:
+        * El propio objeto
+        '''
+        X = self.__matrix(X)
+        y = np.asarray(y, dtype=np.float64)
+
+        anterior = None if self.scaler is None else (self.scaler.scale_.copy(), self.scaler.min_.copy())
+        self.scaler = MinMaxScaler().fit(X)
+        X_scal = self.scaler.transform(X)
+        max_depth = self.__max_depth
+        if max_depth is None:
+            gs = GridSearchCV(DecisionTreeRegressor(random_state=self.__random_state), {"max_depth": np.arange(2, 10)},
+                              cv=10, scoring='r2', n_jobs=-1)
+            gs.fit(X_scal, y)
+            self.search = gs
+            max_depth = int(gs.best_params_["max_depth"])
+            if self.__debug:
+                print("max_depth:", max_depth, "r2:", gs.best_score_)
+
+        self.forest = RandomForestRegressor(n_estimators=self.__n_estimators, max_depth=max_depth, oob_score=True,
+                                            warm_start=True, n_jobs=-1, random_state=self.__random_state)
+        self.forest.fit(X_scal, y)
+        self.__reference_stats(X, self.forest.oob_prediction_, y)
+        # El out-of-bag solo se usa como referencia del error del entrenamiento completo
+        self.forest.set_params(oob_score=False)
+
+        if self.y_scaler is None:
+            self.y_scaler = MinMaxScaler().fit(y.reshape(-1, 1))
+        if self.__network is not None:
+            # Sin keras, la red de 'from_artifacts' no se puede reentrenar: solo se reescala
+            self.__rescale_network(*anterior)
+        elif self.__neural:
+            self.dl_model = self.__build_network(X.shape[1])
+            self.dl_model.fit(X_scal, self.y_scaler.transform(y.reshape(-1, 1)), batch_size=64, epochs=self.__epochs,
+                              verbose=0)
+
+        return self
+
+    def drift(self, X, y = None):
+        '''
+        Compara los anuncios nuevos con los del entrenamiento.
+
+        Parametros:
+        * X: features de los anuncios nuevos
+        * y: precios de los anuncios nuevos (opcional, para comparar el error)
+        Resultado:
+        * Diccionario con el PSI de cada feature, el cociente de errores (None si no hay y) y 'drift' (True/False)
+        '''
+        X = self.__matrix(X)
+        psi = {}
+        for n, feature in enumerate(self.features):
+            corte = self.__reference["cuts"][n]
+            referencia = self.__reference["proportions"][n]
+            nuevas = np.bincount(np.searchsorted(corte, X[:, n], side='right'), minlength=corte.size + 1) / X.shape[0]
+            referencia, nuevas = np.clip(referencia, 1e-4, None), np.clip(nuevas, 1e-4, None)
+            psi[feature] = float(np.sum((nuevas - referencia) * np.log(nuevas / referencia)))
+
+        cociente = None
+        if y is not None:
+            y_pred = self.forest.predict(self.scaler.transform(X))
+            cociente = self.__error(y_pred, np.asarray(y, dtype=np.float64)) / self.__reference["error"]
+
+        hay_drift = max(psi.values()) > self.__psi_threshold or (cociente is not None and cociente > self.__error_threshold)
+        return {"psi": psi, "max_psi": max(psi.values()), "error_ratio": cociente, "drift": hay_drift}
+
+    def __rescale_trees(self, a0, b0):
+        '''
+        Método "privado".
+        Reescribe los umbrales de los árboles entrenados con la escala x * a0 + b0 para la escala actual del scaler.
+        '''
+        a1, b1 = self.scaler.scale_, self.scaler.min_
+        # Con 'from_artifacts' el árbol de main.ipynb aparece varias veces en el bosque y se reescribe una sola vez
+        for estimator in {id(estimator): estimator for estimator in self.forest.estimators_}.values():
+            tree = estimator.tree_
+            nodos = tree.feature >= 0
+            feature = tree.feature[nodos]
+            tree.threshold[nodos] = (tree.threshold[nodos] - b0[feature]) * (a1[feature] / a0[feature]) + b1[feature]
+
+    def __rescale_network(self, a0, b0):
+        '''
+        Método "privado".
+        Reescribe los pesos de la red entrenada con la escala x * a0 + b0 para la escala actual del scaler (la escala
+        del target no cambia).
+        '''
+        m, r = float(self.y_scaler.data_min_[0]), float(self.y_scaler.data_range_[0])
+        if self.dl_model is not None:
+            self.dl_model.set_weights(self.rescale_network_weights(self.dl_model.get_weights(), a0, b0, self.scaler.scale_,
+                                                                   self.scaler.min_, m, r, m, r))
+        elif self.__network is not None:
+            weights = [peso for layer in self.__network for peso in (layer["kernel"], layer["bias"])]
+            weights = self.rescale_network_weights(weights, a0, b0, self.scaler.scale_, self.scaler.min_, m, r, m, r)
+            for n, layer in enumerate(self.__network):
+                layer["kernel"], layer["bias"] = weights[2 * n], weights[2 * n + 1]
+
+    def rescale_network_weights(self, weights, a0, b0, a1, b1, m0, r0, m1, r1):
+        '''
+        Reescribe los pesos de la red (lista de get_weights) entrenada con las features escaladas con x * a0 + b0 y el
+        target con (y - m0) / r0 para las escalas x * a1 + b1 e (y - m1) / r1, sin cambiar sus predicciones.
+
+        Resultado:
+        * Lista de pesos para set_weights
+        '''
+        weights = [np.array(w, dtype=np.float64) for w in weights]
+        ratio = a0 / a1
+        # Primera capa: x0 = (x1 - b1) * a0 / a1 + b0
+        weights[1] = weights[1] + (b0 - b1 * ratio) @ weights[0]
+        weights[0] = weights[0] * ratio[:, None]
+        # Última capa: y1 = (y0 * r0 + m0 - m1) / r1
+        weights[-1] = (weights[-1] * r0 + m0 - m1) / r1
+        weights[-2] = weights[-2] * r0 / r1
+
+        return weights
+
+    def refresh(self, X, y, history = None):
+        '''
+        Actualiza los modelos con los anuncios nuevos. Si hay drift y se pasa el histórico, hace un entrenamiento
+        completo con el histórico y los anuncios nuevos.
+
+        Parametros:
+        * X, y: features y precios de los anuncios nuevos
+        * history: tupla (X, y) con los datos del último entrenamiento (opcional)
+        Resultado:
+        * Diccionario con el resultado del drift, el modo ('incremental', 'full' o 'incremental_despite_drift' si hay
+          drift pero no se ha pasado el histórico, en cuyo caso además se emite un warning) y los segundos empleados
+        '''
+        inicio = time.perf_counter()
+        resultado = self.drift(X, y)
+        if resultado["drift"] and history is not None:
+            X_hist, y_hist = history
+            self.fit(np.vstack([self.__matrix(X_hist), self.__matrix(X)]),
+                     np.concatenate([np.asarray(y_hist, dtype=np.float64), np.asarray(y, dtype=np.float64)]))
+            resultado.update({"mode": "full", "seconds": time.perf_counter() - inicio})
+            return resultado
+
+        X = self.__matrix(X)
+        y = np.asarray(y, dtype=np.float64)
+        a0, b0 = self.scaler.scale_.copy(), self.scaler.min_.copy()
+        self.scaler.partial_fit(X)
+        self.__rescale_trees(a0, b0)
+        self.__rescale_network(a0, b0)
+
+        X_scal = self.scaler.transform(X)
+        self.forest.set_params(n_estimators=len(self.forest.estimators_) + self.__new_trees)
+        self.forest.fit(X_scal, y)
+
+        if self.dl_model is not None:
+            self.dl_model.fit(X_scal, self.y_scaler.transform(y.reshape(-1, 1)), batch_size=64,
+                              epochs=self.__refresh_epochs, verbose=0)
+
+        modo = "incremental"
+        if resultado["drift"]:
+            modo = "incremental_despite_drift"
+            warnings.warn("Se ha detectado drift (máximo PSI " + str(resultado["max_psi"]) + ") pero no se ha pasado "
+                          "el histórico: se hace una actualización incremental y hace falta un entrenamiento completo")
+        resultado.update({"mode": modo, "seconds": time.perf_counter() - inicio})
+        if self.__debug:
+            print("Actualización", resultado["mode"], "en", resultado["seconds"], "s. Máximo PSI:", resultado["max_psi"])
+
+        return resultado
+
+    def predict(self, X):
+        '''
+        Predice el precio con el bosque y, si está entrenada, con la red neuronal.
+
+        Resultado:
+        * Tupla (predicción del bosque, predicción de la red neuronal o None)
+        '''
+        X_scal = self.scaler.transform(self.__matrix(X))
+        dl_prediction = None
+        if self.dl_model is not None:
+            dl_prediction = self.y_scaler.inverse_transform(self.dl_model.predict(X_scal, verbose=0)).ravel()
+        elif self.__network is not None:
+            network = IdealistaNumpyNetwork([dict(layer) for layer in self.__network], self.y_scaler.data_min_[0],
+                                            self.y_scaler.data_range_[0])
+            dl_prediction = network.predict(X_scal)
+
+        return self.forest.predict(X_scal), dl_prediction
+
+    def __replace(self, file, escribir):
+        '''
+        Método "privado".
+        Graba un fichero en uno temporal y lo renombra, para que IdealistaPredictor nunca lea un fichero a medias.
+        '''
+        # El temporal mantiene la extensión (keras elige el formato por la extensión del fichero)
+        tmp_file = os.path.join(os.path.dirname(file), '.tmp_' + os.path.basename(file))
+        escribir(tmp_file)
+        os.replace(tmp_file, file)
+
+    def save(self, models_path = 'models', name = 'incremental'):
+        '''
+        Graba los modelos donde los carga IdealistaPredictor: el MinMaxScaler en 'minmaxscaler.scaler', el bosque como
+        'best_estimator_' de 'best_GridSearchCV.gs' y la red neuronal en 'idealista_model.h5' (con keras, el modelo
+        reentrenado; sin keras, el .h5 de 'from_artifacts' con los pesos reescalados). El estado necesario para la
+        siguiente actualización (referencia del drift) se graba en '<name>.trainer'.
+        La red exportada a NumPy con idealistaexport integra el MinMaxScaler, así que hay que volver a exportarla.
+        '''
+        def pickle_file(objeto):
+            def escribir(fichero):
+                with open(fichero, 'wb') as archivo_salida:
+                    pickle.dump(objeto, archivo_salida)
+            return escribir
+
+        search = self.search if self.search is not None else GridSearchCV(self.forest, {})
+        search.best_estimator_ = self.forest
+        self.__replace(os.path.join(models_path, 'minmaxscaler.scaler'), pickle_file(self.scaler))
+        self.__replace(os.path.join(models_path, 'best_GridSearchCV.gs'), pickle_file(search))
+
+        fichero_h5 = os.path.join(models_path, 'idealista_model.h5')
+        if self.dl_model is not None:
+            self.__replace(fichero_h5, lambda fichero: self.dl_model.save(fichero))
+        elif self.__network is not None:
+            def escribir_h5(fichero):
+                shutil.copyfile(self.__h5_file, fichero)
+                IdealistaNumpyNetwork.write_h5(fichero, self.__network)
+            self.__replace(fichero_h5, escribir_h5)
+            self.__h5_file = fichero_h5
+        self.__replace(os.path.join(models_path, name + '.trainer'), pickle_file(self))
+
+    @staticmethod
+    def load(models_path = 'models', name = 'incremental'):
+        '''
+        Carga un estado grabado con save.
+        '''
+        with open(os.path.join(models_path, name + '.trainer'), 'rb') as archivo_entrada:
+            trainer = pickle.load(archivo_entrada)
+        fichero_h5 = os.path.join(models_path, 'idealista_model.h5')
+        if trainer.__network is not None:
+            trainer.__h5_file = fichero_h5
+        elif trainer.__neural and os.path.exists(fichero_h5):
+            import keras.models
+            trainer.dl_model = keras.models.load_model(fichero_h5)
+
+        return trainer
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from .idealistatools import IdealistaFeatureEngineering
+
+class IdealistaSchema:
+    '''
+    Tipos de datos compactos de los CSV de cada etapa del proyecto:
+    - 'raw': idealista_madrid.csv (anuncios de Madrid con barrio y distrito)
+    - 'clean': idealista_madrid_clean.csv (tras imputar los nulos)
+    - 'clean2': idealista_madrid_clean2.csv (variables seleccionadas)
+    - 'model1': idealista_madrid_model1.csv (variables codificadas para los modelos)
+
+    Las columnas de texto con pocos valores distintos se leen como category, los indicadores como bool/int8,
+    las coordenadas y tamaños como float32 y los enteros con el tamaño mínimo de su rango.
+    Los precios se mantienen enteros (int32) porque son el target. 'codbar' y 'coddistrit' se leen como float32
+    para que su conversión a texto ('11.0') no cambie la codificación FeatureHasher del notebook.
+    '''
+
+    comunes = {
+        "floor": "float32",
+        "price": "int32",
+        "propertyType": "category",
+        "size": "float32",
+        "exterior": "bool",
+        "rooms": "int8",
+        "bathrooms": "int8",
+        "latitude": "float32",
+        "longitude": "float32",
+        "distance": "int32",
+        "status": "category",
+        "newDevelopment": "bool",
+        "hasLift": "float32",
+        "priceByArea": "int32",
+        "topNewDevelopment": "bool",
+        "newDevelopmentFinished": "float32",
+        "hasParkingSpace": "bool",
+        "isParkingSpaceIncludedInPrice": "bool",
+        "codbar": "float32",
+        "coddistrit": "float32"
+    }
+
+    anuncio = {
+        "propertyCode": "int64",
+        "numPhotos": "int16",
+        "operation": "category",
+        "province": "category",
+        "municipality": "category",
+        "district": "category",
+        "country": "category",
+        "neighborhood": "category",
+        "showAddress": "bool",
+        "hasVideo": "bool",
+        "hasPlan": "bool",
+        "has3DTour": "bool",
+        "has360": "bool",
+        "hasStaging": "bool",
+        "subTypology": "category",
+        "codbarrio": "category",
+        "barrio": "category",
+        "distrito": "category"
+    }
+
+    modelo = {
+        "floor": "float32",
+        "price": "int32",
+        "size": "float32",
+        "exterior": "int8",
+        "rooms": "int8",
+        "bathrooms": "int8",
+        "latitude": "float32",
+        "longitude": "float32",
+        "distance": "int32",
+        "newDevelopment": "int8",
+        "hasLift": "int8",
+        "priceByArea": "int32",
+        "topNewDevelopment": "int8",
+        "newDevelopmentFinished": "int8",
+        "hasParkingSpace": "int8",
+        "isParkingSpaceIncludedInPrice": "int8",
+        "propertyType_chalet": "int8",
+        "propertyType_duplex": "int8",
+        "propertyType_flat": "int8",
+        "propertyType_penthouse": "int8",
+        "propertyType_studio": "int8",
+        "status_good": "int8",
+        "status_newdevelopment": "int8",
+        "status_renew": "int8",
+        "codbar_1": "int8",
+        "codbar_2": "int8",
+        "codbar_3": "int8",
+        "codbar_4": "int8",
+        "codbar_5": "int8",
+        "coddistrit_1": "int8",
+        "coddistrit_2": "int8",
+        "coddistrit_3": "int8"
+    }
+
+    schemas = {
+        # En los datos sin limpiar 'floor' es texto ('bj', 'ss', ...) y los nulos de las variables del parking
+        # se rellenan después con False
+        "raw": dict(comunes, **anuncio, floor="category", hasParkingSpace="boolean",
+                    isParkingSpaceIncludedInPrice="boolean"),
+        "clean": dict(comunes, **anuncio),
+        "clean2": dict(comunes),
+        "model1": modelo
+    }
+
+    files = {
+        "raw": "idealista_madrid.csv",
+        "clean": "idealista_madrid_clean.csv",
+        "clean2": "idealista_madrid_clean2.csv",
+        "model1": "idealista_madrid_model1.csv"
+    }
+
+    def __init__(self, data_path = 'data', debug = False):
+        '''
+        Constructor
+        Parametros:
+            data_path: directorio de los CSV
+            debug: si vale True muestra mensajes de debug
+        '''
+        self.__data_path = data_path
+        self.__debug = debug
+
+    def dtypes(self, stage):
+        '''
+        Devuelve el diccionario {columna: tipo} de una etapa.
+        '''
+        if stage not in self.schemas:
+            raise ValueError("Etapa desconocida: " + str(stage) + ". Etapas: " + ", ".join(self.schemas))
+
+        return dict(self.schemas[stage])
+
+    def read_csv(self, stage, file = None, **kwargs):
+        '''
+        Lee el CSV de una etapa con sus tipos de datos compactos.
+        Las columnas que no están en el esquema se leen con los tipos por defecto y después se reducen con
+        IdealistaFeatureEngineering.downcast_dtypes.
+
+        Parametros:
+        * stage: etapa ('raw', 'clean', 'clean2' o 'model1')
+        * file: fichero a leer. Por defecto el CSV de la etapa en data_path
+        * kwargs: otros argumentos de pd.read_csv
+        Resultado:
+        * El DataFrame
+        '''
+        dtypes = self.dtypes(stage)
+        if file is None:
+            file = os.path.join(self.__data_path, self.files[stage])
+        columnas = pd.read_csv(file, nrows=0).columns
+        data_frame = pd.read_csv(file, dtype={columna: dtypes[columna] for columna in columnas if columna in dtypes},
+                                 **kwargs)
+        IdealistaFeatureEngineering().downcast_dtypes(data_frame)
+
+        return data_frame
+
+    def memory_report(self, stages = None):
+        '''
+        Compara la memoria de los CSV de cada etapa leídos con pd.read_csv por defecto y con read_csv.
+
+        Parametros:
+        * stages: etapas a comparar (None: todas)
+        Resultado:
+        * DataFrame con, por cada etapa, el número de filas, los bytes por fila antes y después, la reducción
+          y la mayor diferencia absoluta entre los valores numéricos leídos de las dos formas
+        '''
+        filas = []
+        for stage in (self.files if stages is None else stages):
+            file = os.path.join(self.__data_path, self.files[stage])
+            antes_df = pd.read_csv(file)
+            despues_df = self.read_csv(stage, file)
+            numericas = antes_df.select_dtypes(include=[np.number, bool]).columns
+            diferencia = np.nanmax(np.abs(antes_df[numericas].to_numpy(np.float64) -
+                                          despues_df[numericas].to_numpy(np.float64)))
+            antes = antes_df.memory_usage(deep=True).sum() / antes_df.shape[0]
+            despues = despues_df.memory_usage(deep=True).sum() / despues_df.shape[0]
+            filas.append({"stage": stage, "file": self.files[stage], "rows": antes_df.shape[0],
+                          "bytes_per_row_before": antes, "bytes_per_row_after": despues,
+                          "reduction": antes / despues, "max_abs_diff": diferencia})
+
+        resultado = pd.DataFrame(filas)
+        if self.__debug:
+            print(resultado)
+
+        return resultado
+
+if __name__ == "__main__":
+    print(IdealistaSchema().memory_report().to_string())
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from .idealistatools import IdealistaWebScraping
+from .idealistacrawler import IdealistaRateLimiter
+
+class IdealistaScrapingPipeline:
+    '''
+    Clase que descarga y analiza en lote anuncios del portal Idealista.
+    Las páginas se descargan en paralelo reutilizando las conexiones HTTP y respetando un límite de peticiones
+    por segundo. El html se guarda en una caché en disco junto con su ETag/Last-Modified: en las siguientes ejecuciones
+    se hace una petición condicional y, si la página no ha cambiado (304), se reutiliza el resultado ya analizado.
+    El análisis del html (IdealistaWebScraping.extract_advertisement_info con lxml y SoupStrainer) se reparte
+    entre varios procesos.
+    '''
+
+    def __init__(self, cache_dir = 'html_cache', max_workers = 4, requests_per_second = 1.0, parse_processes = None,
+                 parser = 'lxml', timeout = 30, debug = False):
+        '''
+        Constructor
+        Parametros:
+            cache_dir: directorio de la caché de html
+            max_workers: número máximo de descargas simultáneas
+            requests_per_second: límite de peticiones por segundo
+            parse_processes: número de procesos para analizar el html (None: tantos como CPUs; 0: en el proceso actual)
+            parser: parser de BeautifulSoup ('lxml' o 'html.parser')
+            timeout: segundos máximos de espera de cada descarga
+            debug: si vale True muestra mensajes de debug
+        '''
+        self.__cache_dir = cache_dir
+        self.__max_workers = max_workers
+        self.__parse_processes = parse_processes
+        self.__parser = parser
+        self.__timeout = timeout
+        self.__debug = debug
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.__ws = IdealistaWebScraping()
+        self.__session = requests.Session()
+        self.__session.headers.update(IdealistaWebScraping.headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.__session.mount('http://', adapter)
+        self.__session.mount('https://', adapter)
+        self.__rate_limiter = IdealistaRateLimiter(requests_per_second)
+        self.stats = {}
+
+    def __cache_files(self, url):
+        clave = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.__cache_dir, clave + '.html'), os.path.join(self.__cache_dir, clave + '.json')
+
+    def __load_meta(self, url):
+        html_file, meta_file = self.__cache_files(url)
+        if os.path.exists(html_file) and os.path.exists(meta_file):
+            with open(meta_file) as infile:
+                return json.load(infile)
+        return None
+
+    def __save(self, url, html, meta):
+        html_file, meta_file = self.__cache_files(url)
+        if html is not None:
+            with open(html_file, 'wb') as outfile:
+                outfile.write(html)
+        with open(meta_file + '.tmp', 'w') as outfile:
+            json.dump(meta, outfile)
+        os.replace(meta_file + '.tmp', meta_file)
+
+    def __fetch(self, url):
+        '''
+        Método "privado".
+        Descarga una página con una petición condicional si está en la caché.
+
+        Resultado:
+        * Tupla (estado, html) con estado 'fetched', 'not_modified' o el mensaje de error
+        '''
+        meta = self.__load_meta(url)
+        headers = {}
+        if meta is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        self.__rate_limiter.acquire()
+        try:
+            r = self.__session.get(url, headers=headers, timeout=self.__timeout)
+        except requests.exceptions.RequestException as ex:
+            return str(ex), None
+        if r.status_code == 304 and meta is not None:
+            return 'not_modified', None
+        if r.status_code != 200:
+            return "HTTP " + str(r.status_code), None
+
+        meta = {"url": url, "etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified"), "info": None}
+        self.__save(url, r.content, meta)
+        return 'fetched', r.content
+
+    def run(self, urls, size_index = 0):
+        '''
+        Descarga y analiza una lista de anuncios.
+
+        Parametros:
+        * urls: lista de urls de anuncios de Idealista
+        * size_index: índice del tamaño de la vivienda en la lista de características (ver extract_advertisement_info).
+          Puede ser un entero o un diccionario {url: índice}
+        Resultado:
+        * DataFrame con una fila por url, las variables de extract_advertisement_info y las columnas 'status' y 'error'
+        '''
+        indices = size_index if isinstance(size_index, dict) else {url: size_index for url in urls}
+        inicio = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.__max_workers) as executor:
+            descargas = dict(zip(urls, executor.map(self.__fetch, urls)))
+
+        filas, pendientes = {}, []
+        for url, (estado, html) in descargas.items():
+            if estado == 'not_modified':
+                meta = self.__load_meta(url)
+                if meta.get("info") is not None and meta.get("size_index") == indices[url]:
+                    filas[url] = dict(meta["info"], url=url, status=estado, error=None)
+                    continue
+                with open(self.__cache_files(url)[0], 'rb') as infile:
+                    html = infile.read()
+            elif estado != 'fetched':
+                filas[url] = {"url": url, "status": "error", "error": estado}
+                continue
+            pendientes.append((url, html, estado, indices[url], self.__parser))
+
+        if self.__parse_processes == 0 or len(pendientes) < 2:
+            resultados = [_parse_advertisement(self.__ws, tarea) for tarea in pendientes]
+        else:
+            chunksize = max(1, len(pendientes) // (4 * (self.__parse_processes or os.cpu_count() or 1)))
+            with ProcessPoolExecutor(max_workers=self.__parse_processes) as executor:
+                resultados = list(executor.map(_parse_advertisement, [self.__ws] * len(pendientes), pendientes,
+                                               chunksize=chunksize))
+
+        for url, info, estado, error in resultados:
+            if error is not None:
+                filas[url] = {"url": url, "status": "error", "error": error}
+                continue
+            filas[url] = dict(info, url=url, status=estado, error=None)
+            meta = self.__load_meta(url)
+            meta.update({"info": info, "size_index": indices[url]})
+            self.__save(url, None, meta)
+
+        segundos = time.perf_counter() - inicio
+        resultado_df = pd.DataFrame([filas[url] for url in urls])
+        self.stats = {"pages": len(urls), "seconds": segundos, "pages_per_second": len(urls) / segundos}
+        self.stats.update(resultado_df["status"].value_counts().to_dict())
+        if self.__debug:
+            print(self.stats)
+
+        return resultado_df
+
+def _parse_advertisement(ws, tarea):
+    '''
+    Analiza un anuncio en un proceso del pool (función de módulo para que se pueda serializar).
+    '''
+    url, html, estado, size_index, parser = tarea
+    try:
+        return url, ws.extract_advertisement_info(html, size_index, parser=parser), estado, None
+    except Exception as ex:
+        return url, None, estado, repr(ex)
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import pickle
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.linear_model import LinearRegression
+from sklearn.metrics import get_scorer
+from sklearn.model_selection import GridSearchCV, KFold, ParameterGrid
+from sklearn.svm import SVR, LinearSVR
+from sklearn.tree import DecisionTreeRegressor
+
+# Datos de entrenamiento y folds de cada proceso del pool (se envían/calculan una sola vez al arrancar el proceso)
+_X, _y, _folds = None, None, None
+
+def _init_worker(X, y, n_splits):
+    global _X, _y, _folds
+    _X, _y = X, y
+    _folds = list(KFold(n_splits=n_splits).split(X))
+
+def _score_fold(estimator, params, fold, scoring):
+    '''
+    Entrena un candidato en un fold de KFold(n_splits) (los mismos folds que GridSearchCV con cv=n_splits)
+    y devuelve (score, segundos, error). Si el entrenamiento falla el score es nan, como en GridSearchCV, y error
+    es el mensaje de la excepción (None si no falla).
+    '''
+    train, test = _folds[fold]
+    inicio = time.perf_counter()
+    error = None
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        try:
+            modelo = clone(estimator).set_params(**params).fit(_X[train], _y[train])
+            score = float(get_scorer(scoring)(modelo, _X[test], _y[test]))
+        except Exception as ex:
+            score = float('nan')
+            error = type(ex).__name__ + ": " + str(ex)
+
+    return score, time.perf_counter() - inicio, error
+
+class IdealistaModelSearch:
+    '''
+    Clase que hace la búsqueda de modelos de main.ipynb (varios GridSearchCV) de forma más rápida:
+    - Los candidatos (modelo, parámetros) y sus folds se entrenan en paralelo en un pool de procesos.
+    - Successive halving: en cada ronda se evalúan más folds y solo pasan a la siguiente los mejores candidatos,
+      hasta evaluar todos los folds de los finalistas (con los mismos folds que GridSearchCV, así que el score
+      final de un finalista es el mismo que el 'mean_test_score' de GridSearchCV).
+    - El score de cada fold se guarda en una caché en disco con la clave hash(versión del dataset, features, modelo,
+      parámetros, fold), de modo que los candidatos que no cambian no se vuelven a entrenar. Los folds que fallan
+      (score nan) no se guardan en la caché y el error queda en la columna 'errors' de results_.
+    '''
+
+    '''
+    Modelos y parámetros de la búsqueda de main.ipynb
+    '''
+    grids = {
+        "gs_lin_reg": (LinearRegression(), {}),
+        "gs_dt_reg": (DecisionTreeRegressor(), {"max_depth": np.arange(2, 10)}),
+        "gs_lin_svr": (LinearSVR(), {"epsilon": np.arange(1.5, 5, 0.5), "max_iter": [1000, 1500, 200]}),
+        "gs_svr": (SVR(), {"kernel": ['linear', 'poly', 'rbf', 'sigmoid'], "degree": [2, 3],
+                           "C": [0.01, 0.1, 1.0, 10, 100], "epsilon": np.arange(0.1, 0.5, 0.1), "gamma": ['scale', 'auto']})
+    }
+
+    def __init__(self, grids = None, cv = 10, scoring = 'r2', min_folds = 2, factor = 3, max_workers = None,
+                 cache_file = 'models/search_cache.json', debug = False):
+        '''
+        Constructor
+        Parametros:
+            grids: diccionario {nombre: (estimador, parámetros)}. Por defecto los de main.ipynb
+            cv: número de folds
+            scoring: métrica de scikit-learn
+            min_folds: folds evaluados en la primera ronda
+            factor: en cada ronda se evalúan 'factor' veces más folds y pasa 1 de cada 'factor' candidatos
+            max_workers: procesos del pool (None: tantos como CPUs)
+            cache_file: fichero JSON con la caché de scores por fold (None: sin caché en disco)
+            debug: si vale True muestra mensajes de debug
+        '''
+        self.__grids = self.grids if grids is None else grids
+        self.__cv = cv
+        self.__scoring = scoring
+        self.__min_folds = min_folds
+        self.__factor = factor
+        self.__max_workers = max_workers
+        self.__cache_file = cache_file
+        self.__debug = debug
+        self.__cache = {}
+        if cache_file is not None and os.path.exists(cache_file):
+            with open(cache_file) as infile:
+                # Los scores nan de versiones anteriores eran fallos: se descartan para volver a entrenarlos
+                self.__cache = {clave: score for clave, score in json.load(infile).items() if not np.isnan(score)}
+        self.stats = {}
+
+    def __save_cache(self):
+        if self.__cache_file is None:
+            return
+        directorio = os.path.dirname(self.__cache_file)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        with open(self.__cache_file + '.tmp', 'w') as outfile:
+            json.dump(self.__cache, outfile)
+        os.replace(self.__cache_file + '.tmp', self.__cache_file)
+
+    def dataset_version(self, X, y):
+        '''
+        Hash del contenido de X e y (se puede sustituir por el hash de un dataset de IdealistaFeatureStore).
+        '''
+        sha = hashlib.sha256()
+        for array in (X, y):
+            array = np.ascontiguousarray(array, dtype=np.float64)
+            sha.update(str(array.shape).encode('utf-8'))
+            sha.update(array.data)
+
+        return sha.hexdigest()
+
+    def __key(self, version, features, estimator, params, fold):
+        '''
+        Método "privado".
+        Clave de la caché de un fold de un candidato.
+        '''
+        parametros = {k: (v.item() if isinstance(v, np.generic) else v) for k, v in sorted(params.items())}
+        texto = json.dumps([version, list(features), type(estimator).__name__, repr(estimator.get_params(deep=False)),
+                            parametros, self.__cv, fold, self.__scoring], default=str)
+
+        return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+    def fit(self, X, y, features = None, dataset_version = None):
+        '''
+        Busca el mejor modelo.
+
+        Parametros:
+        * X: DataFrame (o matriz) de entrenamiento, ya escalado
+        * y: target
+        * features: nombres de las columnas (por defecto las de X si es un DataFrame)
+        * dataset_version: versión del dataset para la caché (por defecto el hash de X e y)
+        Resultado:
+        * DataFrame con un candidato por fila: grid, parámetros, folds evaluados, score medio, folds de la caché y segundos
+        '''
+        if features is None:
+            features = list(X.columns) if hasattr(X, 'columns') else list(range(np.shape(X)[1]))
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        y = np.ascontiguousarray(y, dtype=np.float64)
+        version = dataset_version if dataset_version is not None else self.dataset_version(X, y)
+
+        candidatos = []
+        for nombre, (estimator, param_grid) in self.__grids.items():
+            for params in ParameterGrid(param_grid):
+                candidatos.append({"grid": nombre, "estimator": estimator, "params": params, "scores": {}, "seconds": 0.0,
+                                   "errors": [], "cached": 0})
+
+        inicio = time.perf_counter()
+        entrenamientos = 0
+        vivos = list(range(len(candidatos)))
+        folds = min(self.__min_folds, self.__cv)
+        with ProcessPoolExecutor(max_workers=self.__max_workers, initializer=_init_worker,
+                                 initargs=(X, y, self.__cv)) as executor:
+            while True:
+                tareas = []
+                for n in vivos:
+                    candidato = candidatos[n]
+                    for fold in range(folds):
+                        if fold in candidato["scores"]:
+                            continue
+                        clave = self.__key(version, features, candidato["estimator"], candidato["params"], fold)
+                        if clave in self.__cache:
+                            candidato["scores"][fold] = self.__cache[clave]
+                            candidato["cached"] += 1
+                        else:
+                            tareas.append((n, fold, clave, executor.submit(_score_fold, candidato["estimator"],
+                                                                           candidato["params"], fold, self.__scoring)))
+                for n, fold, clave, future in tareas:
+                    score, segundos, error = future.result()
+                    candidatos[n]["scores"][fold] = score
+                    candidatos[n]["seconds"] += segundos
+                    if error is None:
+                        self.__cache[clave] = score
+                    else:
+                        # Un fallo puede ser transitorio (memoria, proceso interrumpido): no se guarda en la caché
+                        # para que la próxima búsqueda lo vuelva a intentar
+                        candidatos[n]["errors"].append(error)
+                        if self.__debug:
+                            print("Fallo en", candidatos[n]["grid"], candidatos[n]["params"], "fold", fold, ":", error)
+                entrenamientos += len(tareas)
+                self.__save_cache()
+
+                if self.__debug:
+                    print("Ronda con", folds, "folds:", len(vivos), "candidatos,", len(tareas), "entrenamientos")
+                if folds >= self.__cv:
+                    break
+                medias = {n: np.nan_to_num(np.mean(list(candidatos[n]["scores"].values())), nan=-np.inf) for n in vivos}
+                n_siguientes = max(1, int(np.ceil(len(vivos) / self.__factor)))
+                vivos = sorted(vivos, key=lambda n: -medias[n])[:n_siguientes]
+                vivos.sort()
+                folds = min(self.__cv, folds * self.__factor)
+
+        filas = []
+        for n, candidato in enumerate(candidatos):
+            scores = list(candidato["scores"].values())
+            filas.append({"grid": candidato["grid"], "params": candidato["params"], "folds": len(scores),
+                          "mean_score": np.mean(scores), "cached_folds": candidato["cached"],
+                          "seconds": candidato["seconds"], "errors": candidato["errors"],
+                          "finalist": n in vivos})
+        self.results_ = pd.DataFrame(filas)
+
+        finalistas = self.results_[self.results_["finalist"]]
+        mejor = finalistas["mean_score"].fillna(-np.inf).idxmax()
+        self.best_grid_ = self.results_.at[mejor, "grid"]
+        self.best_params_ = self.results_.at[mejor, "params"]
+        self.best_score_ = self.results_.at[mejor, "mean_score"]
+        self.stats = {"candidates": len(candidatos), "fits": entrenamientos,
+                      "cached_folds": int(self.results_["cached_folds"].sum()), "seconds": time.perf_counter() - inicio}
+        if self.__debug:
+            print("Mejor:", self.best_grid_, self.best_params_, self.best_score_, self.stats)
+
+        return self.results_
+
+    def best_gridsearch(self, X, y):
+        '''
+        Construye el mismo artefacto que main.ipynb ('best_GridSearchCV.gs'): un GridSearchCV del mejor modelo,
+        limitado a los mejores parámetros, ajustado sobre X e y (best_estimator_ reentrenado con todos los datos).
+        '''
+        estimator = self.__grids[self.best_grid_][0]
+        gs = GridSearchCV(estimator, {k: [v] for k, v in self.best_params_.items()}, cv=self.__cv, scoring=self.__scoring,
+                          n_jobs=self.__max_workers)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            gs.fit(np.asarray(X, dtype=np.float64), np.asarray(y, dtype=np.float64))
+
+        return gs
+
+    def save_best(self, X, y, file = 'models/best_GridSearchCV.gs'):
+        '''
+        Graba con pickle el GridSearchCV de best_gridsearch.
+        '''
+        gs = self.best_gridsearch(X, y)
+        with open(file, 'wb') as archivo_salida:
+            pickle.dump(gs, archivo_salida)
+
+        return gs
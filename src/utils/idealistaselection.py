@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import hashlib
+import json
+import os
+import time
+import warnings
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.feature_selection import f_regression, r_regression
+
+class IdealistaFeatureSelector:
+    '''
+    Clase que hace la selección de features de main.ipynb:
+    - Correlación lineal: features con correlación (en valor absoluto) con el target de al menos 'min_corr'. De cada
+      par de features con correlación mayor que 'pair_threshold' se descarta la menos correlacionada con el target
+      (en el notebook, 'status_newdevelopment' e 'isParkingSpaceIncludedInPrice'). k es el número de features que quedan.
+    - SelectKBest(f_regression, k) sobre todas las features salvo las descartadas por pares.
+    - Las k features más importantes de un RandomForestRegressor de 200 árboles entrenado con esas mismas features.
+    - Se seleccionan las features elegidas por al menos 'min_votes' métodos.
+    Los tres métodos se ejecutan a la vez en hilos (NumPy y los árboles de scikit-learn liberan el GIL): el bosque
+    arranca en cuanto se conocen las features descartadas por pares, que es lo primero que calcula la correlación.
+    El bosque usa todos los cores (n_jobs) y, opcionalmente, solo una muestra de los anuncios en cada árbol (max_samples).
+    Los estadísticos de cada columna (correlación y F con el target, correlación con cada otra columna) se guardan en
+    una caché en disco con la clave hash(contenido de la columna, target), de modo que al añadir o quitar una columna
+    solo se calculan los de esa columna. Las importancias del bosque dependen de todas las columnas: se guardan con la
+    clave hash(columnas, target, parámetros) y solo se reutilizan si no cambia ninguna columna.
+    '''
+
+    def __init__(self, min_corr = 0.1, pair_threshold = 0.9, n_estimators = 200, max_samples = None, min_votes = 2,
+                 n_jobs = -1, random_state = 42, cache_file = 'data/feature_selection_cache.json', debug = False):
+        '''
+        Constructor
+        Parametros:
+            min_corr: correlación mínima (en valor absoluto) de una feature con el target
+            pair_threshold: correlación a partir de la cual dos features se consideran redundantes
+            n_estimators: árboles del RandomForestRegressor
+            max_samples: proporción (o número) de anuncios con los que se entrena cada árbol (None: todos)
+            min_votes: número mínimo de métodos que tienen que elegir una feature
+            n_jobs: cores del RandomForestRegressor (-1: todos)
+            random_state: semilla del RandomForestRegressor
+            cache_file: fichero JSON con la caché de estadísticos (None: sin caché en disco)
+            debug: si vale True muestra mensajes de debug
+        '''
+        self.__min_corr = min_corr
+        self.__pair_threshold = pair_threshold
+        self.__n_estimators = n_estimators
+        self.__max_samples = max_samples
+        self.__min_votes = min_votes
+        self.__n_jobs = n_jobs
+        self.__random_state = random_state
+        self.__cache_file = cache_file
+        self.__debug = debug
+        self.__cache = {}
+        if cache_file is not None and os.path.exists(cache_file):
+            with open(cache_file) as infile:
+                self.__cache = json.load(infile)
+
+        self.features_selected_ = None
+        self.votes_ = None
+        self.scores_ = None
+        self.timing_ = {}
+
+    def __save_cache(self):
+        if self.__cache_file is None:
+            return
+        directorio = os.path.dirname(self.__cache_file)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        with open(self.__cache_file + '.tmp', 'w') as outfile:
+            json.dump(self.__cache, outfile)
+        os.replace(self.__cache_file + '.tmp', self.__cache_file)
+
+    def __hash(self, array):
+        sha = hashlib.sha256()
+        array = np.ascontiguousarray(array, dtype=np.float64)
+        sha.update(str(array.shape).encode('utf-8'))
+        sha.update(array.data)
+
+        return sha.hexdigest()[:32]
+
+    def __column_stats(self, X, y, hashes, y_hash, nombre, funcion):
+        '''
+        Método "privado".
+        Estadístico univariante de cada columna con el target ('r' o 'f'), calculando solo las columnas que no
+        están en la caché.
+        '''
+        claves = [nombre + ":" + hashes[n] + ":" + y_hash for n in range(X.shape[1])]
+        faltan = [n for n, clave in enumerate(claves) if clave not in self.__cache]
+        if faltan:
+            with warnings.catch_warnings():
+                # Las columnas constantes ('topNewDevelopment') dan nan (o inf), como nan en el notebook
+                warnings.simplefilter("ignore")
+                valores = funcion(X[:, faltan], y)
+            for n, valor in zip(faltan, np.atleast_1d(valores)):
+                self.__cache[claves[n]] = float(valor) if np.isfinite(valor) else np.nan
+
+        return np.array([self.__cache[clave] for clave in claves], dtype=np.float64), len(faltan)
+
+    def __pair_correlations(self, X, hashes):
+        '''
+        Método "privado".
+        Matriz de correlaciones entre columnas. Solo se calculan los pares en los que alguna columna es nueva.
+        '''
+        n_columnas = X.shape[1]
+        clave = lambda a, b: "pair:" + min(hashes[a], hashes[b]) + ":" + max(hashes[a], hashes[b])
+        faltan = {(a, b) for a in range(n_columnas) for b in range(a + 1, n_columnas) if clave(a, b) not in self.__cache}
+        if len(faltan) == n_columnas * (n_columnas - 1) // 2:
+            nuevas = list(range(n_columnas))
+        else:
+            # Columnas que cubren los pares que faltan (con una columna nueva, solo esa columna)
+            nuevas = []
+            while faltan:
+                a = Counter(c for par in faltan for c in par).most_common(1)[0][0]
+                nuevas.append(a)
+                faltan = {par for par in faltan if a not in par}
+        if nuevas:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                Z = (X - X.mean(axis=0)) / X.std(axis=0)
+                correlaciones = Z[:, nuevas].T @ Z / X.shape[0]
+            for fila, a in enumerate(nuevas):
+                for b in range(n_columnas):
+                    if a != b:
+                        self.__cache[clave(a, b)] = float(correlaciones[fila, b])
+
+        matriz = np.eye(n_columnas)
+        for a in range(n_columnas):
+            for b in range(a + 1, n_columnas):
+                matriz[a, b] = matriz[b, a] = self.__cache[clave(a, b)]
+
+        return matriz, len(nuevas)
+
+    def __forest_importances(self, X, y, hashes, y_hash):
+        '''
+        Método "privado".
+        Importancias del RandomForestRegressor (de la caché si no ha cambiado ninguna columna ni el target).
+        '''
+        clave = "forest:" + hashlib.sha256(json.dumps([hashes, y_hash, self.__n_estimators, self.__max_samples,
+                                                       self.__random_state]).encode('utf-8')).hexdigest()
+        if clave in self.__cache:
+            return np.array(self.__cache[clave], dtype=np.float64), True
+        forest = RandomForestRegressor(n_estimators=self.__n_estimators, max_samples=self.__max_samples,
+                                       n_jobs=self.__n_jobs, random_state=self.__random_state)
+        forest.fit(X, y)
+        self.__cache[clave] = forest.feature_importances_.tolist()
+
+        return forest.feature_importances_, False
+
+    def __timed(self, funcion, *args):
+        inicio = time.perf_counter()
+        resultado = funcion(*args)
+        return resultado, time.perf_counter() - inicio
+
+    def __top(self, columnas, scores, k):
+        # Mayor score primero y los nan al final, como sort_values(ascending=False) en el notebook
+        orden = sorted(range(len(columnas)), key=lambda n: (np.isnan(scores[n]), -np.nan_to_num(scores[n])))
+        return [columnas[n] for n in orden[:k]]
+
+    def select(self, X, y):
+        '''
+        Selecciona las features.
+
+        Parametros:
+        * X: DataFrame con las features candidatas (p. ej. 'X_train.df')
+        * y: target (precio)
+        Resultado:
+        * Lista de features seleccionadas (más votadas primero)
+        '''
+        inicio = time.perf_counter()
+        columnas = [str(columna) for columna in X.columns]
+        X = X.to_numpy(np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        hashes = [self.__hash(X[:, n]) for n in range(X.shape[1])]
+        y_hash = self.__hash(y)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            # El score F es univariante: se calcula para todas las columnas mientras se analiza la correlación
+            futuro_kbest = executor.submit(self.__timed, self.__column_stats, X, y, hashes, y_hash, "f",
+                                           lambda X, y: f_regression(X, y)[0])
+
+            inicio_correlacion = time.perf_counter()
+            r, r_nuevas = self.__column_stats(X, y, hashes, y_hash, "r", r_regression)
+            pares, pares_nuevos = self.__pair_correlations(X, hashes)
+            corr_target = np.abs(r)
+            descartadas = set()
+            for a in range(len(columnas)):
+                for b in range(a + 1, len(columnas)):
+                    if abs(pares[a, b]) > self.__pair_threshold:
+                        descartadas.add(b if np.nan_to_num(corr_target[a]) >= np.nan_to_num(corr_target[b]) else a)
+            restantes = [n for n in range(len(columnas)) if n not in descartadas]
+            futuro_forest = executor.submit(self.__timed, self.__forest_importances, X[:, restantes], y,
+                                            [hashes[n] for n in restantes], y_hash)
+            correlacion = [columnas[n] for n in restantes if corr_target[n] >= self.__min_corr]
+            k = len(correlacion)
+            segundos_correlacion = time.perf_counter() - inicio_correlacion
+
+            (f, f_nuevas), segundos_kbest = futuro_kbest.result()
+            (importancias, forest_cache), segundos_forest = futuro_forest.result()
+        self.__save_cache()
+
+        nombres = [columnas[n] for n in restantes]
+        kbest = self.__top(nombres, f[restantes], k)
+        forest = self.__top(nombres, np.round(importancias, 4), k)
+
+        self.scores_ = pd.DataFrame({"corr_target": corr_target}, index=pd.Index(columnas, name="feature"))
+        self.scores_["f_score"] = f
+        self.scores_["importance"] = pd.Series(importancias, index=nombres)
+        self.scores_["dropped_pair"] = [n in descartadas for n in range(len(columnas))]
+        self.votes_ = pd.DataFrame({"CorrelacionLineal": [c in correlacion for c in columnas],
+                                    "SelectKBest": [c in kbest for c in columnas],
+                                    "RandomForestRegressor": [c in forest for c in columnas]},
+                                   index=self.scores_.index)
+        self.votes_["votes"] = self.votes_.sum(axis=1)
+        # Más votadas primero y, con los mismos votos, por su score F
+        orden = self.votes_.assign(f_score=self.scores_["f_score"].fillna(-np.inf)) \
+                           .sort_values(["votes", "f_score"], ascending=False)
+        self.features_selected_ = list(orden.index[orden["votes"] >= self.__min_votes])
+
+        self.timing_ = {"correlation_seconds": segundos_correlacion, "kbest_seconds": segundos_kbest,
+                        "forest_seconds": segundos_forest, "total_seconds": time.perf_counter() - inicio,
+                        "new_columns": r_nuevas, "new_pair_columns": pares_nuevos, "new_f_columns": f_nuevas,
+                        "forest_cached": forest_cache, "k": k}
+        if self.__debug:
+            print("Features seleccionadas:", self.features_selected_)
+            print(self.timing_)
+
+        return self.features_selected_
+
+    def write(self, file = 'data/features_selected.npz', timing_file = None, keep_order = True):
+        '''
+        Graba las features seleccionadas en el formato de main.ipynb ('features_selected.npz') y los tiempos en JSON.
+
+        Parametros:
+        * file: fichero .npz
+        * timing_file: fichero JSON con los tiempos y los votos (por defecto, el de file con '_timing.json')
+        * keep_order: si vale True y el fichero ya tiene las mismas features, se mantiene su orden (el de las
+          columnas con las que se entrenaron el MinMaxScaler y los modelos)
+        Resultado:
+        * Array con las features grabadas
+        '''
+        features = self.features_selected_
+        if keep_order and os.path.exists(file):
+            anteriores = [str(feature) for feature in np.load(file, allow_pickle=True)['features_selected']]
+            if set(anteriores) == set(features):
+                features = anteriores
+        features_selected = np.array(features, dtype=object)
+        np.savez(file, features_selected=features_selected)
+
+        timing_file = timing_file if timing_file is not None else os.path.splitext(file)[0] + '_timing.json'
+        with open(timing_file, 'w') as outfile:
+            json.dump({"timing": self.timing_, "votes": self.votes_["votes"].to_dict(),
+                       "features_selected": features}, outfile, indent=1, default=lambda valor: valor.item())
+
+        return features_selected
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Selección de features de main.ipynb sobre 'X_train.df'")
+    parser.add_argument("--data-path", default="data")
+    parser.add_argument("--output", help="fichero .npz (por defecto, 'features_selected.npz' de --data-path)")
+    parser.add_argument("--n-estimators", type=int, default=200)
+    parser.add_argument("--max-samples", type=float, help="proporción de anuncios de cada árbol del bosque")
+    parser.add_argument("--cache-file", help="caché de estadísticos (por defecto, en --data-path)")
+    args = parser.parse_args()
+
+    selector = IdealistaFeatureSelector(n_estimators=args.n_estimators, max_samples=args.max_samples,
+                                        cache_file=args.cache_file or os.path.join(args.data_path,
+                                                                                   'feature_selection_cache.json'),
+                                        debug=True)
+    selector.select(pd.read_pickle(os.path.join(args.data_path, 'X_train.df')),
+                    pd.read_pickle(os.path.join(args.data_path, 'y_train.serie')))
+    print(selector.write(args.output or os.path.join(args.data_path, 'features_selected.npz')))
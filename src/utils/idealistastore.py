@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+class IdealistaFeatureStore:
+    '''
+    Almacén de features por columnas: cada columna de un DataFrame (o una Series) se guarda en un fichero .npy
+    y un manifiesto JSON registra, por cada dataset, sus columnas, tipos, número de filas, versión y hash.
+    Las columnas se abren como memoria mapeada (sin copiar y sin pickle), de modo que un entrenamiento o una
+    predicción solo leen del disco las columnas que usan (p. ej. las de 'features_selected').
+    Cada escritura de un dataset crea una nueva versión; la anterior se borra al confirmar la nueva en el manifiesto.
+    '''
+
+    manifest_name = "manifest.json"
+
+    def __init__(self, store_dir = 'data/feature_store', debug = False):
+        '''
+        Constructor
+        Parametros:
+            store_dir: directorio del almacén
+            debug: si vale True muestra mensajes de debug
+        '''
+        self.__store_dir = store_dir
+        self.__debug = debug
+        os.makedirs(store_dir, exist_ok=True)
+        self.__manifest = self.__load_manifest()
+
+    def __load_manifest(self):
+        manifest_file = os.path.join(self.__store_dir, self.manifest_name)
+        if os.path.exists(manifest_file):
+            with open(manifest_file) as infile:
+                return json.load(infile)
+        return {"datasets": {}, "lists": {}}
+
+    def __save_manifest(self):
+        manifest_file = os.path.join(self.__store_dir, self.manifest_name)
+        with open(manifest_file + '.tmp', 'w') as outfile:
+            json.dump(self.__manifest, outfile, indent=1)
+        os.replace(manifest_file + '.tmp', manifest_file)
+
+    def __hash(self, nombres, arrays):
+        '''
+        Método "privado".
+        Hash SHA-256 del contenido de un dataset (nombres, tipos y bytes de cada columna).
+        '''
+        sha = hashlib.sha256()
+        for nombre, array in zip(nombres, arrays):
+            sha.update(json.dumps([nombre, array.dtype.str, array.shape[0]]).encode('utf-8'))
+            sha.update(np.ascontiguousarray(array).data)
+
+        return sha.hexdigest()
+
+    def datasets(self):
+        '''
+        Devuelve el diccionario del manifiesto con los datasets del almacén.
+        '''
+        return self.__manifest["datasets"]
+
+    def write(self, name, data):
+        '''
+        Graba un DataFrame o una Series en el almacén (una nueva versión si ya existía).
+        Solo admite columnas numéricas o booleanas, que se pueden leer sin pickle.
+
+        Parametros:
+        * name: nombre del dataset (p. ej. 'X_train')
+        * data: DataFrame o Series
+        Resultado:
+        * Diccionario del manifiesto con la descripción del dataset
+        '''
+        tipo = 'series' if isinstance(data, pd.Series) else 'frame'
+        data_frame = data.to_frame() if tipo == 'series' else data
+        nombres = [str(columna) for columna in data_frame.columns]
+        if len(set(nombres)) != len(nombres):
+            raise ValueError("El dataset '" + name + "' tiene columnas repetidas")
+        arrays = []
+        for columna in data_frame.columns:
+            array = data_frame[columna].to_numpy()
+            if array.dtype.kind not in 'biuf':
+                raise ValueError("La columna '" + str(columna) + "' de tipo " + str(array.dtype) +
+                                 " no es numérica ni booleana")
+            arrays.append(array)
+        index = data_frame.index.to_numpy()
+        if index.dtype.kind not in 'biuf':
+            raise ValueError("El índice del dataset '" + name + "' no es numérico")
+
+        anterior = self.__manifest["datasets"].get(name)
+        version = 1 if anterior is None else anterior["version"] + 1
+        directorio = name + "_v" + str(version)
+        os.makedirs(os.path.join(self.__store_dir, directorio), exist_ok=True)
+        columnas = []
+        for n, (nombre, array) in enumerate(zip(nombres, arrays)):
+            fichero = os.path.join(directorio, str(n) + ".npy")
+            np.save(os.path.join(self.__store_dir, fichero), np.ascontiguousarray(array), allow_pickle=False)
+            columnas.append({"name": nombre, "dtype": array.dtype.str, "file": fichero})
+        np.save(os.path.join(self.__store_dir, directorio, "index.npy"), index, allow_pickle=False)
+
+        self.__manifest["datasets"][name] = {
+            "kind": tipo,
+            "series_name": None if tipo == 'frame' or data.name is None else str(data.name),
+            "version": version,
+            "rows": int(data_frame.shape[0]),
+            "index": os.path.join(directorio, "index.npy"),
+            "columns": columnas,
+            "hash": self.__hash(nombres + ["__index__"], arrays + [index])
+        }
+        self.__save_manifest()
+        if anterior is not None:
+            shutil.rmtree(os.path.join(self.__store_dir, os.path.dirname(anterior["index"])), ignore_errors=True)
+        if self.__debug:
+            print("Dataset", name, "versión", version, ":", data_frame.shape)
+
+        return self.__manifest["datasets"][name]
+
+    def write_list(self, name, values):
+        '''
+        Graba una lista de textos (p. ej. la lista de features seleccionadas) en el manifiesto.
+        '''
+        self.__manifest["lists"][name] = [str(valor) for valor in values]
+        self.__save_manifest()
+
+    def read_list(self, name):
+        '''
+        Devuelve una lista de textos grabada con write_list.
+        '''
+        return list(self.__manifest["lists"][name])
+
+    def __dataset(self, name):
+        if name not in self.__manifest["datasets"]:
+            raise KeyError("No existe el dataset '" + name + "' en " + self.__store_dir)
+        return self.__manifest["datasets"][name]
+
+    def column(self, name, column):
+        '''
+        Devuelve una columna de un dataset como array de solo lectura mapeado en memoria.
+
+        Parametros:
+        * name: nombre del dataset
+        * column: nombre de la columna
+        '''
+        for registro in self.__dataset(name)["columns"]:
+            if registro["name"] == column:
+                return np.load(os.path.join(self.__store_dir, registro["file"]), mmap_mode='r', allow_pickle=False)
+        raise KeyError("No existe la columna '" + str(column) + "' en el dataset '" + name + "'")
+
+    def matrix(self, name, columns = None, dtype = np.float32):
+        '''
+        Construye una matriz NumPy (n, nro. de columnas) C-contigua leyendo solo las columnas indicadas.
+
+        Parametros:
+        * name: nombre del dataset
+        * columns: columnas en el orden de la matriz (None: todas)
+        * dtype: tipo de la matriz
+        Resultado:
+        * La matriz
+        '''
+        dataset = self.__dataset(name)
+        columns = [registro["name"] for registro in dataset["columns"]] if columns is None else list(columns)
+        matriz = np.empty((dataset["rows"], len(columns)), dtype=dtype)
+        for n, columna in enumerate(columns):
+            matriz[:, n] = self.column(name, columna)
+
+        return matriz
+
+    def read(self, name, columns = None):
+        '''
+        Lee un dataset como DataFrame o Series (según cómo se grabó), leyendo solo las columnas indicadas.
+        Las columnas no se copian (un bloque por columna sobre la memoria mapeada, que es de solo lectura): para
+        modificar el resultado hay que hacer antes un copy().
+
+        Parametros:
+        * name: nombre del dataset
+        * columns: columnas a leer (None: todas)
+        Resultado:
+        * El DataFrame o la Series
+        '''
+        dataset = self.__dataset(name)
+        index = np.load(os.path.join(self.__store_dir, dataset["index"]), allow_pickle=False)
+        if dataset["kind"] == 'series':
+            columna = dataset["columns"][0]["name"]
+            return pd.Series(self.column(name, columna), index=index, name=dataset["series_name"])
+
+        columns = [registro["name"] for registro in dataset["columns"]] if columns is None else list(columns)
+        # Con copy=False pandas no consolida las columnas en un único bloque (lo que copiaría todos los datos)
+        return pd.DataFrame({columna: self.column(name, columna) for columna in columns}, index=index, copy=False)
+
+    def verify(self, name):
+        '''
+        Comprueba que el contenido de un dataset coincide con el hash del manifiesto.
+        '''
+        dataset = self.__dataset(name)
+        nombres = [registro["name"] for registro in dataset["columns"]]
+        arrays = [self.column(name, nombre) for nombre in nombres]
+        arrays.append(np.load(os.path.join(self.__store_dir, dataset["index"]), mmap_mode='r', allow_pickle=False))
+
+        return self.__hash(nombres + ["__index__"], arrays) == dataset["hash"]
+
+    def import_artifacts(self, data_path = 'data'):
+        '''
+        Migra al almacén los artefactos pickle del proyecto: 'X_train.df', 'y_train.serie', 'X_test.df',
+        'y_test.serie' y la lista 'features_selected' de 'features_selected.npz'.
+        Es la única operación que deserializa pickle, por lo que solo debe usarse con ficheros de confianza.
+
+        Parametros:
+        * data_path: directorio con los artefactos
+        '''
+        for name, fichero in [('X_train', 'X_train.df'), ('y_train', 'y_train.serie'),
+                              ('X_test', 'X_test.df'), ('y_test', 'y_test.serie')]:
+            self.write(name, pd.read_pickle(os.path.join(data_path, fichero)))
+        data = np.load(os.path.join(data_path, 'features_selected.npz'), allow_pickle=True)
+        self.write_list('features_selected', data['features_selected'])
+
+if __name__ == "__main__":
+    store = IdealistaFeatureStore(debug=True)
+    store.import_artifacts()
+    print({name: store.verify(name) for name in store.datasets()})
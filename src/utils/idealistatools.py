@@ -3,20 +3,26 @@
 import glob
 import json
 import os
-import requests
-from requests.auth import HTTPBasicAuth
-import urllib.request
-from bs4 import BeautifulSoup
+import re
 from math import sin, cos, sqrt, atan2, radians
 
 import numpy as np
 import pandas as pd
 
-import seaborn as sns
-import matplotlib.pyplot as plt
+# Solo NumPy y pandas se importan al cargar el módulo: las librerías de la API y del scraping (requests, urllib, bs4),
+# de los gráficos (seaborn, matplotlib) y de scikit-learn/scipy se importan en los métodos que las usan, de modo que
+# los procesos que solo predicen no pagan su tiempo de importación
 
-from sklearn import preprocessing
-from sklearn.feature_extraction import FeatureHasher
+def display(obj):
+    '''
+    Muestra un objeto con IPython.display.display o, fuera de Jupyter/IPython, con print.
+    '''
+    try:
+        from IPython.display import display as ipython_display
+    except ImportError:
+        print(obj)
+        return
+    ipython_display(obj)
 
 # https://developers.idealista.com/access-request
 class Idealista:
@@ -28,13 +34,24 @@ class Idealista:
     __url_search = "http://api.idealista.com/3.5/es/search?"
     __token = None
     
-    def __init__(self, debug = False):
+    def __init__(self, debug = False, url_token = None, url_search = None, session = None):
         '''
         Constructor
         Parametros:
             debug: si vale True muestra mensajes de debug
+            url_token: url alternativa para obtener el token (por ejemplo, un servidor local de pruebas)
+            url_search: url alternativa de la función search
+            session: requests.Session con la que se reutilizan las conexiones HTTP. Por defecto no se reutilizan
         '''
         self.__debug = debug
+        if url_token is not None:
+            self.__url_token = url_token
+        if url_search is not None:
+            self.__url_search = url_search
+        if session is None:
+            import requests
+            session = requests
+        self.__http = session
     
     def __get_has_parkingspace(self, parking_space):
         '''
@@ -91,9 +108,11 @@ class Idealista:
         Resultado:
         * El token
         '''
+        from requests.auth import HTTPBasicAuth
+
         basic_auth = HTTPBasicAuth(api_key, api_secret)
             
-        r = requests.post(self.__url_token,
+        r = self.__http.post(self.__url_token,
                           auth=basic_auth,
                           data={"grant_type": "client_credentials"})
 
@@ -103,6 +122,8 @@ class Idealista:
         self.__token = token_response["access_token"]
         if self.__debug:
             print("Token:", self.__token)
+
+        return self.__token
     
     def set_token(self, token):
         '''
@@ -113,6 +134,25 @@ class Idealista:
         * token: token de la API de Idealista.
         '''
         self.__token = token
+
+    def get_token(self):
+        '''
+        Devuelve el token de la API de Idealista en uso.
+        '''
+        return self.__token
+
+    def search_url(self, center, country='es', numPage='1', maxItems='50', distance='1000', propertyType='homes', operation='sale'):
+        '''
+        Construye la url de la función search de la API de Idealista. Los argumentos son los mismos que los del método 'search'.
+        '''
+        return self.__url_search + \
+            'country=' + country +\
+            '&center=' + center +\
+            '&numPage=' + numPage +\
+            '&maxItems=' + maxItems +\
+            '&distance=' + distance +\
+            '&propertyType=' + propertyType +\
+            '&operation=' + operation
         
     def search(self, center, country='es', numPage='1', maxItems='50', distance='1000', propertyType='homes', operation='sale'):
         '''
@@ -133,19 +173,12 @@ class Idealista:
         Resultado:
         * JSON con el resultado de la invocación a la función search de la API de Idealista
         '''
-        api_url = self.__url_search + \
-            'country=' + country +\
-            '&center=' + center +\
-            '&numPage=' + numPage +\
-            '&maxItems=' + maxItems +\
-            '&distance=' + distance +\
-            '&propertyType=' + propertyType +\
-            '&operation=' + operation
+        api_url = self.search_url(center, country, numPage, maxItems, distance, propertyType, operation)
         if self.__debug:
             print(api_url)
         
         headers = {"Authorization": "Bearer " + self.__token}
-        r = requests.post(api_url, headers = headers)
+        r = self.__http.post(api_url, headers = headers)
         result = None
         try:
             result = json.loads(r.text)
@@ -204,14 +237,9 @@ class Idealista:
         list_df = [self.read_json(fich_json) for fich_json in list_ficheros_json]
         
         idealista_df = None
-        if len(list_df) == 1:
-            idealista_df = list_df[0].copy()
-        elif len(list_df) > 1:
-            idealista_df = list_df[0].copy()
-            for ind in range(1,len(list_df)):
-                idealista_df = idealista_df.append(list_df[ind])
-            
-            idealista_df.reset_index(drop=True,inplace=True)
+        if len(list_df) > 0:
+            # Un único concat en lugar de DataFrame.append en bucle (cuadrático y eliminado en pandas 2)
+            idealista_df = pd.concat(list_df, ignore_index=True)
 
         return idealista_df
 
@@ -231,11 +259,194 @@ class Idealista:
         data_frame["isParkingSpaceIncludedInPrice"] = data_frame["parkingSpace"].apply(self.__get_is_parkingspace_inc_inprice)
         data_frame.drop(columns = ["detailedType","parkingSpace"], inplace = True)
 
+class IdealistaImputer:
+    '''
+    Clase que imputa valores nulos siguiendo una jerarquía de grupos (por defecto barrio -> distrito -> ciudad,
+    siempre dentro del mismo 'propertyType').
+    Las tablas de agregados de cada nivel se calculan una sola vez con groupby y los nulos se rellenan
+    de forma vectorizada, sin recorrer el DataFrame fila a fila.
+    Los agregados se calculan solo con los valores observados, de modo que el resultado no depende del orden
+    de las filas (el antiguo bucle con iterrows incluía en la media los valores que ya había imputado).
+    '''
+
+    niveles_defecto = [["codbarrio", "propertyType"], ["coddistrit", "propertyType"], ["propertyType"]]
+
+    def __init__(self, columns, levels = None, debug = False):
+        '''
+        Constructor
+        Parametros:
+            columns: diccionario {columna: agregador}. El agregador puede ser 'mean', 'mode' o una función
+                     que recibe una Serie y devuelve un escalar
+            levels: lista de niveles de la jerarquía, de más específico a más general. Cada nivel es una lista
+                    de columnas de agrupación. Por defecto: barrio, distrito y ciudad por 'propertyType'
+            debug: si vale True muestra mensajes de debug
+        '''
+        self.columns = columns
+        self.levels = levels if levels is not None else self.niveles_defecto
+        self.tables = None
+        self.__debug = debug
+
+    def __aggregate(self, data_frame, column, keys, aggregator):
+        '''
+        Método "privado".
+        Calcula la tabla de agregados de una columna para un nivel de la jerarquía.
+
+        Argumentos:
+        * data_frame: DataFrame con los valores observados (sin nulos en 'column')
+        * column: columna a agregar
+        * keys: columnas de agrupación del nivel
+        * aggregator: 'mean', 'mode' o función
+
+        Resultado:
+        * Serie indexada por las claves del nivel con el valor agregado
+        '''
+        if aggregator == 'mode':
+            # Igual que Series.mode()[0]: el valor más frecuente y, en caso de empate, el menor
+            counts = data_frame.groupby(keys + [column]).size().reset_index(name='__count')
+            counts.sort_values(by=['__count', column], ascending=[False, True], inplace=True, kind='mergesort')
+            counts.drop_duplicates(subset=keys, keep='first', inplace=True)
+            return counts.set_index(keys)[column]
+
+        values = data_frame[column]
+        if aggregator == 'mean':
+            values = values.astype('float64')
+        return values.groupby([data_frame[key] for key in keys]).agg(aggregator)
+
+    def fit(self, data_frame):
+        '''
+        Calcula las tablas de agregados de cada columna y nivel de la jerarquía.
+
+        Parametros:
+        * data_frame: DataFrame con datos de Idealista
+        Resultado:
+        * El propio imputador
+        '''
+        self.tables = {}
+        for column, aggregator in self.columns.items():
+            observados = data_frame.loc[data_frame[column].notnull(), :]
+            self.tables[column] = [self.__aggregate(observados, column, keys, aggregator) for keys in self.levels]
+            if self.__debug:
+                print(column, "tamaño de las tablas por nivel:", [table.shape[0] for table in self.tables[column]])
+
+        return self
+
+    def transform(self, data_frame):
+        '''
+        Rellena los nulos de las columnas configuradas con el valor del nivel más específico de la jerarquía
+        en el que haya valores observados. Modifica el DataFrame recibido.
+
+        Parametros:
+        * data_frame: DataFrame con datos de Idealista
+        '''
+        for column in self.columns:
+            pendientes = data_frame[column].isna().to_numpy()
+            if self.__debug:
+                print(column, "nulos a imputar:", pendientes.sum())
+            pos_columna = data_frame.columns.get_loc(column)
+            for keys, table in zip(self.levels, self.tables[column]):
+                if not pendientes.any():
+                    break
+                filas = data_frame.loc[pendientes, keys]
+                if len(keys) == 1:
+                    claves = pd.Index(filas[keys[0]])
+                else:
+                    claves = pd.MultiIndex.from_frame(filas)
+                encontrados = table.reindex(claves).to_numpy()
+                rellenar = pd.notnull(encontrados)
+                posiciones = np.flatnonzero(pendientes)[rellenar]
+                if posiciones.shape[0] > 0:
+                    data_frame.iloc[posiciones, pos_columna] = encontrados[rellenar]
+                pendientes[posiciones] = False
+
+    def fit_transform(self, data_frame):
+        '''
+        Calcula las tablas de agregados y rellena los nulos del DataFrame en una sola llamada.
+
+        Parametros:
+        * data_frame: DataFrame con datos de Idealista
+        '''
+        self.fit(data_frame)
+        self.transform(data_frame)
+
+class IdealistaHyperLogLog:
+    '''
+    Sketch HyperLogLog para estimar el número de valores distintos de una columna sin guardarlos.
+    Usa 2^p registros de un byte (16 KB con p=14, error típico de 1.04 / sqrt(2^p), un 0,8%) y se actualiza
+    con arrays de valores completos (vectorizado con NumPy).
+    '''
+
+    def __init__(self, p = 14):
+        '''
+        Constructor
+        Parametros:
+            p: número de bits del hash que seleccionan el registro (entre 4 y 18)
+        '''
+        self.__p = p
+        self.__m = 1 << p
+        self.registers = np.zeros(self.__m, dtype=np.uint8)
+
+    def __bit_length(self, values):
+        '''
+        Método "privado".
+        Número de bits de cada entero de un array uint64 (exacto: se calcula por mitades de 32 bits).
+        '''
+        alto = (values >> np.uint64(32)).astype(np.float64)
+        bajo = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+        return np.where(alto > 0, np.frexp(alto)[1] + 32, np.frexp(bajo)[1])
+
+    def update(self, values):
+        '''
+        Añade al sketch los valores no nulos de un array o Series.
+        '''
+        values = pd.Series(values).dropna()
+        if values.empty:
+            return self
+        if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            # 5 y 5.0 son el mismo valor aunque en un trozo la columna sea entera y en otro float
+            values = values.astype(np.float64)
+        elif not pd.api.types.is_bool_dtype(values):
+            values = values.astype(str)
+        hashes = pd.util.hash_array(values.to_numpy(), categorize=False)
+
+        bits = 64 - self.__p
+        registro = (hashes >> np.uint64(bits)).astype(np.intp)
+        resto = hashes & np.uint64((1 << bits) - 1)
+        rango = (bits - self.__bit_length(resto) + 1).astype(np.uint8)
+        np.maximum.at(self.registers, registro, rango)
+
+        return self
+
+    def merge(self, other):
+        '''
+        Une otro sketch con el mismo p (el resultado estima los distintos de la unión).
+        '''
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        '''
+        Estimación del número de valores distintos.
+        '''
+        m = self.__m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimacion = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        vacios = int(np.count_nonzero(self.registers == 0))
+        if estimacion <= 2.5 * m and vacios > 0:
+            # Corrección para cardinalidades pequeñas (linear counting)
+            estimacion = m * np.log(m / vacios)
+
+        return int(round(estimacion))
+
 class IdealistaFeatureEngineering:
     '''
     Clase con métodos para hacer tareas de FeatureEngineering sobre el dataset de Idealista.
     '''
 
+    '''
+    Abreviaturas de plantas y su número
+    '''
+    map_floor = { "bj": 0, "en": 0, "ss": -1, "st": -1 }
+
     def __init__(self, debug = False):
         '''
         Constructor
@@ -243,32 +454,101 @@ class IdealistaFeatureEngineering:
             debug: si vale True muestra mensajes de debug
         '''
         self.__debug = debug
+        self.__hash_cache = {}
     
     
     def nan_analysis(self, dataframe, display_analysis = True):
         '''
         Realiza un análisis de nans sobre el dataset de Idealista, generando un DataFrame con el resultado de dicho análisis.
         Opcionalmente hace un display del DataFrame con el resultado del análisis de nans.
+        El dataset puede ser un DataFrame o un iterable de DataFrames (p. ej. 'read_chunks' o pd.read_csv con chunksize):
+        en ese caso se recorre una sola vez con 'profile', sin cargarlo entero en memoria.
         
         Parametros:
-        * dataframe: DataFrame a analizar
+        * dataframe: DataFrame a analizar, o iterable de trozos del DataFrame
         * display_analysis: si vale True se hace un display del DataFrame con el resultado del análisis de nans
         Resultado:
         * El DataFrame con el resultado del análisis de nans
         '''
-        nro_filas = dataframe.shape[0]
-
-        print("Valores nulos en cada columna:")
-        suma_nulos_cols = dataframe.isna().sum().to_frame()
-        suma_nulos_cols.columns = ['NroNulos']
-        suma_nulos_cols['PorcentajeNulos'] = 100 * suma_nulos_cols['NroNulos'] / nro_filas
+        if isinstance(dataframe, pd.DataFrame):
+            nro_filas = dataframe.shape[0]
+            suma_nulos_cols = dataframe.isna().sum().to_frame()
+            suma_nulos_cols.columns = ['NroNulos']
+            suma_nulos_cols['PorcentajeNulos'] = 100 * suma_nulos_cols['NroNulos'] / nro_filas
+        else:
+            suma_nulos_cols = self.profile(dataframe)[['NroNulos', 'PorcentajeNulos']]
         suma_nulos_cols.sort_values(by='NroNulos', ascending=False, inplace=True)
         cols_con_nulos = suma_nulos_cols[suma_nulos_cols['NroNulos'] > 0]
         if display_analysis:
+            print("Valores nulos en cada columna:")
             display(cols_con_nulos)
         
         return cols_con_nulos
-        
+
+    def read_chunks(self, file, chunksize = 100000, columns = None):
+        '''
+        Lee un CSV o un Parquet por trozos.
+
+        Parametros:
+        * file: fichero '.csv' o '.parquet'
+        * chunksize: número de filas de cada trozo
+        * columns: columnas a leer (None: todas)
+        Resultado:
+        * Iterador de DataFrames
+        '''
+        if file.endswith('.parquet'):
+            import pyarrow.parquet as pq
+
+            for batch in pq.ParquetFile(file).iter_batches(batch_size=chunksize, columns=columns):
+                yield batch.to_pandas()
+        else:
+            yield from pd.read_csv(file, chunksize=chunksize, usecols=columns)
+
+    def profile(self, chunks, p = 14):
+        '''
+        Recorre una sola vez un dataset por trozos y acumula por columna el número de nulos, una estimación
+        HyperLogLog del número de valores distintos y el mínimo y el máximo (de las columnas numéricas).
+        Si una columna no aparece en un trozo, sus filas de ese trozo cuentan como nulos.
+
+        Parametros:
+        * chunks: iterable de DataFrames (p. ej. 'read_chunks') o un DataFrame
+        * p: precisión de los sketches HyperLogLog
+        Resultado:
+        * DataFrame con una fila por columna y las columnas NroNulos, PorcentajeNulos, Distintos, Min y Max
+        '''
+        if isinstance(chunks, pd.DataFrame):
+            chunks = [chunks]
+
+        nro_filas = 0
+        nulos, sketches, minimos, maximos = {}, {}, {}, {}
+        for chunk in chunks:
+            for columna in chunk.columns:
+                if columna not in nulos:
+                    # Columna nueva: las filas de los trozos anteriores no la tenían
+                    nulos[columna] = nro_filas
+                    sketches[columna] = IdealistaHyperLogLog(p)
+            for columna in nulos:
+                if columna not in chunk.columns:
+                    nulos[columna] += chunk.shape[0]
+                    continue
+                valores = chunk[columna]
+                nulos[columna] += int(valores.isna().sum())
+                sketches[columna].update(valores)
+                if pd.api.types.is_numeric_dtype(valores) and valores.notna().any():
+                    minimo, maximo = valores.min(), valores.max()
+                    minimos[columna] = minimo if columna not in minimos else min(minimos[columna], minimo)
+                    maximos[columna] = maximo if columna not in maximos else max(maximos[columna], maximo)
+            nro_filas += chunk.shape[0]
+            if self.__debug:
+                print("Filas procesadas:", nro_filas)
+
+        resultado = pd.DataFrame({'NroNulos': pd.Series(nulos, dtype=np.int64)})
+        resultado['PorcentajeNulos'] = 100 * resultado['NroNulos'] / nro_filas
+        resultado['Distintos'] = [sketches[columna].count() for columna in resultado.index]
+        resultado['Min'] = pd.Series(minimos, dtype=object)
+        resultado['Max'] = pd.Series(maximos, dtype=object)
+
+        return resultado
 
     def floor_str_2_number(self, floor):
         '''
@@ -285,9 +565,8 @@ class IdealistaFeatureEngineering:
         '''
         new_floor = floor
 
-        map_floor = { "bj": 0, "en": 0, "ss": -1, "st": -1 }
         if not pd.isnull(floor) and isinstance(floor, str):
-            valor = map_floor.get(floor)
+            valor = self.map_floor.get(floor)
             if valor != None:
                 new_floor = valor
             else:
@@ -295,40 +574,55 @@ class IdealistaFeatureEngineering:
 
         return new_floor
 
+    def floors_2_number(self, floors, errors = 'raise'):
+        '''
+        Versión vectorizada de floor_str_2_number para una columna completa: en lugar de convertir cada valor,
+        convierte solo los valores distintos (una búsqueda en map_floor y pd.to_numeric para los textos numéricos)
+        y los reparte a todas las filas con sus códigos de pd.factorize.
+
+        Parametros:
+        * floors: Series con las plantas (textos, números o nulos)
+        * errors: qué hacer con los valores que no son una abreviatura ni un número entero entre -128 y 127:
+          'raise' lanza ValueError con esos valores y 'coerce' los convierte a nulo
+        Resultado:
+        * Series de tipo Int8 (entero de 8 bits con nulos) con el mismo índice y nombre que floors
+        '''
+        if errors not in ('raise', 'coerce'):
+            raise ValueError("errors debe ser 'raise' o 'coerce': " + str(errors))
+
+        codigos, valores = pd.factorize(floors, use_na_sentinel=True)
+        valores = pd.Series(valores, dtype=object)
+        numeros = valores.map(self.map_floor)
+        sin_abreviatura = numeros.isna()
+        numeros[sin_abreviatura] = pd.to_numeric(valores[sin_abreviatura], errors='coerce')
+        numeros = numeros.astype(np.float64)
+        validos = numeros.notna() & (numeros == numeros.round()) & numeros.between(-128, 127)
+        if not validos.all():
+            if errors == 'raise':
+                raise ValueError("Plantas desconocidas: " + ", ".join(map(repr, valores[~validos].tolist())))
+            numeros[~validos] = np.nan
+
+        # El código -1 de pd.factorize (nulo) toma el último valor, que es nulo
+        tabla = pd.array(numeros.tolist() + [None], dtype="Int8")
+
+        return pd.Series(tabla.take(codigos), index=floors.index, name=floors.name)
+
     def fillna_floor(self, idealista_df):
         '''
         Asigna a las muestras con la variable 'floor' a nan la media de propiedades del mismo tipo:
         - Y del mismo tipo de barrio al que pertenezca la propiedad si en ese barrio hay propiedades
         - Y del mismo tipo de distrito al que pertenezca la propiedad si no hay propiedades en su barrio y sí en su distrito
         - De todo Madrid si no hay propiedades en su barrio ni en su distrito
+
+        Las medias se calculan solo con los valores observados. La versión original (un recorrido con iterrows)
+        usaba también los valores que ya había imputado, así que dependía del orden de las filas y algunos
+        valores imputados difieren en unas centésimas; tras el round() de main.ipynb el resultado es el mismo
+        que idealista_madrid_clean.csv.
         
         Parametros:
         * idealista_df: DataFrame con datos de Idealista
         '''
-        df_floor_nan = idealista_df.loc[idealista_df['floor'].isna(),:]
-        df_floor_nan.shape[0]
-        for index, row in df_floor_nan.iterrows():
-            #display(index)
-            new_floor = np.nan
-            aux = idealista_df.loc[idealista_df['floor'].notnull() &
-                                   (idealista_df["codbarrio"] == row["codbarrio"]) & \
-                                   (idealista_df["propertyType"] == row["propertyType"]),:]["floor"]
-            #display(aux)
-            if aux.shape[0] > 0:
-                new_floor = aux.mean()
-            else:
-                aux = idealista_df.loc[idealista_df['floor'].notnull() &
-                                       (idealista_df["coddistrit"] == row["coddistrit"]) & \
-                                       (idealista_df["propertyType"] == row["propertyType"]),:]["floor"]
-                if aux.shape[0] > 0:
-                    new_floor = aux.mean()
-                else:
-                    aux = idealista_df.loc[idealista_df['floor'].notnull() &
-                                           (idealista_df["propertyType"] == row["propertyType"]),:]["floor"]
-                    new_floor = aux.mean()
-
-            #print(new_floor)
-            idealista_df.at[index,"floor"] = new_floor
+        IdealistaImputer({'floor': 'mean'}, debug=self.__debug).fit_transform(idealista_df)
     
     def fillna_haslift(self, idealista_df):
         '''
@@ -340,41 +634,50 @@ class IdealistaFeatureEngineering:
         Parametros:
         * idealista_df: DataFrame con datos de Idealista
         '''
-        df_haslift_nan = idealista_df.loc[idealista_df['hasLift'].isna(),:]
-        df_haslift_nan.shape[0]
-        for index, row in df_haslift_nan.iterrows():
-            #display(index)
-            new_haslift = np.nan
-            aux = idealista_df.loc[idealista_df['hasLift'].notnull() &
-                                   (idealista_df["codbarrio"] == row["codbarrio"]) & \
-                                   (idealista_df["propertyType"] == row["propertyType"]),:]["hasLift"]
-            #display(aux)
-            if aux.shape[0] > 0:
-                new_haslift = aux.mode()[0]
-            else:
-                aux = idealista_df.loc[idealista_df['hasLift'].notnull() &
-                                       (idealista_df["coddistrit"] == row["coddistrit"]) & \
-                                       (idealista_df["propertyType"] == row["propertyType"]),:]["hasLift"]
-                if aux.shape[0] > 0:
-                    new_haslift = aux.mode()[0]
-                else:
-                    aux = idealista_df.loc[idealista_df['hasLift'].notnull() &
-                                           (idealista_df["propertyType"] == row["propertyType"]),:]["hasLift"]
-                    new_haslift = aux.mode()[0]
-
-            #print(new_haslift)
-            idealista_df.at[index,"hasLift"] = new_haslift
+        IdealistaImputer({'hasLift': 'mode'}, debug=self.__debug).fit_transform(idealista_df)
         
     def feateures_bool_2_number(self, data_frame):
         '''
-        Convierte las columnas booleanas de un DataFrame a ceors y unos.
+        Convierte las columnas booleanas de un DataFrame a ceors y unos (int8) y reduce el resto de columnas
+        enteras con downcast_dtypes.
         
         Parametros:
         * data_frame: DataFrame con datos a convertir
         '''
+        # downcast_dtypes convierte a bool las booleanas nullables sin nulos
+        self.downcast_dtypes(data_frame)
         for index, value in data_frame.dtypes.items():
             if str(value) == 'bool':
-                data_frame[index] = data_frame[index] * 1
+                data_frame[index] = data_frame[index].astype(np.int8)
+
+    def downcast_dtypes(self, data_frame, float32_columns = None, category_columns = None):
+        '''
+        Reduce la memoria de un DataFrame sin cambiar sus valores:
+        - Las columnas enteras se convierten al entero más pequeño que admite su rango
+        - Las columnas booleanas nullables sin nulos se convierten a bool
+        - Las columnas indicadas en float32_columns se convierten a float32 (coordenadas, tamaños, etc.)
+        - Las columnas indicadas en category_columns se convierten a category
+
+        Parametros:
+        * data_frame: DataFrame con datos a convertir
+        * float32_columns: columnas numéricas que se pueden guardar en float32
+        * category_columns: columnas de texto con pocos valores distintos
+        Resultado:
+        * El DataFrame convertido (se modifica el propio DataFrame)
+        '''
+        float32_columns = [] if float32_columns is None else float32_columns
+        category_columns = [] if category_columns is None else category_columns
+        for index, value in data_frame.dtypes.items():
+            if index in category_columns:
+                data_frame[index] = data_frame[index].astype('category')
+            elif index in float32_columns:
+                data_frame[index] = data_frame[index].astype(np.float32)
+            elif str(value) == 'boolean' and not data_frame[index].hasnans:
+                data_frame[index] = data_frame[index].astype(bool)
+            elif pd.api.types.is_integer_dtype(value) and not pd.api.types.is_extension_array_dtype(value):
+                data_frame[index] = pd.to_numeric(data_frame[index], downcast='integer')
+
+        return data_frame
 
     def create_featurehasher(self, feature, n_features, prefix):
         '''
@@ -387,13 +690,68 @@ class IdealistaFeatureEngineering:
         Resultado:
         * El DataFrame con el resultado de la codificación FeatureHasher
         '''
+        from sklearn.feature_extraction import FeatureHasher
+
         hasher = FeatureHasher(n_features = n_features, input_type='string')
-        f = hasher.transform(feature)
+        # Cada valor se codifica como la secuencia de sus caracteres (lo que hacía FeatureHasher con un str
+        # antes de scikit-learn 1.2, que ya no acepta un str como muestra)
+        f = hasher.transform([list(valor) for valor in feature])
         columns = [prefix + "_" + str(n + 1) for n in range(n_features)]
         hasher_df = pd.DataFrame(data=f.toarray(), columns=columns)
 
         return hasher_df
 
+    def create_featurehasher_cached(self, feature, n_features, prefix, output = 'int8'):
+        '''
+        Realiza la misma codificación FeatureHasher que 'create_featurehasher', pero calculando el hash de cada valor
+        distinto una sola vez (las codificaciones se guardan entre llamadas) y asignándolo a la columna con indexación
+        vectorizada. Es útil con columnas de pocos valores distintos y muchas filas, como 'codbar' o 'coddistrit'.
+
+        Parametros:
+        * feature: los valores de la columna de un DataFrame
+        * n_features: valor del argumento n_features de FeatureHasher
+        * prefix: prefijo de las columnas del resultado
+        * output: formato del resultado:
+            'int8' - DataFrame con columnas int8 (los valores del hash son enteros pequeños). Si algún valor no cabe en
+                     int8 (textos largos o con muchos caracteres repetidos) las columnas son int16 o, si tampoco
+                     caben, float64
+            'float64' - DataFrame igual al de 'create_featurehasher'
+            'sparse' - matriz dispersa scipy (CSR) con las columnas prefix_1 ... prefix_n
+        Resultado:
+        * El resultado de la codificación FeatureHasher en el formato indicado
+        '''
+        codes, uniques = pd.factorize(pd.Series(feature), sort=False)
+        if (codes < 0).any():
+            raise ValueError("La columna tiene valores nulos: convertirla antes a str, como se hace en el notebook")
+
+        cache = self.__hash_cache.setdefault(n_features, {})
+        nuevos = [valor for valor in uniques if valor not in cache]
+        if nuevos:
+            from sklearn.feature_extraction import FeatureHasher
+
+            hasher = FeatureHasher(n_features = n_features, input_type='string')
+            for valor, fila in zip(nuevos, hasher.transform([list(valor) for valor in nuevos]).toarray()):
+                cache[valor] = fila
+        if self.__debug:
+            print(prefix, "valores distintos:", len(uniques), "nuevos en la caché:", len(nuevos))
+
+        table = np.vstack([cache[valor] for valor in uniques]) if len(uniques) > 0 else np.zeros((0, n_features))
+        columns = [prefix + "_" + str(n + 1) for n in range(n_features)]
+        if output == 'sparse':
+            from scipy import sparse
+
+            return sparse.csr_matrix(table)[codes]
+
+        dtype = np.float64
+        if output == 'int8':
+            for entero in (np.int8, np.int16):
+                if table.size == 0 or (table.min() >= np.iinfo(entero).min and table.max() <= np.iinfo(entero).max):
+                    dtype = entero
+                    break
+            if self.__debug and dtype != np.int8:
+                print(prefix, "valores del hash fuera del rango de int8, se usa", np.dtype(dtype).name)
+        return pd.DataFrame(data=table.astype(dtype)[codes], columns=columns)
+
 class IdealistaML:
     '''
     Clase con métodos para hacer ciertos análisis para la creación del modelo de Machine Learning del dataset de Idealista.
@@ -407,34 +765,93 @@ class IdealistaML:
         '''
         self.__debug = debug
 
-    def correlation_analysis(self, data, show_heatmap = False, figsize=None):
+    def correlation_analysis(self, data, show_heatmap = False, figsize=None, target = None, dtype = np.float32,
+                             chunk_size = None):
         '''
-        Realiza un análisis de correlación sobre un DataFrame.
+        Realiza un análisis de correlación (Pearson) sobre un DataFrame.
         Opcionalmente muestra una gráfica heatmap del resultado del análisis de correlación.
+        Si las columnas no tienen nulos, las correlaciones se calculan con un único producto de matrices sobre las
+        columnas estandarizadas (en 'dtype'); si hay nulos se usa data.corr(), que descarta los nulos por pares.
         
         Parametros:
         * data: DataFrame sobre el que se realiza un análisis de correlación
         * show_heatmap: si vale True muestra una gráfica heatmap del resultado del análisis de correlación
         * figsize: tamaño de la gráfica heatmap
-        * prefix: prefijo de las columnas del DataFrame con el resultado de la codificación FeatureHasher
+        * target: si se indica (p. ej. 'price'), solo se calcula la correlación de cada columna con esa columna
+        * dtype: tipo con el que se calculan las correlaciones
+        * chunk_size: si se indica, la matriz de correlación se calcula por bloques de ese número de columnas
+          (para DataFrames muy anchos)
         Resultado:
-        * El resultado del análisis de correlación
+        * El resultado del análisis de correlación: un DataFrame, o una Series si se indica target
         '''
-        correlation = data.corr()
+        numericas = data.select_dtypes(include=[np.number, bool])
+        if numericas.isna().to_numpy().any():
+            if target is not None:
+                correlation = numericas.corrwith(numericas[target])
+            else:
+                correlation = numericas.corr()
+        else:
+            correlation = self.__correlation_matrix_product(numericas, target, dtype, chunk_size)
 
-        mask = np.zeros_like(correlation, dtype=np.bool)
-        mask[np.triu_indices_from(mask)] = True
+        if show_heatmap:
+            import matplotlib.pyplot as plt
+            import seaborn as sns
 
-        f, ax = plt.subplots(figsize=figsize)
+            if target is not None:
+                correlation_plot = correlation.drop(target).sort_values().to_frame()
+                f, ax = plt.subplots(figsize=figsize)
+                sns.heatmap(correlation_plot, cmap=sns.diverging_palette(180, 20, as_cmap=True), vmax=1, vmin=-1,
+                            center=0, annot=True)
+            else:
+                mask = np.zeros_like(correlation, dtype=bool)
+                mask[np.triu_indices_from(mask)] = True
 
-        cmap = sns.diverging_palette(180, 20, as_cmap=True)
-        sns.heatmap(correlation, mask=mask, cmap=cmap, vmax=1, vmin =-1, center=0,
-                    square=True, linewidths=.5, cbar_kws={"shrink": .5}, annot=True)
+                f, ax = plt.subplots(figsize=figsize)
 
-        plt.show()
+                cmap = sns.diverging_palette(180, 20, as_cmap=True)
+                sns.heatmap(correlation, mask=mask, cmap=cmap, vmax=1, vmin =-1, center=0,
+                            square=True, linewidths=.5, cbar_kws={"shrink": .5}, annot=True)
+
+            plt.show()
         
         return correlation
 
+    def __correlation_matrix_product(self, data, target, dtype, chunk_size):
+        '''
+        Método "privado".
+        Calcula las correlaciones como Z.T @ Z, con Z las columnas centradas y divididas por su norma euclídea
+        (con esa normalización el producto ya es la correlación, sin dividir por n).
+        Las columnas constantes tienen correlación nan, igual que con data.corr().
+        '''
+        columnas = data.columns
+        nro_columnas = len(columnas)
+        paso = nro_columnas if chunk_size is None else chunk_size
+
+        # Se estandariza por bloques de chunk_size columnas: el temporal float64 de cada bloque es de n x chunk_size
+        # (Z, de n x columnas, se guarda en dtype)
+        Z = np.empty((data.shape[0], nro_columnas), dtype=dtype)
+        for inicio in range(0, nro_columnas, paso):
+            bloque = data.iloc[:, inicio:inicio + paso].to_numpy(dtype=np.float64)
+            bloque = bloque - bloque.mean(axis=0)
+            norma = np.sqrt(np.einsum('ij,ij->j', bloque, bloque))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                Z[:, inicio:inicio + paso] = bloque / norma
+
+        if target is not None:
+            z_target = Z[:, columnas.get_loc(target)]
+            correlation = pd.Series(np.clip(Z.T @ z_target, -1, 1), index=columnas)
+            correlation[target] = 1.0 if np.isfinite(correlation[target]) else np.nan
+            return correlation
+
+        matriz = np.empty((nro_columnas, nro_columnas), dtype=dtype)
+        for inicio in range(0, nro_columnas, paso):
+            matriz[inicio:inicio + paso] = Z[:, inicio:inicio + paso].T @ Z
+        np.clip(matriz, -1, 1, out=matriz)
+        diagonal = np.diag_indices(nro_columnas)
+        matriz[diagonal] = np.where(np.isfinite(matriz[diagonal]), 1, np.nan)
+
+        return pd.DataFrame(matriz, index=columnas, columns=columnas)
+
 class IdealistaWebScraping:
     '''
     Clase con métodos para obtener información de un anuncio del portal Idealista usando Web Scraping.
@@ -446,6 +863,29 @@ class IdealistaWebScraping:
     longitudCentro = -3.703834
     latitudCentro = 40.416639
 
+    '''
+    Variables de una vivienda en el orden esperado por los modelos (el target 'price' y después 'features_selected')
+    '''
+    campos_vivienda = ["price", "exterior", "distance", "size", "rooms", "priceByArea", "propertyType_flat", "latitude",
+                       "coddistrit_1", "bathrooms", "coddistrit_2", "propertyType_chalet", "codbar_3", "codbar_5",
+                       "hasParkingSpace"]
+
+    '''
+    Cabeceras HTTP con las que se descargan los anuncios
+    '''
+    headers = {
+        'authority': "www.idealista.com",
+        'cache-control': "max-age=0",
+        'upgrade-insecure-requests': "1",
+        'user-agent': "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/84.0.4147.125 Safari/537.36",
+        'accept': "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9",
+        'sec-fetch-site': "none",
+        'sec-fetch-mode': "navigate",
+        'sec-fetch-user': "?1",
+        'sec-fetch-dest': "document",
+        'accept-language': "en-US,en;q=0.9"
+    }
+
     def __init__(self, debug = False):
         '''
         Constructor
@@ -463,18 +903,7 @@ class IdealistaWebScraping:
         Resultado:
         * Html de la página web descargada
         '''
-        headers = {
-            'authority': "www.idealista.com",
-            'cache-control': "max-age=0",
-            'upgrade-insecure-requests': "1",
-            'user-agent': "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/84.0.4147.125 Safari/537.36",
-            'accept': "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9",
-            'sec-fetch-site': "none",
-            'sec-fetch-mode': "navigate",
-            'sec-fetch-user': "?1",
-            'sec-fetch-dest': "document",
-            'accept-language': "en-US,en;q=0.9"
-        }
+        headers = self.headers
 
         '''
         headers={
@@ -482,6 +911,8 @@ class IdealistaWebScraping:
         }
         '''
 
+        import urllib.request
+
         req = urllib.request.Request(
             url, 
             data=None, 
@@ -520,7 +951,26 @@ class IdealistaWebScraping:
 
         return distance
 
-    def extract_advertisement_info(self, html, size_index):
+    def __strained_soup(self, html, parser):
+        '''
+        Método "privado".
+        Construye un BeautifulSoup solo con los elementos del anuncio que usa 'extract_advertisement_info'.
+        SoupStrainer no permite combinar condiciones sobre 'class' e 'id', así que se filtra en dos pasadas
+        (el tokenizado de lxml es rápido; lo costoso es construir el árbol completo).
+        '''
+        from bs4 import BeautifulSoup, SoupStrainer
+
+        if hasattr(html, 'read'):
+            html = html.read()
+        clases = SoupStrainer(class_=re.compile(r'\b(info-data-price|details-property_features|squaredmeterprice)\b'))
+        soup = BeautifulSoup(html, parser, parse_only=clases)
+        header_map = BeautifulSoup(html, parser, parse_only=SoupStrainer(id='headerMap')).find(id='headerMap')
+        if header_map is not None:
+            soup.append(header_map)
+
+        return soup
+
+    def extract_advertisement_info(self, html, size_index, parser = None):
         '''
         Extrae del html de un anuncio de venta de vivienda de Idealista la siguietne información:
         price, size, rooms, bathrooms, priceByArea, barrio y distrito.
@@ -528,12 +978,16 @@ class IdealistaWebScraping:
         Parametros:
         * html: html del anuncio de venta de vivienda de Idealista
         * size_index: índice dentro de una lista de características de la vivienda donde se encuentra el taaño del piso.
+        * parser: si se indica (p. ej. 'lxml' o 'html.parser'), el html se analiza con ese parser y solo se construyen
+          los elementos necesarios (SoupStrainer). Por defecto se analiza el documento completo con el parser por defecto
         Resultado:
         * Diccionario con price, size, rooms, bathrooms, priceByArea, barrio y distrito.
         '''
+        from bs4 import BeautifulSoup
+
         info = {}
 
-        soup = BeautifulSoup(html)
+        soup = BeautifulSoup(html) if parser is None else self.__strained_soup(html, parser)
         price = soup.find_all("span", class_ = "info-data-price")
         price = int(price[0].contents[0].contents[0].replace('.',''))
         info["price"] = price
@@ -592,39 +1046,7 @@ class IdealistaWebScraping:
         Resultado:
         * Diccionario ordenado
         '''
-        
-        infoVivenda = {
-            "price": None,
-            "exterior": None,
-            "distance": None,
-            "size": None,
-            "rooms": None,
-            "priceByArea": None,
-            "propertyType_flat": None,
-            "latitude": None,
-            "coddistrit_1": None,
-            "bathrooms": None,
-            "coddistrit_2": None,
-            "propertyType_chalet": None,
-            "codbar_3": None,
-            "codbar_5": None,
-            "hasParkingSpace": None
-        }
-
-        infoVivenda["price"] = info["price"]
-        infoVivenda["exterior"] = info["exterior"]
-        infoVivenda["distance"] = info["distance"]
-        infoVivenda["size"] = info["size"]
-        infoVivenda["rooms"] = info["rooms"]
-        infoVivenda["priceByArea"] = info["priceByArea"]
-        infoVivenda["propertyType_flat"] = info["propertyType_flat"]
-        infoVivenda["latitude"] = info["latitude"]
-        infoVivenda["coddistrit_1"] = info["coddistrit_1"]
-        infoVivenda["bathrooms"] = info["bathrooms"]
-        infoVivenda["coddistrit_2"] = info["coddistrit_2"]
-        infoVivenda["propertyType_chalet"] = info["propertyType_chalet"]
-        infoVivenda["codbar_3"] = info["codbar_3"]
-        infoVivenda["codbar_5"] = info["codbar_5"]
-        infoVivenda["hasParkingSpace"] = info["hasParkingSpace"]
+        # Para codificar lotes de viviendas sin construir un diccionario por vivienda ver IdealistaFeatureEncoder (idealistapredict.py)
+        infoVivenda = {campo: info[campo] for campo in self.campos_vivienda}
 
         return infoVivenda
\ No newline at end of file